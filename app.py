@@ -3,16 +3,52 @@
 from kinesis_tumbling_window_analytics.stacks.back_end.serverless_kinesis_producer_stack.serverless_kinesis_producer_stack import ServerlessKinesisProducerStack
 from kinesis_tumbling_window_analytics.stacks.back_end.firehose_transformation_stack.firehose_tranformation_stack import FirehoseTransformationStack
 from kinesis_tumbling_window_analytics.stacks.back_end.kinesis_tumbling_window_analytics_stack.kinesis_tumbling_window_analytics_stack import KinesisTumblingWindowAnalyticsStack
+from kinesis_tumbling_window_analytics.stacks.back_end.lambda_tumbling_window_consumer_stack.lambda_tumbling_window_consumer_stack import LambdaTumblingWindowConsumerStack
 
 from aws_cdk import core
 
 app = core.App()
 
+
+def _context_flag(name):
+    """ Boolean cdk context, -c name=true on the command line arrives as a string """
+    return str(app.node.try_get_context(name) or "").lower() in ("true", "1", "yes")
+
+
+# Extra KDA outputs, off unless set. top_k_items turns on the per store category sums, ranked downstream
+top_k_items = int(app.node.try_get_context("top_k_items") or 0)
+slide_seconds = int(app.node.try_get_context("slide_seconds") or 0)
+
+# Both consumers write the same rows to firehose, deploy one of them: kda (default) or lambda
+consumer = app.node.try_get_context("consumer") or "kda"
+
+# Firehose converts the revenue rows to parquet with the glue table schema
+parquet_output = _context_flag("parquet_output")
+
+# Event time windows, events later than the allowed lateness go to their own delivery stream
+event_time = _context_flag("event_time")
+
+# Wire format of the sales events, json (default) or csv, the consumers read both
+record_format = (app.node.try_get_context("record_format") or "json").lower()
+
+# Partial sums every this many seconds of event time instead of raw events, json only
+pre_aggregation_seconds = float(app.node.try_get_context(
+    "pre_aggregation_seconds") or 0)
+if record_format == "csv" and pre_aggregation_seconds:
+    raise ValueError(
+        "pre_aggregation_seconds needs record_format=json, a csv row has no events column "
+        "and every partial would count as one event")
+
 # Kinesis Data Producer on Lambda
 serverless_kinesis_producer_stack = ServerlessKinesisProducerStack(
     app,
     f"{app.node.try_get_context('project')}-producer-stack",
     stack_log_level="INFO",
+    shard_count=int(app.node.try_get_context("shard_count") or 1),
+    producer_concurrency=int(app.node.try_get_context(
+        "producer_concurrency") or 1),
+    pre_aggregation_seconds=pre_aggregation_seconds,
+    record_format=record_format,
     description="Miztiik Automation: Kinesis Data Producer on Lambda"
 )
 
@@ -21,19 +57,50 @@ kinesis_firehose_transformation_stack = FirehoseTransformationStack(
     app,
     f"{app.node.try_get_context('project')}-firehose-stack",
     stack_log_level="INFO",
+    dynamic_partitioning=_context_flag("dynamic_partitioning"),
+    parquet_output=parquet_output,
+    top_categories_output=bool(top_k_items) and consumer == "kda",
+    hopping_output=bool(slide_seconds) and consumer == "kda",
+    late_sales_output=event_time and consumer == "kda",
     description="Miztiik Automation: Firehose with lambda transformations"
 )
 
+# Analytics on stream of data using Kinesis Data Analytics tumbling window.
+if consumer == "kda":
+    tumbling_window_stream_analytics_stack = KinesisTumblingWindowAnalyticsStack(
+        app,
+        f"{app.node.try_get_context('project')}-consumer-stack",
+        stack_log_level="INFO",
+        src_stream=serverless_kinesis_producer_stack.get_stream,
+        dest_stream=kinesis_firehose_transformation_stack.get_fh_stream,
+        event_time=event_time,
+        allowed_lateness_seconds=int(app.node.try_get_context(
+            "allowed_lateness_seconds") or 0),
+        late_sales_stream=kinesis_firehose_transformation_stack.get_late_sales_fh_stream,
+        top_k_items=top_k_items,
+        top_categories_stream=kinesis_firehose_transformation_stack.get_top_categories_fh_stream,
+        hop_window_seconds=int(app.node.try_get_context(
+            "hop_window_seconds") or 300),
+        slide_seconds=slide_seconds,
+        hopping_stream=kinesis_firehose_transformation_stack.get_hopping_fh_stream,
+        record_format=record_format.upper(),
+        description="Miztiik Automation: Analytics on stream of data using Kinesis Data Analytics tumbling window"
+    )
 
-# Analytics on stream of data using lambda tumbling window.
-tumbling_window_stream_analytics_stack = KinesisTumblingWindowAnalyticsStack(
-    app,
-    f"{app.node.try_get_context('project')}-consumer-stack",
-    stack_log_level="INFO",
-    src_stream=serverless_kinesis_producer_stack.get_stream,
-    dest_stream=kinesis_firehose_transformation_stack.get_fh_stream,
-    description="Miztiik Automation: Analytics on stream of data using Kinesis Data Analytics tumbling window"
-)
+# Analytics on stream of data using lambda tumbling windows, no application to start by hand
+if consumer == "lambda":
+    lambda_tumbling_window_consumer_stack = LambdaTumblingWindowConsumerStack(
+        app,
+        f"{app.node.try_get_context('project')}-lambda-consumer-stack",
+        stack_log_level="INFO",
+        src_stream=serverless_kinesis_producer_stack.get_stream,
+        dest_stream=kinesis_firehose_transformation_stack.get_fh_stream,
+        batch_size=int(app.node.try_get_context("consumer_batch_size") or 1000),
+        parallelization_factor=int(app.node.try_get_context(
+            "consumer_parallelization_factor") or 1),
+        dedup_capacity=int(app.node.try_get_context("dedup_capacity") or 0),
+        description="Miztiik Automation: Analytics on stream of data using Lambda tumbling windows"
+    )
 
 
 # Stack Level Tagging
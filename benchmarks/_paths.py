@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: _paths
+    :Actions: Make the lambda sources and the shared layer importable for local runs
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BACK_END = os.path.join(
+    REPO_ROOT, "kinesis_tumbling_window_analytics", "stacks", "back_end")
+SAMPLE_RECORDS = os.path.join(REPO_ROOT, "sample_records")
+
+for _p in (
+    os.path.join(BACK_END, "lambda_layers", "stream_common", "python"),
+    os.path.join(BACK_END, "serverless_kinesis_producer_stack", "lambda_src"),
+    os.path.join(BACK_END, "firehose_transformation_stack", "lambda_src"),
+    os.path.join(BACK_END, "lambda_tumbling_window_consumer_stack", "lambda_src"),
+):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_backfill
+    :Actions: Scaling of the parallel backfill with worker processes on generated event archives
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Writes about size_mb of producer events as NDJSON, split over a few plain
+files and one gzip file, then runs the backfill with 1, 2, 4 ... workers up
+to the number of cores. Every run must produce the same rows as the single
+process run, up to float rounding, and the revenue must add up to the sales
+written. Speedup is relative to one worker, the per worker MB/s shows
+whether the workers are starved or the merge in the parent is the
+bottleneck.
+
+Usage: python benchmarks/bench_backfill.py [size_mb] [chunk_mb]
+"""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import _paths  # noqa: F401
+from stream_common import backfill
+from stream_common.load_generator import LoadGenerator
+
+START = 1612101600.0
+PLAIN_FILES = 3
+
+
+def write_archive(directory, size_mb):
+    """ Returns the total sales written, the last file is gzipped """
+    gen = LoadGenerator(seed=7, stores=50, start_time=START, events_per_s=2000)
+    per_file = size_mb * 1024 * 1024 // (PLAIN_FILES + 1)
+    total = 0.0
+    for i in range(PLAIN_FILES + 1):
+        path = os.path.join(directory, f"events-{i}.ndjson")
+        written = 0
+        with open(path, "w", encoding="utf-8") as f:
+            while written < per_file:
+                for event in gen.batch(5000):
+                    line = json.dumps(event) + "\n"
+                    f.write(line)
+                    written += len(line)
+                    total += event["sales"]
+        if i == PLAIN_FILES:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+    return total
+
+
+def _same(rows, expected):
+    """ Same windows and counts, revenue may differ in the last bits as the merge order changes """
+    if len(rows) != len(expected):
+        return False
+    for a, b in zip(rows, expected):
+        if (a["store_id"], a["timestamp"], a["records"]) != (b["store_id"], b["timestamp"], b["records"]):
+            return False
+        if abs(a["revenue"] - b["revenue"]) > 1e-6 * abs(b["revenue"]):
+            return False
+    return True
+
+
+def _worker_counts():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= max(cores, 2):
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    chunk_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 8
+    directory = tempfile.mkdtemp(prefix="bench_backfill_")
+    try:
+        total_sales = write_archive(directory, size_mb)
+        results = []
+        baseline = None
+        for workers in _worker_counts():
+            sums, report = backfill.run([directory], 60, workers, chunk_mb)
+            rows = list(backfill.format_backfill_rows(sums))
+            if baseline is None:
+                baseline = (rows, report["seconds"])
+                revenue = sum(value for value, _ in sums.values())
+                assert abs(revenue - total_sales) < 1e-6 * total_sales, (revenue, total_sales)
+            else:
+                assert _same(rows, baseline[0]), workers
+            busy = [w["mb_per_s"] for w in report["per_worker"]]
+            results.append({
+                "workers": workers,
+                "chunks": report["chunks"],
+                "seconds": report["seconds"],
+                "mb_per_s": report["mb_per_s"],
+                "speedup": round(baseline[1] / report["seconds"], 2),
+                "worker_mb_per_s_min": min(busy),
+                "worker_mb_per_s_max": max(busy),
+            })
+        print(json.dumps({"size_mb": size_mb, "chunk_mb": chunk_mb, "cores": os.cpu_count(),
+                          "lines": report["lines"], "windows": len(baseline[0]),
+                          "results": results}, indent=2))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
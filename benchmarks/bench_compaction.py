@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_compaction
+    :Actions: Reader scan time over the small firehose objects before and after compaction
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Writes days of firehose output, one object a minute with a row per store,
+named and laid out like the delivery stream writes them, to a local
+directory and to a stand-in S3 client with a fixed latency per request.
+A reader lists and parses every row, and then every row of one hour,
+before compaction and from the compacted files through the index.
+
+Compaction must keep every row, write them in timestamp order, write the
+same bytes when the sorting spills to disk, and do nothing when re-run.
+With --delete-sources the index is written once a run and forgets the
+deleted sources on the next one.
+
+Usage: python benchmarks/bench_compaction.py [days] [stores] [s3_latency_ms]
+"""
+
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import _paths  # noqa: F401
+from fakes import StubS3Client
+from stream_common import compaction
+from stream_common.tumbling_window import format_timestamp
+
+START_MS = 1612051200000
+SOURCE_PREFIX = "sales_revenue/"
+HOUR = ("2021-01-31 14:00:00.000", "2021-01-31 15:00:00.000")
+
+
+def firehose_objects(days, stores, seed=7):
+    """ {key: bytes} a minute of rows per object, arriving in store order shuffled """
+    rnd = random.Random(seed)
+    objects = {}
+    for minute in range(days * 24 * 60):
+        window_end = START_MS + (minute + 1) * 60000
+        ts = format_timestamp(window_end)
+        rows = [{"store_id": f"store_{s}", "revenue": round(rnd.random() * 10000, 4), "timestamp": ts}
+                for s in range(1, stores + 1)]
+        rnd.shuffle(rows)
+        # Delivered a few seconds after the window closed
+        delivered = datetime.datetime.utcfromtimestamp(window_end / 1000 + rnd.randrange(2, 9))
+        uid = uuid.UUID(int=rnd.getrandbits(128))
+        key = (f"{SOURCE_PREFIX}{delivered:%Y/%m/%d/%H}/"
+               f"revenue_analytics_stream-1-{delivered:%Y-%m-%d-%H-%M-%S}-{uid}")
+        objects[key] = "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+    return objects
+
+
+def scan_small(store, start=None, end=None):
+    """ What a reader does without compaction, list the prefix and read every object """
+    rows = 0
+    for key, _ in store.list(SOURCE_PREFIX):
+        for line in compaction.iter_lines(store.open(key)):
+            row = json.loads(line)
+            if (start is None or row["timestamp"] >= start) and (end is None or row["timestamp"] < end):
+                rows += 1
+    return rows
+
+
+def scan_compacted(store, start=None, end=None):
+    rows = 0
+    for line in compaction.scan(store, start=start, end=end):
+        json.loads(line)
+        rows += 1
+    return rows
+
+
+def _timed(fn, *args, **kwargs):
+    _t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, round(time.perf_counter() - _t, 3)
+
+
+def check(store, objects):
+    index = compaction.load_index(store)
+    lines = list(compaction.scan(store, index=index))
+    assert sorted(lines) == sorted(l for data in objects.values() for l in data.splitlines())
+    stamps = [compaction.sort_key(l)[0] for l in lines]
+    assert stamps == sorted(stamps)
+    for entry in index["files"]:
+        part = list(compaction.iter_lines(store.open(entry["key"]), gzipped=True))
+        assert entry["rows"] == len(part)
+        assert entry["min_timestamp"].encode() == compaction.sort_key(part[0])[0]
+        assert entry["max_timestamp"].encode() == compaction.sort_key(part[-1])[0]
+    return index
+
+
+def bench(name, store, objects, stores):
+    before_full, before_full_s = _timed(scan_small, store)
+    before_hour, before_hour_s = _timed(scan_small, store, *HOUR)
+    summary, compact_s = _timed(compaction.compact, store, SOURCE_PREFIX, min_objects=1)
+    index = check(store, objects)
+    again = compaction.compact(store, SOURCE_PREFIX, min_objects=1)
+    assert again["groups"] == 0, again
+    after_full, after_full_s = _timed(scan_compacted, store)
+    after_hour, after_hour_s = _timed(scan_compacted, store, *HOUR)
+    assert before_full == after_full == len(objects) * stores
+    assert before_hour == after_hour == 60 * stores, (before_hour, after_hour)
+    return {
+        "store": name,
+        "objects": len(objects),
+        "compacted_files": len(index["files"]),
+        "compacted_mb": round(sum(f["compressed_bytes"] for f in index["files"]) / 1024 / 1024, 3),
+        "compact_seconds": compact_s,
+        "full_scan_seconds": {"before": before_full_s, "after": after_full_s,
+                              "speedup": round(before_full_s / max(after_full_s, 1e-6), 1)},
+        "hour_scan_seconds": {"before": before_hour_s, "after": after_hour_s,
+                              "speedup": round(before_hour_s / max(after_hour_s, 1e-6), 1)},
+    }
+
+
+def spill_matches(objects):
+    """ A max_rows far below the group size spills runs to disk, the parts must not change """
+    outputs = []
+    for max_rows in (compaction.DEFAULT_MAX_ROWS, 1000):
+        s3 = StubS3Client()
+        s3.objects.update(objects)
+        compaction.compact(compaction.S3Store(s3, "bucket"), SOURCE_PREFIX, max_rows=max_rows, min_objects=1)
+        outputs.append({k: v for k, v in s3.objects.items() if k.startswith(compaction.DEFAULT_DEST_PREFIX)})
+    return outputs[0] == outputs[1]
+
+
+class _IndexCountingS3Client(StubS3Client):
+    """ StubS3Client counting the writes of the compaction index """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index_puts = 0
+
+    def put_object(self, Bucket, Key, Body):
+        if Key.endswith(compaction.INDEX_NAME):
+            self.index_puts += 1
+        return super().put_object(Bucket, Key, Body)
+
+
+def check_delete_sources(objects):
+    """ One index write a run, deleted sources leave the index on the next run, the rows stay """
+    s3 = _IndexCountingS3Client()
+    s3.objects.update(objects)
+    store = compaction.S3Store(s3, "bucket")
+    first = compaction.compact(store, SOURCE_PREFIX, delete_sources=True, min_objects=1)
+    assert first["groups"] > 1 and s3.index_puts == 1, (first, s3.index_puts)
+    assert not any(k.startswith(SOURCE_PREFIX) for k in s3.objects), "sources left behind"
+    assert len(compaction.load_index(store)["sources"]) == len(objects)
+    second = compaction.compact(store, SOURCE_PREFIX, delete_sources=True, min_objects=1)
+    assert second["forgotten_sources"] == len(objects) and s3.index_puts == 2, (second, s3.index_puts)
+    assert compaction.load_index(store)["sources"] == {}
+    compaction.compact(store, SOURCE_PREFIX, delete_sources=True, min_objects=1)
+    assert s3.index_puts == 2, "a run with nothing to do rewrote the index"
+    check(store, objects)
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    stores = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+    objects = firehose_objects(days, stores)
+
+    results = []
+    directory = tempfile.mkdtemp(prefix="bench_compaction_")
+    try:
+        for key, data in objects.items():
+            path = os.path.join(directory, *key.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        results.append(bench("local", compaction.LocalStore(directory), objects, stores))
+    finally:
+        shutil.rmtree(directory)
+
+    s3 = StubS3Client(request_latency_s=latency_ms / 1000)
+    s3.objects.update(objects)
+    results.append(bench(f"s3_stub_{latency_ms:g}ms", compaction.S3Store(s3, "bucket"), objects, stores))
+    assert spill_matches(objects)
+    check_delete_sources(objects)
+    print(json.dumps({"days": days, "stores": stores, "rows": len(objects) * stores,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_dedup
+    :Actions: False positive rate, memory and throughput cost of dropping replayed event ids
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Generates events with event ids at each rate and replays a dup_ratio share
+of them up to 2 seconds later, like a producer retry after a partial
+PutRecords failure. The Bloom filters are sized for rate * window events
+per partition. Reported per rate and error rate,
+
+    false positive rate     unique events dropped / unique events
+    missed duplicates       replays that were counted, must be 0
+    revenue error           revenue lost to false positives, relative to the true revenue
+    memory                  the filters at most, next to a set of the ids of the same horizon
+    throughput              events/s through the tumbling window with and without dedup, and the
+                            microseconds dedup adds per event
+
+Usage: python benchmarks/bench_dedup.py [duration_s] [dup_ratio]
+"""
+
+import heapq
+import json
+import random
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common.dedup import BloomFilter, Deduplicator
+from stream_common.load_generator import LoadGenerator
+from stream_common.tumbling_window import parse_evnt_time, run
+
+START = 1612101600.0
+WINDOW_SECONDS = 60
+RATES = [1000, 5000]
+ERROR_RATES = [0.01, 0.001]
+MAX_RETRY_DELAY_S = 2
+
+
+def with_replays(events, rate, dup_ratio, seed=7):
+    """ The events with a dup_ratio share repeated up to MAX_RETRY_DELAY_S later, replays flagged """
+    rnd = random.Random(seed)
+    pending = []
+    out = []
+    for i, event in enumerate(events):
+        while pending and pending[0][0] <= i:
+            out.append((True, heapq.heappop(pending)[2]))
+        out.append((False, event))
+        if rnd.random() < dup_ratio:
+            heapq.heappush(pending, (i + int(rnd.uniform(0, MAX_RETRY_DELAY_S) * rate), i, event))
+    out.extend((True, e) for _, _, e in sorted(pending))
+    return out
+
+
+def _set_bytes(ids):
+    return sys.getsizeof(set(ids)) + sum(sys.getsizeof(i) for i in ids)
+
+
+def _throughput(events, dedup=None):
+    _t = time.perf_counter()
+    rows = list(run(iter(events), WINDOW_SECONDS, dedup=dedup))
+    return len(events) / (time.perf_counter() - _t), rows
+
+
+def bench(rate, duration_s, dup_ratio, error_rate):
+    events = LoadGenerator(seed=7, stores=20, start_time=START, events_per_s=rate,
+                           event_ids=True, jitter_ms=500).batch(int(rate * duration_s))
+    stream = with_replays(events, rate, dup_ratio)
+    capacity = rate * WINDOW_SECONDS
+    dedup = Deduplicator(WINDOW_SECONDS, WINDOW_SECONDS, capacity, error_rate)
+    # Classify event by event, the window engine only sees what the filter keeps
+    false_positives = 0
+    missed = 0
+    kept_sales = 0.0
+    for replay, event in stream:
+        dropped = dedup.seen(event["event_id"], parse_evnt_time(event["evnt_time"]))
+        if dropped and not replay:
+            false_positives += 1
+        elif not dropped and replay:
+            missed += 1
+        if not dropped:
+            kept_sales += event["sales"]
+    true_sales = sum(e["sales"] for e in events)
+    replays = len(stream) - len(events)
+
+    plain_eps, _ = _throughput([e for _, e in stream])
+    dedup_eps, rows = _throughput([e for _, e in stream],
+                                  Deduplicator(WINDOW_SECONDS, WINDOW_SECONDS, capacity, error_rate))
+    assert missed == 0, missed
+    assert abs(sum(r["revenue"] for r in rows) - kept_sales) < 1e-4 * true_sales
+    horizon_ids = [e["event_id"] for e in events[:capacity]]
+    return {
+        "events_per_s": rate,
+        "error_rate": error_rate,
+        "events": len(events),
+        "replays": replays,
+        "false_positive_rate": round(false_positives / len(events), 5),
+        "missed_duplicates": missed,
+        "revenue_error": round((true_sales - kept_sales) / true_sales, 6),
+        "filter_kb": round(dedup.memory_bytes() / 1024, 1),
+        "exact_set_kb": round(_set_bytes(horizon_ids) * dedup.max_partitions() / 1024, 1),
+        "lambda_state_kb": round(len(BloomFilter(capacity, error_rate).to_base64()) / 1024, 1),
+        "throughput_events_per_s": {"plain": round(plain_eps), "dedup": round(dedup_eps),
+                                    "cost_us_per_event": round(1e6 / dedup_eps - 1e6 / plain_eps, 2)},
+    }
+
+
+def main():
+    duration_s = float(sys.argv[1]) if len(sys.argv) > 1 else 180
+    dup_ratio = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    results = [bench(rate, duration_s, dup_ratio, error_rate)
+               for rate in RATES for error_rate in ERROR_RATES]
+    print(json.dumps({"duration_s": duration_s, "dup_ratio": dup_ratio,
+                      "window_seconds": WINDOW_SECONDS, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
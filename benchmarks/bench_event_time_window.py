@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_event_time_window
+    :Actions: Throughput and memory of event time windows across lateness settings
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Usage: python benchmarks/bench_event_time_window.py [num_events] [max_disorder_seconds]
+"""
+
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import _paths  # noqa: F401
+from stream_common import tumbling_window
+
+# (watermark delay, allowed lateness) in seconds
+SETTINGS = [(0, 0), (5, 0), (5, 30), (30, 60), (30, 300), (60, 900)]
+
+
+def _rows(n, num_stores, max_disorder_s, events_per_s=2000, seed=7):
+    """ Arrival ordered rows whose event time lags arrival by up to max_disorder_s """
+    rnd = random.Random(seed)
+    start = 1612101900000
+    step_ms = 1000 / events_per_s
+    disorder_ms = int(max_disorder_s * 1000)
+    return [
+        (int(start + i * step_ms) - rnd.randint(0, disorder_ms),
+         f"store_{rnd.randint(1, num_stores)}", 1.0)
+        for i in range(n)
+    ]
+
+
+def _run(rows, delay_s, lateness_s, measure_memory):
+    late = [0]
+    emitted = 0
+
+    def _count_late(row):
+        late[0] += 1
+
+    if measure_memory:
+        tracemalloc.start()
+    _t = time.perf_counter()
+    for _ in tumbling_window.event_time_window(rows, 60, delay_s, lateness_s, _count_late):
+        emitted += 1
+    elapsed = time.perf_counter() - _t
+    peak = None
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, emitted, late[0], peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    max_disorder_s = float(sys.argv[2]) if len(sys.argv) > 2 else 120
+    rows = _rows(n, 50, max_disorder_s)
+    results = []
+    for delay_s, lateness_s in SETTINGS:
+        elapsed, emitted, late, _ = _run(rows, delay_s, lateness_s, False)
+        # tracemalloc slows the loop down, measure memory in a separate pass
+        _, _, _, peak = _run(rows, delay_s, lateness_s, True)
+        results.append({
+            "watermark_delay_s": delay_s,
+            "allowed_lateness_s": lateness_s,
+            "rows_per_s": round(n / elapsed),
+            "window_emits": emitted,
+            "late_side_output": late,
+            "late_ratio": round(late / n, 4),
+            "peak_state_bytes": peak,
+        })
+    print(json.dumps({
+        "events": n,
+        "max_disorder_s": max_disorder_s,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_firehose_transformer
+    :Actions: Records/s and peak RSS of the firehose transformer on synthetic 6MB batches
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Each mode runs in its own process so peak RSS is not shared between them.
+
+Usage: python benchmarks/bench_firehose_transformer.py [batches] [batch_mb]
+"""
+
+import base64
+import json
+import logging
+import resource
+import subprocess
+import sys
+import time
+
+import _paths  # noqa: F401
+import kinesis_firehose_transformer as transformer
+
+
+def make_batch(batch_bytes=6 * 1024 * 1024, seed=0):
+    """ Firehose transformation event holding ~batch_bytes of base64 KDA output rows """
+    records = []
+    size = 0
+    i = seed
+    while size < batch_bytes:
+        row = json.dumps({
+            "store_id": f"store_{i % 5 + 1}",
+            "revenue": 8671.3125 + i,
+            "timestamp": "2021-01-31 14:47:00.000"
+        }, separators=(",", ":"))
+        data = base64.b64encode(row.encode("utf-8")).decode("utf-8")
+        records.append({
+            "recordId": f"49546986683135544286507457936321625675700192471156785154{i:010d}",
+            "approximateArrivalTimestamp": 1612104420000,
+            "data": data
+        })
+        size += len(data) + 100
+        i += 1
+    return {
+        "invocationId": "invocationIdExample",
+        "deliveryStreamArn": "arn:aws:kinesis:EXAMPLE",
+        "region": "us-east-1",
+        "records": records
+    }
+
+
+def legacy_handler(event, context):
+    """ The original two-pass transformer, kept as the baseline """
+    src_records = []
+    for record in event["records"]:
+        payload = base64.b64decode(record["data"]).decode("utf-8")
+        src_records.append({
+            "recordId": record["recordId"],
+            "event": dict(json.loads(payload))
+        })
+    output = []
+    for record in src_records:
+        trans_payload = json.dumps(dict(record["event"])) + "\n"
+        output.append({
+            "recordId": record["recordId"],
+            "result": "Ok",
+            "data": base64.b64encode(trans_payload.encode("utf-8")).decode("utf-8")
+        })
+    return {"records": output}
+
+
+def run_mode(mode, batches, batch_mb):
+    logging.getLogger().setLevel(logging.WARNING)
+    transformer.GlobalArgs.METRICS_ENABLED = False
+    handler = legacy_handler if mode == "legacy" else transformer.lambda_handler
+    events = [make_batch(int(batch_mb * 1024 * 1024), seed=b * 100000)
+              for b in range(batches)]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    records = 0
+    _t = time.perf_counter()
+    for event in events:
+        records += len(handler(event, None)["records"])
+    elapsed = time.perf_counter() - _t
+    return {
+        "mode": mode,
+        "records": records,
+        "records_per_s": round(records / elapsed),
+        "mb_per_s": round(batches * batch_mb / elapsed, 1),
+        # ru_maxrss is KB on linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "handler_rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--mode":
+        print(json.dumps(run_mode(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))))
+        return
+    batches = sys.argv[1] if len(sys.argv) > 1 else "5"
+    batch_mb = sys.argv[2] if len(sys.argv) > 2 else "6"
+    results = []
+    for mode in ("legacy", "fast"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, batches, batch_mb],
+            check=True, stdout=subprocess.PIPE
+        ).stdout
+        results.append(json.loads(out))
+    print(json.dumps({"batches": int(batches), "batch_mb": float(batch_mb), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
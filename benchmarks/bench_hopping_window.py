@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_hopping_window
+    :Actions: Pane based hopping windows against recomputing every overlapping window
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Three ways to report the last window_seconds of revenue per store every
+slide_seconds,
+
+    naive     re-sum the raw rows of every window, each row is read window / slide times
+    panes     sum rows once per pane, re-add the panes of every window
+    hopping   tumbling_window.hopping_window, add the new pane and subtract the evicted one
+
+All three must agree. The hopping cost per row should stay flat as the
+window / slide ratio grows, the others grow with it.
+
+Usage: python benchmarks/bench_hopping_window.py [events] [window_seconds]
+"""
+
+import collections
+import json
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common.load_generator import LoadGenerator
+from stream_common.tumbling_window import hopping_window, to_rows
+
+START = 1612101600.0
+SLIDES = [60, 10, 5, 1]
+
+
+def naive(rows, window_seconds, slide_seconds):
+    """ Keep the raw rows of the window and sum all of them at every slide """
+    window_ms = int(window_seconds * 1000)
+    slide_ms = int(slide_seconds * 1000)
+    buffered = collections.deque()
+    end = None
+
+    def _emit(end):
+        while buffered and buffered[0][0] < end - window_ms:
+            buffered.popleft()
+        sums = {}
+        for _, key, value in buffered:
+            sums[key] = sums.get(key, 0.0) + value
+        return end, sums
+
+    for row in rows:
+        ts = row[0]
+        if end is None:
+            end = ts - ts % slide_ms + slide_ms
+        while ts >= end:
+            yield _emit(end)
+            end += slide_ms
+        buffered.append(row)
+    while buffered and end - window_ms <= buffered[-1][0]:
+        yield _emit(end)
+        end += slide_ms
+
+
+def panes(rows, window_seconds, slide_seconds):
+    """ Sum rows once per pane, then add up the panes of every window from scratch """
+    window_ms = int(window_seconds * 1000)
+    slide_ms = int(slide_seconds * 1000)
+    closed = collections.deque(maxlen=window_ms // slide_ms)
+    pane = {}
+    end = None
+
+    def _emit(end):
+        sums = {}
+        for p in closed:
+            for key, value in p.items():
+                sums[key] = sums.get(key, 0.0) + value
+        return end, sums
+
+    for ts, key, value in rows:
+        if end is None:
+            end = ts - ts % slide_ms + slide_ms
+        while ts >= end:
+            closed.append(pane)
+            pane = {}
+            yield _emit(end)
+            end += slide_ms
+        pane[key] = pane.get(key, 0.0) + value
+    for _ in range(window_ms // slide_ms):
+        closed.append(pane)
+        pane = {}
+        yield _emit(end)
+        end += slide_ms
+
+
+def _non_empty(windows):
+    return [(end, sums) for end, sums in windows if sums]
+
+
+def _same(a, b):
+    if [end for end, _ in a] != [end for end, _ in b]:
+        return False
+    for (_, x), (_, y) in zip(a, b):
+        if x.keys() != y.keys() or any(abs(x[k] - y[k]) > 1e-6 * max(1.0, abs(y[k])) for k in x):
+            return False
+    return True
+
+
+def _timed(fn, rows, window_seconds, slide_seconds):
+    _t = time.perf_counter()
+    windows = _non_empty(fn(iter(rows), window_seconds, slide_seconds))
+    return windows, time.perf_counter() - _t
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    window_seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    # Ten minutes of traffic over 100 stores
+    events = LoadGenerator(seed=7, stores=100, start_time=START,
+                           events_per_s=n / 600).batch(n)
+    rows = list(to_rows(events))
+    results = []
+    for slide in SLIDES:
+        if window_seconds % slide:
+            continue
+        timings = {}
+        outputs = {}
+        for name, fn in (("naive", naive), ("panes", panes), ("hopping", hopping_window)):
+            outputs[name], seconds = _timed(fn, rows, window_seconds, slide)
+            timings[name] = seconds
+        assert _same(outputs["hopping"], outputs["naive"]), slide
+        assert _same(outputs["panes"], outputs["naive"]), slide
+        results.append({
+            "slide_seconds": slide,
+            "window_over_slide": window_seconds // slide,
+            "windows": len(outputs["hopping"]),
+            **{f"{name}_rows_per_s": round(n / s) for name, s in timings.items()},
+            "hopping_speedup_over_naive": round(timings["naive"] / timings["hopping"], 1),
+        })
+    print(json.dumps({"events": n, "window_seconds": window_seconds,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_hyperloglog
+    :Actions: Error, memory and throughput of the HyperLogLog distinct counts against exact sets
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+For every precision and cardinality the sketch estimate is compared to the
+true count, over several seeds. Memory is the tracemalloc peak of one exact
+set and of one sketch fed the same values, the sketch stays at 2**p bytes.
+
+The rollup check splits the values over 60 minute sketches with overlap,
+merges them from their base64 form and compares the result with the exact
+union, the hourly count the minute rows can answer without the raw events.
+
+Usage: python benchmarks/bench_hyperloglog.py [max_cardinality] [seeds]
+"""
+
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+import _paths  # noqa: F401
+from stream_common.hyperloglog import HyperLogLog
+
+PRECISIONS = [10, 12, 14]
+CARDINALITIES = [100, 1000, 10000, 100000, 1000000]
+
+
+def _values(n, seed):
+    return [f"customer_{seed}_{i}" for i in range(n)]
+
+
+def _peak(fn, values):
+    tracemalloc.start()
+    try:
+        result = fn(values)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _sketch(p):
+    def _run(values):
+        hll = HyperLogLog(p)
+        for value in values:
+            hll.add(value)
+        return hll
+    return _run
+
+
+def accuracy(p, n, seeds):
+    errors = []
+    elapsed = 0.0
+    for seed in range(seeds):
+        values = _values(n, seed)
+        _t = time.perf_counter()
+        hll = _sketch(p)(values)
+        elapsed += time.perf_counter() - _t
+        errors.append(hll.count() / n - 1)
+    values = _values(n, 0)
+    exact, exact_peak = _peak(set, values)
+    _, sketch_peak = _peak(_sketch(p), values)
+    return {
+        "precision": p,
+        "cardinality": n,
+        "expected_std_error": round(1.04 / math.sqrt(1 << p), 4),
+        "mean_abs_error": round(sum(abs(e) for e in errors) / len(errors), 4),
+        "max_abs_error": round(max(abs(e) for e in errors), 4),
+        "adds_per_s": round(n * seeds / elapsed),
+        "exact_set_kb": round(exact_peak / 1024, 1),
+        "sketch_kb": round(sketch_peak / 1024, 1),
+    }
+
+
+def rollup(p, customers, minutes=60, per_minute=2000, seed=7):
+    """ Minute sketches of a shared customer base, merged into the hour """
+    rnd = random.Random(seed)
+    hour = HyperLogLog(p)
+    seen = set()
+    minute_errors = []
+    for _ in range(minutes):
+        minute = HyperLogLog(p)
+        values = {f"customer_{rnd.randrange(customers)}" for _ in range(per_minute)}
+        for value in values:
+            minute.add(value)
+        minute_errors.append(abs(minute.count() / len(values) - 1))
+        seen |= values
+        hour.merge(HyperLogLog.from_base64(minute.to_base64()))
+    return {
+        "precision": p,
+        "minutes": minutes,
+        "exact_hourly": len(seen),
+        "merged_hourly": round(hour.count()),
+        "hourly_error": round(hour.count() / len(seen) - 1, 4),
+        "mean_minute_error": round(sum(minute_errors) / minutes, 4),
+        "naive_sum_of_minutes_error": round(minutes * per_minute / len(seen) - 1, 2),
+    }
+
+
+def main():
+    max_cardinality = int(sys.argv[1]) if len(sys.argv) > 1 else CARDINALITIES[-1]
+    seeds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    results = [accuracy(p, n, seeds) for p in PRECISIONS
+               for n in CARDINALITIES if n <= max_cardinality]
+    for result in results:
+        # Well within four standard errors, the bound the sketch is sized by
+        assert result["max_abs_error"] < 4 * result["expected_std_error"], result
+    rollups = [rollup(p, customers=50000) for p in PRECISIONS]
+    print(json.dumps({"seeds": seeds, "results": results, "rollup": rollups}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
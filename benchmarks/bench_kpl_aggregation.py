@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_kpl_aggregation
+    :Actions: Check the KPL round trip against the reference fixture and measure packing
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Usage: python benchmarks/bench_kpl_aggregation.py [num_records] [max_bytes]
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+
+import _paths
+from stream_common import kpl_aggregation
+import kinesis_firehose_transformer as transformer
+
+
+def check_reference_fixture():
+    """ Our encoder must produce the reference bytes and the decoder must read them back """
+    with open(os.path.join(_paths.SAMPLE_RECORDS, "kpl_aggregated_record.json")) as f:
+        fixture = json.load(f)
+    blob = base64.b64decode(fixture["data"])
+    expected = [(r["partition_key"], r["data"].encode("utf-8"))
+                for r in fixture["user_records"]]
+
+    decoded = [(r.partition_key, r.data)
+               for r in kpl_aggregation.deaggregate(blob)]
+    assert decoded == expected, decoded
+    encoded = list(kpl_aggregation.aggregate(expected))
+    assert len(encoded) == 1 and encoded[0].data == blob, encoded
+    assert encoded[0].partition_key == fixture["partition_key"]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    max_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else kpl_aggregation.DEFAULT_MAX_BYTES
+    transformer.GlobalArgs.METRICS_ENABLED = False
+    check_reference_fixture()
+
+    with open(os.path.join(_paths.SAMPLE_RECORDS, "producer_event.json")) as f:
+        event = json.load(f)
+    user_records = [
+        (f"store_{i % 5 + 1}", json.dumps(dict(event, sales=i / 100)))
+        for i in range(n)
+    ]
+    user_bytes = sum(len(d) + len(k) for k, d in user_records)
+
+    _t = time.perf_counter()
+    aggregated = list(kpl_aggregation.aggregate(user_records, max_bytes))
+    agg_s = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    unpacked = sum(len(kpl_aggregation.deaggregate(a.data))
+                   for a in aggregated)
+    deagg_s = time.perf_counter() - _t
+    assert unpacked == n
+
+    # Firehose hands the transformer one aggregated record per recordId
+    fh_event = {"records": [
+        {"recordId": str(i), "data": base64.b64encode(a.data).decode("utf-8")}
+        for i, a in enumerate(aggregated)
+    ]}
+    out = transformer.lambda_handler(fh_event, None)
+    lines = sum(base64.b64decode(r["data"]).count(b"\n")
+                for r in out["records"])
+    assert lines == n
+
+    print(json.dumps({
+        "reference_fixture": "ok",
+        "user_records": n,
+        "user_bytes": user_bytes,
+        "kinesis_records": len(aggregated),
+        "kinesis_bytes": sum(len(a.data) + len(a.partition_key) for a in aggregated),
+        "user_records_per_kinesis_record": round(n / len(aggregated), 1),
+        "aggregate_records_per_s": round(n / agg_s),
+        "deaggregate_records_per_s": round(n / deagg_s),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
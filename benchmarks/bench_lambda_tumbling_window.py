@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_lambda_tumbling_window
+    :Actions: Replay a stream through the lambda tumbling window consumer and check it against the SQL rows
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Events get virtual arrival times and are spread over shards. Like the
+kinesis event source, every shard's records are cut into windows by arrival
+time and into batches of batch_size, each batch is one invocation carrying
+the state returned by the previous one, and an empty final invocation
+closes the window. Events and state go through JSON on the way in and out,
+as they do in lambda.
+
+The firehose rows, summed per store and timestamp, must match the rows of
+the local STREAM_PUMP equivalent, tumbling_window.run in arrival order.
+With one shard they are identical. Throughput and state size are reported
+per batch size, to pick the event source batch size.
+
+Usage: python benchmarks/bench_lambda_tumbling_window.py [events] [events_per_s]
+"""
+
+import base64
+import collections
+import contextlib
+import datetime
+import json
+import os
+import sys
+import time
+
+import _paths  # noqa: F401
+import tumbling_window_consumer as consumer
+from fakes import StubFirehoseClient
+from stream_common.kpl_aggregation import aggregate, deaggregate
+from stream_common.load_generator import LoadGenerator
+from stream_common.tumbling_window import as_real, format_rows, tumbling_window
+
+START = 1612101600.0
+WINDOW_SECONDS = 60
+BATCH_SIZES = [100, 1000, 10000]
+KPL_EVENTS_PER_RECORD = 50
+
+
+def _iso(epoch_ms):
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=epoch_ms)
+            ).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def kinesis_records(events, events_per_s, shards, kpl=False):
+    """ [(arrival_ms, shard, record)] with the records spread round robin over shards """
+    payloads = [json.dumps(e).encode("utf-8") for e in events]
+    out = []
+    if kpl:
+        groups = [payloads[i:i + KPL_EVENTS_PER_RECORD]
+                  for i in range(0, len(payloads), KPL_EVENTS_PER_RECORD)]
+        datas = [next(aggregate(("pk", p) for p in group)).data for group in groups]
+        # An aggregate arrives when its last event was produced
+        arrivals = [int((START + min(i + KPL_EVENTS_PER_RECORD, len(payloads)) / events_per_s) * 1000)
+                    for i in range(0, len(payloads), KPL_EVENTS_PER_RECORD)]
+    else:
+        datas = payloads
+        arrivals = [int((START + (i + 1) / events_per_s) * 1000) for i in range(len(payloads))]
+    for i, (data, arrival) in enumerate(zip(datas, arrivals)):
+        record = {"kinesis": {
+            "data": base64.b64encode(data).decode("ascii"),
+            "sequenceNumber": str(i),
+            "approximateArrivalTimestamp": arrival / 1000,
+        }}
+        out.append((arrival, i % shards, record))
+    return out
+
+
+def invocations(records, batch_size, window_seconds=WINDOW_SECONDS):
+    """ Yield (shard, lambda event without state) per batch and a final event per window """
+    window_ms = window_seconds * 1000
+    by_shard = collections.defaultdict(list)
+    for arrival, shard, record in records:
+        by_shard[shard].append((arrival, record))
+    for shard, shard_records in sorted(by_shard.items()):
+        windows = collections.OrderedDict()
+        for arrival, record in shard_records:
+            windows.setdefault(arrival - arrival % window_ms, []).append(record)
+        for start, window_records in windows.items():
+            window = {"start": _iso(start), "end": _iso(start + window_ms)}
+            base = {"window": window, "shardId": f"shardId-{shard:012d}",
+                    "eventSourceARN": "arn:aws:kinesis:us-east-1:123456789012:stream/data_pipe",
+                    "isWindowTerminatedEarly": False}
+            for i in range(0, len(window_records), batch_size):
+                yield shard, dict(base, Records=window_records[i:i + batch_size],
+                                  isFinalInvokeFromWindow=False)
+            yield shard, dict(base, Records=[], isFinalInvokeFromWindow=True)
+
+
+def replay(records, batch_size):
+    """ Run every invocation through the handler, returns (firehose rows, invocations, state bytes) """
+    fh_client = StubFirehoseClient()
+    consumer.client = fh_client
+    states = {}
+    calls = 0
+    state_bytes = []
+    for shard, event in invocations(records, batch_size):
+        event["state"] = states.get(shard, {})
+        # Lambda hands the event over, and takes the result back, as JSON
+        result = json.loads(json.dumps(consumer.lambda_handler(json.loads(json.dumps(event)), None)))
+        states[shard] = result["state"]
+        state_bytes.append(len(json.dumps(result["state"])))
+        calls += 1
+    return [json.loads(r) for r in fh_client.records], calls, state_bytes
+
+
+def sql_rows(records):
+    """ The local STREAM_PUMP, one window over all shards in arrival order """
+    rows = []
+    for arrival, _, record in sorted(records, key=lambda r: (r[0], int(r[2]["kinesis"]["sequenceNumber"]))):
+        data = base64.b64decode(record["kinesis"]["data"])
+        for user_record in deaggregate(data):
+            event = json.loads(user_record.data)
+            rows.append((arrival, event["store_id"], event["sales"]))
+    return list(format_rows(tumbling_window(iter(rows), WINDOW_SECONDS)))
+
+
+def check(lambda_rows, expected, exact):
+    totals = collections.defaultdict(float)
+    for row in lambda_rows:
+        totals[(row["store_id"], row["timestamp"])] += row["revenue"]
+    want = {(row["store_id"], row["timestamp"]): row["revenue"] for row in expected}
+    assert totals.keys() == want.keys(), sorted(set(totals) ^ set(want))[:5]
+    worst = 0.0
+    for key, revenue in want.items():
+        got = as_real(totals[key])
+        if exact:
+            assert got == revenue, (key, got, revenue)
+        worst = max(worst, abs(got - revenue) / max(1.0, abs(revenue)))
+    # Partial rows are rounded to REAL before they are added up
+    assert worst < 1e-5, worst
+    return worst
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    events_per_s = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    consumer.GlobalArgs.METRICS_ENABLED = False
+    consumer.logger.setLevel("WARNING")
+    events = LoadGenerator(seed=7, stores=20, start_time=START).batch(n)
+
+    results = []
+    for shards, kpl in ((1, False), (4, False), (2, True)):
+        records = kinesis_records(events, events_per_s, shards, kpl)
+        expected = sql_rows(records)
+        for batch_size in BATCH_SIZES:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                _t = time.perf_counter()
+                rows, calls, state_bytes = replay(records, batch_size)
+                seconds = time.perf_counter() - _t
+            worst = check(rows, expected, exact=shards == 1)
+            results.append({
+                "shards": shards,
+                "kpl_aggregated": kpl,
+                "batch_size": batch_size,
+                "invocations": calls,
+                "events_per_s": round(n / seconds),
+                "max_state_bytes": max(state_bytes),
+                "firehose_rows": len(rows),
+                "sql_rows": len(expected),
+                "max_relative_error": worst,
+            })
+    print(json.dumps({"events": n, "events_per_s": events_per_s,
+                      "window_seconds": WINDOW_SECONDS, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
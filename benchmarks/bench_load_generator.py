@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_load_generator
+    :Actions: Events/s, reproducibility and key skew of the synthetic load generator
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+"inline" is the previous per-event generation in the producer loop, one
+random call per field and a datetime.now().isoformat() per event.
+
+Usage: python benchmarks/bench_load_generator.py [events]
+"""
+
+import collections
+import datetime
+import json
+import random
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common.load_generator import LoadGenerator
+from stream_common.tumbling_window import parse_evnt_time
+
+START = 1612101600.0
+
+
+def inline_events(n):
+    categories = ["Books", "Electronics"]
+    for _ in range(n):
+        yield {
+            "category": random.choice(categories),
+            "store_id": f"store_{random.randint(1, 5)}",
+            "evnt_time": datetime.datetime.now().isoformat(),
+            "sales": round(random.random() * 100, 2)
+        }
+
+
+def _rate(events, n):
+    _t = time.perf_counter()
+    for _ in events:
+        pass
+    return round(n / (time.perf_counter() - _t))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    first = LoadGenerator(seed=7, start_time=START).batch(1000)
+    again = LoadGenerator(seed=7, start_time=START).batch(1000)
+    assert first == again, "same seed and start_time must repeat"
+
+    skewed = LoadGenerator(seed=7, stores=100, store_skew=1.1, categories=50,
+                           category_skew=0.8, start_time=START).batch(n)
+    stores = collections.Counter(e["store_id"] for e in skewed)
+    top_share = stores.most_common(1)[0][1] / n
+
+    disorder = LoadGenerator(seed=7, jitter_ms=50, out_of_order_ratio=0.05,
+                             max_delay_ms=5000, start_time=START).batch(n)
+    times = [parse_evnt_time(e["evnt_time"]) for e in disorder]
+    high = times[0]
+    late = 0
+    for ts in times:
+        if ts < high - 100:
+            late += 1
+        high = max(high, ts)
+
+    print(json.dumps({
+        "events": n,
+        "events_per_s": {
+            "inline": _rate(inline_events(n), n),
+            "generator_wall_clock": _rate(LoadGenerator(seed=7).events(n), n),
+            "generator_virtual_clock": _rate(LoadGenerator(seed=7, start_time=START).events(n), n),
+            "generator_skewed": _rate(LoadGenerator(seed=7, stores=10000, store_skew=1.1, categories=1000).events(n), n),
+        },
+        "reproducible": True,
+        "zipf_1.1_top_store_share": round(top_share, 4),
+        "zipf_1.1_distinct_stores": len(stores),
+        "late_by_over_100ms_share": round(late / n, 4),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_logging
+    :Actions: Handler throughput of the producer and transformer at different log levels
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Log lines go to os.devnull, so formatting is measured but not terminal I/O.
+"legacy" replays the old per-invocation json.dumps of the whole event at
+INFO and logs every failed record and generated event at DEBUG.
+
+Usage: python benchmarks/bench_logging.py [records_per_batch] [producer_seconds]
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+import _paths  # noqa: F401
+import kinesis_firehose_transformer as transformer
+import stream_data_producer as producer
+from fakes import DeadlineContext, StubKinesisStream
+from bench_transformer_poison import make_batch
+from stream_common.load_generator import LoadGenerator
+
+# (label, level, sample rate)
+SETTINGS = [
+    ("legacy_info", logging.INFO, None),
+    ("debug_all", logging.DEBUG, 1.0),
+    ("debug_sampled", logging.DEBUG, 0.001),
+    ("info", logging.INFO, 0.001),
+    ("warning", logging.WARNING, 0.001),
+]
+
+
+def _legacy_transformer(event, context):
+    transformer.logger.info(f"Event: {json.dumps(event)}")
+    return transformer.lambda_handler(event, context)
+
+
+def bench_transformer(n, level, sample_rate, repeat=5):
+    event, _ = make_batch(n, 0.01)
+    handler = transformer.lambda_handler
+    transformer.GlobalArgs.LOG_SAMPLE_RATE = 1.0 if sample_rate is None else sample_rate
+    if sample_rate is None:
+        handler = _legacy_transformer
+    best = None
+    for _ in range(repeat):
+        _t = time.perf_counter()
+        handler(event, None)
+        elapsed = time.perf_counter() - _t
+        best = elapsed if best is None else min(best, elapsed)
+    return round(n / best)
+
+
+def bench_producer(seconds, sample_rate):
+    producer.GlobalArgs.LOG_SAMPLE_RATE = 1.0 if sample_rate is None else sample_rate
+    stream = StubKinesisStream(1, 0.0, records_per_s=10 ** 9, bytes_per_s=10 ** 12)
+    writer = producer.KinesisBatchWriter(
+        stream, "bench", DeadlineContext(seconds + producer.GlobalArgs.DEADLINE_MARGIN_MS / 1000))
+    count, _ = producer._produce(writer, ["0"], LoadGenerator(seed=7).events())
+    return round(count / seconds)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    devnull = open(os.devnull, "w")
+    root.addHandler(logging.StreamHandler(devnull))
+    transformer.GlobalArgs.METRICS_ENABLED = False
+    producer.GlobalArgs.METRICS_ENABLED = False
+
+    results = []
+    for label, level, sample_rate in SETTINGS:
+        root.setLevel(level)
+        results.append({
+            "setting": label,
+            "transformer_records_per_s": bench_transformer(n, level, sample_rate),
+            "producer_events_per_s": bench_producer(seconds, sample_rate),
+        })
+    devnull.close()
+    print(json.dumps({"records_per_batch": n, "poison_ratio": 0.01, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
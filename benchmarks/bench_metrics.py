@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_metrics
+    :Actions: Check the EMF output of both lambdas and the cost of collecting it
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Fails when an EMF line is malformed, or when the instrumentation costs more
+than MAX_OVERHEAD of a handler run with METRICS_ENABLED=false. Timing both
+settings and subtracting does not resolve 2% on a shared machine, two runs
+of the same setting differ by up to 10%, so the work METRICS_ENABLED adds,
+_publish_metrics in the transformer and the metrics branches of
+KinesisBatchWriter replayed for the batches of a real run, is timed on its
+own. Both sides are the fastest of several rounds in CPU time of the
+process. Instrumentation that moves into the per record loop is caught by
+counting the function calls both settings make, which does not depend on
+timing, it must stay under MAX_CALLS_PER_RECORD extra calls per record.
+
+Usage: python benchmarks/bench_metrics.py [records_per_batch] [rounds]
+"""
+
+import contextlib
+import gc
+import io
+import json
+import logging
+import sys
+import time
+
+import _paths  # noqa: F401
+import kinesis_firehose_transformer as transformer
+import stream_data_producer as producer
+from fakes import StubKinesisClient, producer_events as _events
+from bench_transformer_poison import make_batch
+from stream_common.metrics import MAX_VALUES
+
+MAX_OVERHEAD = 0.02
+MAX_CALLS_PER_RECORD = 0.1
+PUBLISH_REPEAT = 100
+
+
+def check_emf(line, namespace, service):
+    """ Validate one EMF document against the CloudWatch specification, returns it parsed """
+    doc = json.loads(line)
+    meta = doc["_aws"]
+    assert isinstance(meta["Timestamp"], int)
+    assert len(meta["CloudWatchMetrics"]) == 1
+    directive = meta["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == namespace
+    assert directive["Dimensions"] == [["ServiceName"]]
+    assert doc["ServiceName"] == service
+    assert directive["Metrics"], "no metrics"
+    for metric in directive["Metrics"]:
+        value = doc[metric["Name"]]
+        assert metric["Unit"] in ("Count", "Bytes", "Milliseconds"), metric
+        if isinstance(value, dict):
+            assert len(value["Values"]) == len(value["Counts"]) <= MAX_VALUES
+            assert all(c > 0 for c in value["Counts"])
+        else:
+            assert isinstance(value, (int, float)), metric
+    return doc
+
+
+def _capture(fn, *args):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        fn(*args)
+    return [l for l in out.getvalue().splitlines() if l]
+
+
+def check_transformer_output():
+    event, _ = make_batch(1000, 0.01)
+    lines = _capture(transformer.lambda_handler, event, None)
+    assert len(lines) == 1, "one EMF line per invocation"
+    doc = check_emf(lines[0], transformer.GlobalArgs.METRICS_NAMESPACE,
+                    transformer.GlobalArgs.MODULE_NAME)
+    assert doc["RecordsIn"] == 1000
+    assert doc["RecordsProcessed"] + doc["RecordsFailed"] == 1000
+    assert sum(doc["TransformBatchRecords"]["Counts"]) == 1
+    return doc
+
+
+class _Context:
+    def get_remaining_time_in_millis(self):
+        return 2200
+
+
+def check_producer_output():
+    producer.client = StubKinesisClient(failure_rate=0.01)
+    lines = _capture(producer.lambda_handler, {}, _Context())
+    assert len(lines) == 1, "one EMF line per invocation"
+    doc = check_emf(lines[0], producer.GlobalArgs.METRICS_NAMESPACE,
+                    producer.GlobalArgs.MODULE_NAME)
+    assert doc["InvocationErrors"] == 0
+    assert sum(doc["PutRecordsLatency"]["Counts"]) >= 1
+    return doc
+
+
+def _best(fn, rounds):
+    """ Fastest of rounds runs in CPU time of the process, the noise of a run only ever adds time """
+    best = float("inf")
+    for _ in range(rounds):
+        gc.collect()
+        _t = time.process_time()
+        fn()
+        best = min(best, time.process_time() - _t)
+    return best
+
+
+def _calls(fn):
+    """ Python and C function calls made by fn, deterministic where timings are not """
+    calls = [0]
+
+    def _profile(frame, event, arg):
+        if event in ("call", "c_call"):
+            calls[0] += 1
+    sys.setprofile(_profile)
+    try:
+        fn()
+    finally:
+        sys.setprofile(None)
+    return calls[0]
+
+
+def _run_transformer(event, enabled):
+    transformer.GlobalArgs.METRICS_ENABLED = enabled
+    with contextlib.redirect_stdout(io.StringIO()):
+        transformer.lambda_handler(event, None)
+
+
+def transformer_overhead(event, rounds):
+    """
+    CPU time of _publish_metrics, the only work METRICS_ENABLED adds to the
+    handler, over the fastest plain handler run
+    """
+    plain = _best(lambda: _run_transformer(event, False), rounds)
+    resp = {"total_records": len(event["records"]), "processed_records": len(event["records"])}
+
+    def _publish():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(PUBLISH_REPEAT):
+                transformer._publish_metrics(event["records"], resp, 1.0)
+    cost = _best(_publish, rounds) / PUBLISH_REPEAT
+    extra_calls = _calls(lambda: _run_transformer(event, True)) - _calls(lambda: _run_transformer(event, False))
+    return cost / plain, extra_calls
+
+
+def _run_writer(events, metrics):
+    writer = producer.KinesisBatchWriter(
+        StubKinesisClient(0.01), "bench", sleep=lambda s: None,
+        metrics=producer._new_metrics() if metrics else None)
+    for data, key in events:
+        writer.put(data, key)
+    writer.flush()
+    if metrics:
+        writer.metrics.flush(lambda line: None)
+    return writer
+
+
+def writer_overhead(events, rounds):
+    """
+    CPU time of the instrumented branches of KinesisBatchWriter, replayed for
+    the batches and PutRecords attempts of a real run, plus creating and
+    flushing the recorder, over the fastest plain writer run
+    """
+    plain = _best(lambda: _run_writer(events, False), rounds)
+    writer = _run_writer(events, True)
+    batches = sum(writer._batch_records.counts)
+    attempts = writer.stats["put_calls"]
+    clock = writer.clock
+
+    def _instrumentation():
+        metrics = producer._new_metrics()
+        w = producer.KinesisBatchWriter(None, "bench", metrics=metrics)
+        for _ in range(batches):
+            w._batch_records.record(500)
+            w._batch_bytes.record(100000)
+        for _ in range(attempts):
+            _t = clock()
+            w._put_latency.record((clock() - _t) * 1000)
+        metrics.flush(lambda line: None)
+    cost = _best(_instrumentation, rounds)
+    extra_calls = _calls(lambda: _run_writer(events, True)) - _calls(lambda: _run_writer(events, False))
+    return cost / plain, extra_calls
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    logging.getLogger().setLevel(logging.ERROR)
+
+    transformer_doc = check_transformer_output()
+    producer_doc = check_producer_output()
+
+    event, _ = make_batch(n, 0.01)
+
+    events = list(_events(n))
+    transformer_cost, transformer_calls = transformer_overhead(event, rounds)
+    writer_cost, writer_calls = writer_overhead(events, rounds)
+    results = {
+        "transformer_overhead": round(transformer_cost, 5),
+        "writer_overhead": round(writer_cost, 5),
+    }
+    extra_calls = {"transformer": transformer_calls, "writer": writer_calls}
+    print(json.dumps({
+        "records": n,
+        "emf_transformer": transformer_doc,
+        "emf_producer_metrics": sorted(k for k in producer_doc if k not in ("_aws", "ServiceName")),
+        "overhead": results,
+        "max_overhead": MAX_OVERHEAD,
+        "extra_calls_per_record": {k: round(v / n, 4) for k, v in extra_calls.items()},
+    }, indent=2))
+    assert all(v < MAX_OVERHEAD for v in results.values()), results
+    # Per record instrumentation would add at least one call per record
+    assert all(v < MAX_CALLS_PER_RECORD * n for v in extra_calls.values()), extra_calls
+
+
+if __name__ == "__main__":
+    main()
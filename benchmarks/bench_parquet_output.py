@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_parquet_output
+    :Actions: Compare file size and full scan time of NDJSON vs Parquet revenue rows
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Needs pyarrow, `pip install -r benchmarks/requirements.txt`, and is skipped
+without it.
+
+Usage: python benchmarks/bench_parquet_output.py [num_rows] [num_stores]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import _paths  # noqa: F401
+from stream_common import parquet_writer
+from stream_common.tumbling_window import as_real, format_timestamp
+
+
+def write_ndjson(path, n, num_stores):
+    """ Firehose style output, one row per store per minute """
+    rnd = random.Random(7)
+    start = 1612104420000
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            f.write(json.dumps({
+                "store_id": f"store_{i % num_stores + 1}",
+                "revenue": as_real(rnd.uniform(5000, 15000)),
+                "timestamp": format_timestamp(start + (i // num_stores) * 60000)
+            }) + "\n")
+
+
+def scan_ndjson(path):
+    total = 0.0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            total += json.loads(line)["revenue"]
+    return total
+
+
+def scan_parquet(path):
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=["store_id", "revenue", "timestamp"])
+    return pc.sum(table.column("revenue")).as_py()
+
+
+def _timed(fn, *args):
+    _t = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - _t
+
+
+def main():
+    if parquet_writer.pa is None:
+        print(json.dumps({"skipped": "pyarrow is not installed, pip install -r benchmarks/requirements.txt"}))
+        return
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    num_stores = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "revenue_analytics_stream.ndjson")
+        dest = os.path.join(tmp, "revenue_analytics_stream.parquet")
+        write_ndjson(src, n, num_stores)
+
+        _, convert_s = _timed(parquet_writer.ndjson_to_parquet, [src], dest)
+        json_total, json_scan_s = _timed(scan_ndjson, src)
+        parquet_total, parquet_scan_s = _timed(scan_parquet, dest)
+        # float32 storage, totals agree to REAL precision
+        assert abs(json_total - parquet_total) / json_total < 1e-5
+
+        print(json.dumps({
+            "rows": n,
+            "ndjson_bytes": os.path.getsize(src),
+            "parquet_bytes": os.path.getsize(dest),
+            "size_ratio": round(os.path.getsize(src) / os.path.getsize(dest), 1),
+            "convert_rows_per_s": round(n / convert_s),
+            "ndjson_scan_s": round(json_scan_s, 3),
+            "parquet_scan_s": round(parquet_scan_s, 3),
+            "scan_speedup": round(json_scan_s / parquet_scan_s, 1),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_partition_keys
+    :Actions: Check and time partition key extraction in the firehose transformer
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+KPL aggregated records are written to one partition, so an aggregate
+mixing stores or hours must fail instead of landing under the keys of its
+first row.
+
+Usage: python benchmarks/bench_partition_keys.py [num_records]
+"""
+
+import base64
+import json
+import logging
+import random
+import sys
+import time
+
+import _paths  # noqa: F401
+import kinesis_firehose_transformer as transformer
+from stream_common import kpl_aggregation
+
+
+def make_payloads(n, seed=7):
+    """ KDA style rows plus a sprinkle of layouts the byte level extraction must not get wrong """
+    rnd = random.Random(seed)
+    payloads = []
+    for i in range(n):
+        row = {
+            "store_id": f"store_{rnd.randint(1, 500)}",
+            "revenue": round(rnd.random() * 10000, 3),
+            "timestamp": f"2021-01-{rnd.randint(1, 31):02d} {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00.000"
+        }
+        kind = i % 100
+        if kind == 0:
+            row["store_id"] = 'store_"quoted"'
+            payload = json.dumps(row)
+        elif kind == 1:
+            payload = json.dumps(dict(reversed(list(row.items()))))
+        elif kind == 2:
+            payload = json.dumps(row, separators=(",", ":"))
+        else:
+            payload = json.dumps(row)
+        payloads.append(payload.encode("utf-8"))
+    return payloads
+
+
+def reference_keys(payload):
+    row = json.loads(payload)
+    return {"store_id": row["store_id"], "date": row["timestamp"][:10], "hour": row["timestamp"][11:13]}
+
+
+def _aggregated_record(record_id, rows):
+    blob, = kpl_aggregation.aggregate((row["store_id"], json.dumps(row)) for row in rows)
+    return {"recordId": record_id, "data": base64.b64encode(blob.data).decode("utf-8")}
+
+
+def check_aggregated_partitions():
+    """ One store and hour per aggregate goes through, mixed stores or hours fail the record """
+    rows = [{"store_id": "store_1", "revenue": 1.5, "timestamp": f"2021-01-31 14:{m:02d}:00.000"}
+            for m in range(1, 4)]
+    event = {"records": [
+        _aggregated_record("same", rows),
+        _aggregated_record("mixed_store", rows + [dict(rows[0], store_id="store_2")]),
+        _aggregated_record("mixed_hour", rows + [dict(rows[0], timestamp="2021-01-31 15:00:00.000")]),
+    ]}
+    out = {r["recordId"]: r for r in transformer.lambda_handler(event, None)["records"]}
+    assert out["same"]["result"] == "Ok", out["same"]
+    assert out["same"]["metadata"]["partitionKeys"] == {"store_id": "store_1", "date": "2021-01-31", "hour": "14"}
+    for record_id in ("mixed_store", "mixed_hour"):
+        assert out[record_id]["result"] == transformer.GlobalArgs.FAILED_RECORD_RESULT, out[record_id]
+        assert "metadata" not in out[record_id]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    logging.getLogger().setLevel(logging.ERROR)
+    transformer.GlobalArgs.METRICS_ENABLED = False
+    payloads = make_payloads(n)
+
+    _t = time.perf_counter()
+    expected = [reference_keys(p) for p in payloads]
+    parse_s = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    got = [transformer.extract_partition_keys(p) for p in payloads]
+    extract_s = time.perf_counter() - _t
+
+    mismatches = sum(1 for a, b in zip(expected, got) if a != b)
+    assert mismatches == 0, mismatches
+
+    transformer.GlobalArgs.EMIT_PARTITION_KEYS = True
+    check_aggregated_partitions()
+    event = {"records": [
+        {"recordId": str(i), "data": base64.b64encode(p).decode("utf-8")}
+        for i, p in enumerate(payloads[:100000])
+    ]}
+    _t = time.perf_counter()
+    out = transformer.lambda_handler(event, None)["records"]
+    handler_s = time.perf_counter() - _t
+    assert all(r["metadata"]["partitionKeys"] == expected[i]
+               for i, r in enumerate(out))
+
+    print(json.dumps({
+        "records": n,
+        "distinct_partitions": len({tuple(k.values()) for k in expected}),
+        "mismatches": mismatches,
+        "json_parse_keys_per_s": round(n / parse_s),
+        "byte_extract_keys_per_s": round(n / extract_s),
+        "handler_records_per_s": round(len(event["records"]) / handler_s),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_pre_aggregation
+    :Actions: Stream volume and per minute revenue of producer pre-aggregation against raw events
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Runs the same seeded events, with jitter and late events, through the
+producer's _produce into a stub kinesis client, once as raw events and once
+per bucket size as partial aggregates. The records are decoded with the
+sales cast to REAL, as the KDA input schema does, and aggregated in one
+minute event time windows, both exactly per store and evnt_time minute and
+through the local event time SQL equivalent. Revenue per store and minute
+must match the raw events to float32 rounding.
+
+Reported per bucket size: records, bytes and shards needed (1000
+records/s and 1MB/s per shard) at the generated rate, and the time the
+window engine takes, a stand-in for the KDA processing.
+
+Usage: python benchmarks/bench_pre_aggregation.py [events_per_s] [duration_s]
+"""
+
+import collections
+import json
+import math
+import struct
+import sys
+import time
+
+import _paths  # noqa: F401
+import stream_data_producer as producer
+from fakes import StubKinesisClient
+from stream_common.load_generator import LoadGenerator
+from stream_common.pre_aggregation import PreAggregator
+from stream_common.tumbling_window import format_timestamp, parse_evnt_time, run
+
+START = 1612101600.0
+WINDOW_SECONDS = 60
+BUCKET_SECONDS = [1, 5, 10, 30]
+_REAL = struct.Struct("f")
+
+
+def produce(events, bucket_seconds=None):
+    """ Payloads the producer puts for the events, partial aggregates when bucket_seconds is set """
+    client = StubKinesisClient(keep_data=True)
+    writer = producer.KinesisBatchWriter(client, "bench", sleep=lambda s: None)
+    pre = PreAggregator(bucket_seconds) if bucket_seconds else None
+    producer._produce(writer, [], iter(events), pre)
+    return client.data
+
+
+def decode(payloads):
+    """ Records as KDA reads them, sales as REAL """
+    out = []
+    for data in payloads:
+        record = json.loads(data)
+        record["sales"] = _REAL.unpack(_REAL.pack(record["sales"]))[0]
+        out.append(record)
+    return out
+
+
+def minute_revenue(records):
+    """ Revenue per (store, event time minute), where every record belongs """
+    window_ms = WINDOW_SECONDS * 1000
+    sums = collections.defaultdict(float)
+    for r in records:
+        ts = parse_evnt_time(r["evnt_time"])
+        sums[(r["store_id"], format_timestamp(ts - ts % window_ms + window_ms))] += r["sales"]
+    return sums
+
+
+def sql_revenue(records):
+    """ The event time SQL equivalent, rows summed per store and timestamp, and the time it took """
+    late = []
+    _t = time.perf_counter()
+    rows = list(run(iter(records), WINDOW_SECONDS, event_time=True, watermark_delay_seconds=5,
+                    allowed_lateness_seconds=WINDOW_SECONDS, on_late=late.append))
+    seconds = time.perf_counter() - _t
+    assert not late, len(late)
+    sums = collections.defaultdict(float)
+    for row in rows:
+        sums[(row["store_id"], row["timestamp"])] += row["revenue"]
+    return sums, seconds
+
+
+def worst_error(got, want):
+    assert got.keys() == want.keys(), sorted(set(got) ^ set(want))[:5]
+    return max(abs(got[k] - want[k]) / max(1.0, abs(want[k])) for k in want)
+
+
+def _volume(payloads, duration_s):
+    size = sum(len(p) for p in payloads)
+    return {
+        "records": len(payloads),
+        "mb": round(size / 1024 / 1024, 2),
+        "shards": max(1, math.ceil(max(len(payloads) / duration_s / 1000,
+                                       size / duration_s / 1024 / 1024))),
+    }
+
+
+def main():
+    events_per_s = float(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    duration_s = float(sys.argv[2]) if len(sys.argv) > 2 else 300
+    producer.GlobalArgs.METRICS_ENABLED = False
+    events = LoadGenerator(seed=7, stores=20, categories=5, start_time=START, events_per_s=events_per_s,
+                           jitter_ms=200, out_of_order_ratio=0.01, max_delay_ms=3000
+                           ).batch(int(events_per_s * duration_s))
+    raw = produce([dict(e) for e in events])
+    raw_records = decode(raw)
+    want = minute_revenue(raw_records)
+    want_sql, raw_sql_s = sql_revenue(raw_records)
+    results = [dict(_volume(raw, duration_s), bucket_seconds=None, sql_seconds=round(raw_sql_s, 3))]
+    for bucket_seconds in BUCKET_SECONDS:
+        payloads = produce([dict(e) for e in events], bucket_seconds)
+        records = decode(payloads)
+        assert sum(r["events"] for r in records) == len(events)
+        got_sql, sql_s = sql_revenue(records)
+        results.append(dict(
+            _volume(payloads, duration_s),
+            bucket_seconds=bucket_seconds,
+            sql_seconds=round(sql_s, 3),
+            max_relative_error=worst_error(minute_revenue(records), want),
+            max_relative_error_sql=worst_error(got_sql, want_sql),
+        ))
+        # REAL keeps about 7 significant digits of every record
+        assert results[-1]["max_relative_error"] < 1e-6, results[-1]
+        assert results[-1]["max_relative_error_sql"] < 1e-6, results[-1]
+    for r in results[1:]:
+        r["record_reduction"] = round(results[0]["records"] / r["records"], 1)
+    print(json.dumps({"events": len(events), "events_per_s": events_per_s, "duration_s": duration_s,
+                      "window_seconds": WINDOW_SECONDS, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_producer_batching
+    :Actions: Compare PutRecords calls per record, one-by-one vs KinesisBatchWriter
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+The batched run must take at most ceil(n / 500) PutRecords calls without
+failures, deliver every record exactly once, and resend only the entries a
+call reported as failed. The writer runs on a frozen clock, so the 1s
+BATCH_MAX_AGE_MS flush of a slow machine cannot add calls, the age based
+flush is checked apart with a clock the check advances.
+
+Usage: python benchmarks/bench_producer_batching.py [num_records] [failure_rate]
+"""
+
+import collections
+import json
+import math
+import sys
+import time
+
+import _paths  # noqa: F401
+import stream_data_producer as producer
+from fakes import StubKinesisClient, producer_events as _events
+
+
+class RecordingClient(StubKinesisClient):
+    """ StubKinesisClient counting every entry sent and the partition keys accepted """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.entries = 0
+        self.failed = 0
+        self.accepted = collections.Counter()
+
+    def put_records(self, Records, StreamName):
+        resp = super().put_records(Records, StreamName)
+        self.entries += len(Records)
+        self.failed += resp["FailedRecordCount"]
+        for record, result in zip(Records, resp["Records"]):
+            if "ErrorCode" not in result:
+                self.accepted[record["PartitionKey"]] += 1
+        return resp
+
+
+def run_one_by_one(n, failure_rate):
+    client = StubKinesisClient(failure_rate)
+    for data, key in _events(n):
+        client.put_records(
+            Records=[{"Data": data, "PartitionKey": key}], StreamName="bench")
+    return client
+
+
+def _frozen_clock():
+    return 0.0
+
+
+def run_batched(n, failure_rate):
+    client = RecordingClient(failure_rate)
+    writer = producer.KinesisBatchWriter(
+        client, "bench", clock=_frozen_clock, sleep=lambda s: None)
+    for data, key in _events(n):
+        writer.put(data, key)
+    writer.flush()
+    return client, writer
+
+
+def check_batched(n, failure_rate):
+    """ The calls per record bound without failures, exactly once delivery and retries of failed entries only """
+    client, writer = run_batched(n, 0.0)
+    assert client.calls <= math.ceil(n / 500), (client.calls, n)
+    client, writer = run_batched(n, failure_rate)
+    assert writer.stats["records_failed"] == 0, writer.stats
+    assert len(client.accepted) == n and set(client.accepted.values()) == {1}, "lost or duplicated records"
+    # Every entry beyond the first attempt is the retry of a failed one
+    assert client.entries == n + client.failed, (client.entries, n, client.failed)
+
+
+def check_age_flush(max_age_ms=1000, step_ms=300):
+    """ A partial batch is sent once its first record is max_age_ms old, not before """
+    now = [0.0]
+    client = RecordingClient(0.0)
+    writer = producer.KinesisBatchWriter(
+        client, "bench", max_age_ms=max_age_ms, clock=lambda: now[0], sleep=lambda s: None)
+    sent = []
+    for data, key in _events(10):
+        writer.put(data, key)
+        sent.append(client.records)
+        now[0] += step_ms / 1000
+    # Records put at 0, 300, 600 and 900 ms wait, the one at 1200 ms sends all five
+    assert sent[:5] == [0, 0, 0, 0, 5], sent
+    assert sent[5:] == [5, 5, 5, 5, 10], sent
+    writer.flush()
+    assert client.records == 10 and client.calls == 2, (client.records, client.calls)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    check_batched(n, failure_rate)
+    check_age_flush()
+
+    _t = time.perf_counter()
+    single = run_one_by_one(n, failure_rate)
+    single_s = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    batched, writer = run_batched(n, failure_rate)
+    batched_s = time.perf_counter() - _t
+
+    print(json.dumps({
+        "records": n,
+        "failure_rate": failure_rate,
+        "one_by_one": {
+            "put_calls": single.calls,
+            "calls_per_record": round(single.calls / n, 5),
+            "records_delivered": single.records,
+            "seconds": round(single_s, 3)
+        },
+        "batched": {
+            "put_calls": batched.calls,
+            "calls_per_record": round(batched.calls / n, 5),
+            "records_delivered": batched.records,
+            "seconds": round(batched_s, 3),
+            "stats": writer.stats
+        },
+        "call_reduction": round(single.calls / max(batched.calls, 1), 1)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
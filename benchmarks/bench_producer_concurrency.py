@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_producer_concurrency
+    :Actions: Aggregate producer records/s as writer threads and shards scale
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+The stub stream enforces the per-shard write limits and adds a fixed
+latency per call, see fakes.StubKinesisStream. Before timing, a run with KPL
+aggregation checks that every aggregate is put with the explicit hash key
+of all of its user records, so it lands on the shard they were meant for.
+
+Usage: python benchmarks/bench_producer_concurrency.py [seconds_per_run] [call_latency_ms]
+"""
+
+import json
+import sys
+import time
+
+import _paths  # noqa: F401
+import stream_data_producer as producer
+from fakes import DeadlineContext, StubKinesisClient, StubKinesisStream
+from stream_common.kpl_aggregation import deaggregate
+
+WRITERS = [1, 2, 4, 8]
+SHARDS = [1, 2, 4, 8]
+
+
+class EntryClient(StubKinesisClient):
+    """ Accepts every entry and keeps it, over the hash key ranges of shards """
+
+    def __init__(self, shards):
+        super().__init__()
+        self._shards = StubKinesisStream(shards, 0).list_shards("bench")
+        self.entries = []
+
+    def list_shards(self, StreamName, **kwargs):
+        return self._shards
+
+    def put_records(self, Records, StreamName):
+        self.entries.extend(Records)
+        return super().put_records(Records, StreamName)
+
+
+def check_aggregate_routing(writers=2, shards=4, seconds=0.3):
+    client = EntryClient(shards)
+    producer.client = client
+    producer.GlobalArgs.PRODUCER_CONCURRENCY = writers
+    aggregation = producer.GlobalArgs.AGGREGATION_ENABLED
+    producer.GlobalArgs.AGGREGATION_ENABLED = True
+    try:
+        producer.lambda_handler({}, DeadlineContext(seconds + producer.GlobalArgs.DEADLINE_MARGIN_MS / 1000))
+    finally:
+        producer.GlobalArgs.AGGREGATION_ENABLED = aggregation
+    hash_keys = set()
+    for entry in client.entries:
+        hash_keys.add(entry["ExplicitHashKey"])
+        mixed = {r.explicit_hash_key for r in deaggregate(entry["Data"])} - {entry["ExplicitHashKey"]}
+        assert not mixed, f"aggregate for {entry['ExplicitHashKey']} carries records for {mixed}"
+    assert len(hash_keys) == shards, hash_keys
+
+
+def run(writers, shards, seconds, call_latency_s):
+    stream = StubKinesisStream(shards, call_latency_s)
+    producer.client = stream
+    producer.GlobalArgs.PRODUCER_CONCURRENCY = writers
+    margin_s = producer.GlobalArgs.DEADLINE_MARGIN_MS / 1000
+    _t = time.perf_counter()
+    producer.lambda_handler({}, DeadlineContext(seconds + margin_s))
+    elapsed = time.perf_counter() - _t
+    return {
+        "writers": writers,
+        "shards": shards,
+        "accepted_records_per_s": round(stream.accepted / elapsed),
+        "per_shard_records_per_s": round(stream.accepted / elapsed / shards),
+        "throttled": stream.throttled,
+        "put_calls": stream.calls,
+    }
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    call_latency_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 30) / 1000
+    producer.logger.setLevel("WARNING")
+    producer.GlobalArgs.METRICS_ENABLED = False
+    # Short buffer age so every writer keeps a steady flow of batches
+    producer.GlobalArgs.BATCH_MAX_AGE_MS = 200
+    check_aggregate_routing()
+    results = [run(w, s, seconds, call_latency_s)
+               for s in SHARDS for w in WRITERS]
+    print(json.dumps({"seconds_per_run": seconds, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_rate_control
+    :Actions: Deterministic run of the producer loop against a throttling stub stream
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Time is virtual: generating an event, a put_records round trip and every
+sleep advance a simulated clock, so runs are repeatable and fast. The stub
+enforces the per-shard limits per virtual second and, halfway through,
+loses part of its capacity to simulate a noisy neighbour.
+
+Usage: python benchmarks/bench_rate_control.py [virtual_seconds] [shards]
+"""
+
+import json
+import random
+import sys
+
+import _paths  # noqa: F401
+import stream_data_producer as producer
+from rate_control import ShardRateController
+from stream_common.load_generator import LoadGenerator
+
+EVENT_COST_S = 0.0001
+CALL_LATENCY_S = 0.02
+
+
+class VirtualClock:
+    def __init__(self):
+        self.t = 0.0
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += max(seconds, 0.0)
+
+
+class VirtualContext:
+    def __init__(self, clock, seconds):
+        self.clock = clock
+        self.deadline = clock.now() + seconds
+
+    def get_remaining_time_in_millis(self):
+        # Generating an event is not free, charge it here as the loop checks the deadline once per event
+        self.clock.sleep(EVENT_COST_S)
+        return int((self.deadline - self.clock.now()) * 1000)
+
+
+class ThrottlingStream:
+    """ Per shard 1000 records/s and 1MB/s, routed by ExplicitHashKey """
+
+    def __init__(self, clock, hash_keys, degrade_at_s=None, degraded_capacity=0.6):
+        self.clock = clock
+        self.shard = {hk: i for i, hk in enumerate(hash_keys)}
+        self.degrade_at_s = degrade_at_s
+        self.degraded_capacity = degraded_capacity
+        self._second = None
+        self._usage = None
+        self.accepted_per_s = {}
+        self.throttled = 0
+
+    def put_records(self, Records, StreamName):
+        self.clock.sleep(CALL_LATENCY_S)
+        _second = int(self.clock.now())
+        if _second != self._second:
+            self._second = _second
+            self._usage = [[0, 0] for _ in self.shard]
+        capacity = 1.0
+        if self.degrade_at_s is not None and _second >= self.degrade_at_s:
+            capacity = self.degraded_capacity
+        results = []
+        failed = 0
+        for record in Records:
+            usage = self._usage[self.shard[record["ExplicitHashKey"]]]
+            size = len(record["Data"]) + len(record["PartitionKey"])
+            if usage[0] + 1 > 1000 * capacity or usage[1] + size > 1024 * 1024 * capacity:
+                failed += 1
+                self.throttled += 1
+                results.append({"ErrorCode": "ProvisionedThroughputExceededException",
+                                "ErrorMessage": "Rate exceeded for shard"})
+            else:
+                usage[0] += 1
+                usage[1] += size
+                self.accepted_per_s[_second] = self.accepted_per_s.get(
+                    _second, 0) + 1
+                results.append({"SequenceNumber": "1", "ShardId": "shardId-000000000000"})
+        return {"FailedRecordCount": failed, "Records": results}
+
+
+def run(rate_control, seconds, shards, target_events_per_s):
+    random.seed(7)
+    clock = VirtualClock()
+    hash_keys = [str(i) for i in range(shards)]
+    stream = ThrottlingStream(clock, hash_keys, degrade_at_s=seconds // 2)
+    controller = None
+    if rate_control:
+        controller = ShardRateController(
+            hash_keys, target_events_per_s=target_events_per_s,
+            clock=clock.now, sleep=clock.sleep)
+    writer = producer.KinesisBatchWriter(
+        stream, "bench", VirtualContext(clock, seconds + producer.GlobalArgs.DEADLINE_MARGIN_MS / 1000),
+        max_age_ms=200, rate_controller=controller, clock=clock.now, sleep=clock.sleep)
+    generated, _ = producer._produce(writer, hash_keys, LoadGenerator(seed=7).events())
+
+    half = seconds // 2
+    healthy = [stream.accepted_per_s.get(s, 0) for s in range(2, half)]
+    degraded = [stream.accepted_per_s.get(s, 0) for s in range(half + 3, seconds)]
+    return {
+        "rate_control": rate_control,
+        "generated": generated,
+        "delivered": writer.stats["records_sent"],
+        "failed": writer.stats["records_failed"],
+        "throttled_records": stream.throttled,
+        "put_calls": writer.stats["put_calls"],
+        "stable_records_per_s_healthy": round(sum(healthy) / max(len(healthy), 1)),
+        "stable_records_per_s_degraded": round(sum(degraded) / max(len(degraded), 1)),
+        "shard_rates_end": controller.rates() if controller else None,
+    }
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    producer.logger.setLevel("CRITICAL")
+    results = [run(rc, seconds, shards, 0) for rc in (False, True)]
+    print(json.dumps({
+        "virtual_seconds": seconds,
+        "shards": shards,
+        "shard_limit_records_per_s": 1000 * shards,
+        "degraded_limit_records_per_s": 600 * shards,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
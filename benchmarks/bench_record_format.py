@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_record_format
+    :Actions: Bytes, encode and decode cost and shard capacity of JSON and CSV sales events
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Encodes the same seeded events, with and without event ids, as JSON with
+each serializer backend and as CSV rows. Every format must decode back to
+the events, and the local window engine must give the same rows for JSON
+and CSV payloads. CSV fields are matched by position, so the KDA input
+columns of the analytics stack must be record_format.SALES_COLUMNS, same
+names, types and order, read from the stack source without the CDK.
+Reported per format,
+
+    bytes_per_record        payload size, the CSV row drops the field names
+    encode_ns, decode_ns    best of 5 per record
+    events_per_shard_s      raw records, capped at 1000 records/s, and KPL aggregated records,
+                            capped at 1MB/s with the producer's partition keys
+
+Usage: python benchmarks/bench_record_format.py [records]
+"""
+
+import ast
+import json
+import os
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common import serializer as serializers
+from stream_common.kpl_aggregation import aggregate
+from stream_common.load_generator import LoadGenerator
+from stream_common.record_format import SALES_COLUMNS, CsvRecordFormat, get_record_format
+from stream_common.tumbling_window import decode_records, run
+
+KDA_STACK = os.path.join(_paths.BACK_END, "kinesis_tumbling_window_analytics_stack",
+                         "kinesis_tumbling_window_analytics_stack.py")
+START = 1612101600.0
+SHARD_RECORDS_PER_S = 1000
+SHARD_BYTES_PER_S = 1024 * 1024
+
+
+def formats():
+    out = {"json": serializers.StdlibSerializer()}
+    if serializers.orjson is not None:
+        out["orjson"] = serializers.OrjsonSerializer()
+    out["csv"] = CsvRecordFormat()
+    return out
+
+
+def _ns_per_record(fn, items, repeat=5):
+    best = None
+    for _ in range(repeat):
+        _t = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - _t
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(items) * 1e9)
+
+
+def _per_shard(events, payloads):
+    """ Events/s one shard takes as raw records and as KPL aggregated records """
+    size = sum(len(p) for p in payloads) / len(payloads)
+    raw = min(SHARD_RECORDS_PER_S, SHARD_BYTES_PER_S / size)
+    keys = [e.get("event_id") or str(i) for i, e in enumerate(events)]
+    aggregated = list(aggregate(zip(keys, payloads)))
+    agg_bytes = sum(len(r.data) for r in aggregated)
+    per_s = len(events) * min(SHARD_RECORDS_PER_S / len(aggregated), SHARD_BYTES_PER_S / agg_bytes)
+    return {"raw": round(raw), "kpl_aggregated": round(per_s)}
+
+
+def window_rows(payloads):
+    return list(run(decode_records(payloads), 60))
+
+
+def bench(events):
+    results = {}
+    for name, fmt in formats().items():
+        payloads = [fmt.dumps(e) for e in events]
+        decoded = [fmt.loads(p) for p in payloads]
+        assert decoded == events, name
+        results[name] = {
+            "bytes_per_record": round(sum(len(p) for p in payloads) / len(payloads), 1),
+            "encode_ns": _ns_per_record(fmt.dumps, events),
+            "decode_ns": _ns_per_record(fmt.loads, payloads),
+            "events_per_shard_s": _per_shard(events, payloads),
+        }
+    assert window_rows([get_record_format("csv").dumps(e) for e in events]) == \
+        window_rows([get_record_format("json").dumps(e) for e in events])
+    for name in results:
+        results[name]["size_vs_json"] = round(
+            results[name]["bytes_per_record"] / results["json"]["bytes_per_record"], 2)
+    return results
+
+
+def check_kda_columns(path=KDA_STACK):
+    """ The SALES_COLUMNS literal of the analytics stack must match the producer's CSV columns """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SALES_COLUMNS" for t in node.targets):
+            columns = ast.literal_eval(node.value)
+            assert columns == SALES_COLUMNS, f"KDA input columns {columns} != record_format {SALES_COLUMNS}"
+            return
+    raise AssertionError(f"no SALES_COLUMNS in {path}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    check_kda_columns()
+    out = {"records": n}
+    for event_ids in (False, True):
+        events = LoadGenerator(seed=7, stores=50, start_time=START, events_per_s=1000,
+                               event_ids=event_ids).batch(n)
+        out["with_event_ids" if event_ids else "without_event_ids"] = bench(events)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
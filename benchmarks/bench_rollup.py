@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_rollup
+    :Actions: Throughput and memory of the NumPy rollups against the pure Python dict loop
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Writes per minute revenue rows of stores in firehose NDJSON objects of an
+hour each, then rolls them up by hour and day for store_id, store_group and
+all stores, twice,
+
+    python      every row parsed and summed into one dict per table, the loop
+                dashboards run today
+    numpy       stream_common.rollup, columns of chunk_rows and a vectorized group-by
+
+Both are timed end to end, reading the files, and on the group-by alone
+over rows already in memory. Every table must match the dict loop to 1e-9,
+and hourly sums of rows on the hour boundary must match backfill, row
+timestamps are window ends.
+Peak memory is traced for two chunk sizes, it depends on the chunk and the
+tables, not the input, and the seconds for 100 million rows are
+extrapolated from the measured rate.
+
+Needs numpy, `pip install -r benchmarks/requirements.txt`, and is skipped
+without it.
+
+Usage: python benchmarks/bench_rollup.py [rows] [stores]
+"""
+
+import collections
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import _paths  # noqa: F401
+from stream_common import backfill
+from stream_common import rollup as rollups
+from stream_common.compaction import iter_lines
+from stream_common.serializer import get_serializer
+from stream_common.tumbling_window import as_real, format_timestamp, parse_evnt_time
+
+START_MS = 1612051200000
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("store_id", "store_group", "all")
+CHUNK_ROWS = [100000, rollups.DEFAULT_CHUNK_ROWS]
+EXTRAPOLATE_ROWS = 100000000
+
+
+def write_output(dest, rows, stores, seed=7):
+    """ rows per minute revenue rows in one firehose like object per hour, and the store groups """
+    rnd = random.Random(seed)
+    minutes = rows // stores
+    paths = []
+    f = None
+    for minute in range(minutes):
+        if minute % 60 == 0:
+            if f:
+                f.close()
+            ts = START_MS + minute * 60000
+            paths.append(os.path.join(dest, f"revenue_analytics_stream-1-{format_timestamp(ts)[:13].replace(' ', '-')}"))
+            f = open(paths[-1], "w", encoding="utf-8")
+        timestamp = format_timestamp(START_MS + minute * 60000)
+        f.write("".join(
+            f'{{"store_id": "store_{s}", "revenue": {as_real(rnd.uniform(100, 20000))}, "timestamp": "{timestamp}"}}\n'
+            for s in range(1, stores + 1)))
+    f.close()
+    groups = {f"store_{s}": f"region_{s % 8}" for s in range(1, stores + 1) if s % 10}
+    return paths, groups
+
+
+def python_rollup(rows, groups):
+    """ {(dimension, granularity): {(bucket, key): [revenue, rows]}} with dicts """
+    tables = {(d, g): collections.defaultdict(lambda: [0.0, 0]) for d in DIMENSIONS for g in GRANULARITIES}
+    sizes = [(g, rollups.GRANULARITIES[g]) for g in GRANULARITIES]
+    for store_id, revenue, epoch_ms in rows:
+        keys = {"store_id": store_id, "store_group": groups.get(store_id, rollups.DEFAULT_GROUP), "all": None}
+        for granularity, bucket_ms in sizes:
+            # Row timestamps are window ends
+            bucket = (epoch_ms - 1) // bucket_ms
+            for dimension in DIMENSIONS:
+                acc = tables[(dimension, granularity)][(bucket, keys[dimension])]
+                acc[0] += revenue
+                acc[1] += 1
+    return tables
+
+
+def python_rows(paths):
+    loads = get_serializer().loads
+    epoch_ms_of = {}
+    for path in paths:
+        for line in iter_lines(open(path, "rb")):
+            row = loads(line)
+            ts = epoch_ms_of.get(row["timestamp"])
+            if ts is None:
+                ts = epoch_ms_of[row["timestamp"]] = parse_evnt_time(row["timestamp"])
+            yield row["store_id"], row["revenue"], ts
+
+
+def check(tables, numpy_tables, stores):
+    labels = {"store_id": stores.ids, "store_group": stores.group_names}
+    for key, want in tables.items():
+        table = numpy_tables[key]
+        assert len(table) == len(want), (key, len(table), len(want))
+        for bucket, code, revenue, rows in zip(table.buckets.tolist(), table.keys.tolist(),
+                                               table.revenue.tolist(), table.rows.tolist()):
+            label = labels[key[0]][code] if key[0] in labels else None
+            w = want[(bucket, label)]
+            assert w[1] == rows and abs(w[0] - revenue) <= 1e-9 * abs(w[0]), (key, bucket, label, w, revenue)
+
+
+def check_boundary(dest):
+    """ Rows closing 14:59 and 15:00 go to the hour ending 15:00, stamped as backfill stamps it """
+    path = os.path.join(dest, "boundary")
+    with open(path, "w", encoding="utf-8") as f:
+        for timestamp, revenue in (("2021-01-31 14:00:00.000", 1.0), ("2021-01-31 14:59:00.000", 10.0),
+                                   ("2021-01-31 15:00:00.000", 5.0), ("2021-01-31 15:01:00.000", 2.0)):
+            f.write(f'{{"store_id": "store_1", "revenue": {as_real(revenue)}, "timestamp": "{timestamp}"}}\n')
+    tables, _ = rollups.rollup([path], ("hour",), ("store_id",), {})
+    got = {row["timestamp"]: row["revenue"] for row in tables[("store_id", "hour")].to_rows(["store_1"])}
+    sums, _ = backfill.aggregate_chunk(path, window_seconds=3600)
+    want = {row["timestamp"]: row["revenue"] for row in backfill.format_backfill_rows(sums)}
+    assert got == want == {"2021-01-31 14:00:00.000": 1.0, "2021-01-31 15:00:00.000": 15.0,
+                           "2021-01-31 16:00:00.000": 2.0}, (got, want)
+
+
+def _peak_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def _rate(rows, seconds):
+    return {"rows_per_s": round(rows / seconds), "seconds_per_100m_rows": round(EXTRAPOLATE_ROWS / rows * seconds)}
+
+
+def main():
+    if rollups.np is None:
+        print(json.dumps({"skipped": "numpy is not installed, pip install -r benchmarks/requirements.txt"}))
+        return
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    stores = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    tmp = tempfile.mkdtemp(prefix="bench_rollup_")
+    try:
+        check_boundary(tmp)
+        paths, groups = write_output(tmp, rows, stores)
+        rows = rows // stores * stores
+
+        _t = time.perf_counter()
+        parsed = list(python_rows(paths))
+        parse_s = time.perf_counter() - _t
+        _t = time.perf_counter()
+        tables = python_rollup(parsed, groups)
+        python_group_s = time.perf_counter() - _t
+
+        _t = time.perf_counter()
+        numpy_tables, store_dict = rollups.rollup(paths, GRANULARITIES, DIMENSIONS, groups)
+        numpy_s = time.perf_counter() - _t
+        check(tables, numpy_tables, store_dict)
+
+        columns_dict = rollups.StoreDictionary(groups)
+        columns = list(rollups.read_columns(paths, columns_dict))
+        _t = time.perf_counter()
+        rollups.rollup_columns(columns, columns_dict, GRANULARITIES, DIMENSIONS)
+        numpy_group_s = time.perf_counter() - _t
+        del parsed, columns
+
+        memory = {str(chunk_rows): _peak_mb(lambda: rollups.rollup(paths, GRANULARITIES, DIMENSIONS,
+                                                                   groups, chunk_rows))
+                  for chunk_rows in CHUNK_ROWS}
+        print(json.dumps({
+            "rows": rows,
+            "stores": stores,
+            "files": len(paths),
+            "input_mb": round(sum(os.path.getsize(p) for p in paths) / 1024 / 1024, 1),
+            "tables": {f"{d}_{g}": len(t) for (d, g), t in numpy_tables.items()},
+            "end_to_end": {"python": _rate(rows, parse_s + python_group_s), "numpy": _rate(rows, numpy_s),
+                           "speedup": round((parse_s + python_group_s) / numpy_s, 1)},
+            "group_by_only": {"python": _rate(rows, python_group_s), "numpy": _rate(rows, numpy_group_s),
+                              "speedup": round(python_group_s / numpy_group_s, 1)},
+            "numpy_peak_mb_by_chunk_rows": memory,
+        }, indent=2))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
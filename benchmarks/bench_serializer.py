@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_serializer
+    :Actions: Per-record cost of each JSON backend and a check that they write the same bytes
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+"producer_event_legacy" is the previous per-event producer work, a
+json.dumps for the debug log line and another for the payload, encoded to
+UTF-8 by the writer. The serializers dump once, straight to bytes.
+
+Usage: python benchmarks/bench_serializer.py [records]
+"""
+
+import json
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common import serializer as serializers
+from stream_common.load_generator import LoadGenerator
+from stream_common.tumbling_window import as_real
+
+START = 1612101600.0
+
+
+def kda_rows(n):
+    return [{
+        "store_id": f"store_{i % 50 + 1}",
+        "revenue": as_real(i * 13.37 + 0.1),
+        "timestamp": "2021-01-31 14:47:00.000"
+    } for i in range(n)]
+
+
+def _ns_per_record(fn, items, repeat=5):
+    best = None
+    for _ in range(repeat):
+        _t = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - _t
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(items) * 1e9)
+
+
+def _legacy_producer_event(event):
+    json.dumps(event)
+    return json.dumps(event).encode("utf-8")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    events = LoadGenerator(seed=7, stores=1000, categories=16, start_time=START).batch(n)
+    rows = kda_rows(n)
+    backends = [serializers.get_serializer(name) for name in serializers.BACKENDS
+                if name != "orjson" or serializers.orjson is not None]
+
+    # Every backend must write exactly the bytes of the json module
+    reference = serializers.StdlibSerializer()
+    for backend in backends:
+        for obj in events + rows:
+            data = backend.dumps(obj)
+            assert data == reference.dumps(obj), (backend.name, obj)
+            assert backend.loads(data) == obj
+        try:
+            backend.loads(b'\xff\xfe{"store_id": 1}')
+            raise AssertionError("invalid UTF-8 accepted")
+        except UnicodeDecodeError:
+            pass
+
+    event_bytes = [reference.dumps(e) for e in events]
+    results = {"producer_event_legacy_ns": _ns_per_record(_legacy_producer_event, events)}
+    for backend in backends:
+        results[backend.name] = {
+            "dumps_event_ns": _ns_per_record(backend.dumps, events),
+            "dumps_row_ns": _ns_per_record(backend.dumps, rows),
+            "loads_event_ns": _ns_per_record(backend.loads, event_bytes),
+        }
+    for backend in backends:
+        results[backend.name]["producer_saving_ns"] = \
+            results["producer_event_legacy_ns"] - results[backend.name]["dumps_event_ns"]
+    print(json.dumps({
+        "records": n,
+        "identical_bytes": [b.name for b in backends],
+        "default_backend": serializers.get_serializer().name,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
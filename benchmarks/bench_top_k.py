@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_top_k
+    :Actions: Accuracy, memory and throughput of the Space-Saving top-K categories against exact counts
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Events come from the load generator with Zipf distributed categories. For
+every store the reported top-K is compared to the exact top-K: recall is
+the share of true top-K categories reported, and every estimate must be
+within the Space-Saving bound of total / capacity. The per store category
+sums the KDA application writes, ranked by top_k.rank_category_sums, must
+give the exact top-K of every store, however busy the other stores are.
+
+Usage: python benchmarks/bench_top_k.py [events] [k] [capacity]
+"""
+
+import collections
+import json
+import sys
+import time
+import tracemalloc
+
+import _paths  # noqa: F401
+from stream_common import top_k
+from stream_common.load_generator import LoadGenerator
+
+START = 1612101600.0
+CARDINALITIES = [100, 10000, 100000]
+STORES = 20
+
+
+def exact_window(rows):
+    """ Exact per store revenue and count totals, the baseline the sketch replaces """
+    revenue = collections.defaultdict(collections.Counter)
+    count = collections.defaultdict(collections.Counter)
+    for _, store_id, category, sales in rows:
+        revenue[store_id][category] += sales
+        count[store_id][category] += 1
+    return revenue, count
+
+
+def _measure(fn, rows):
+    tracemalloc.start()
+    result = fn(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    _t = time.perf_counter()
+    fn(rows)
+    return result, time.perf_counter() - _t, peak
+
+
+def _sketch(k, capacity):
+    def _run(rows):
+        # One window holding every row, so the sketch sees the whole stream
+        return list(top_k.top_k_window(iter(rows), 10 ** 9, k, capacity))[0][1]
+    return _run
+
+
+def check(sketch, exact, k, capacity):
+    revenue, count = exact
+    recalls = []
+    for store_id, (by_revenue, by_count) in sketch.items():
+        for reported, truth in ((by_revenue, revenue[store_id]), (by_count, count[store_id])):
+            total = sum(truth.values())
+            true_top = {c for c, _ in truth.most_common(k)}
+            recalls.append(len(true_top & {c for c, _, _ in reported}) / len(true_top))
+            for category, estimate, error in reported:
+                # Space-Saving overestimates by at most the error it carries, itself at most total / capacity
+                assert truth[category] - 1e-6 <= estimate <= truth[category] + error + 1e-6, category
+                assert error <= total / capacity + 1e-6
+    return round(min(recalls), 3), round(sum(recalls) / len(recalls), 4)
+
+
+def check_kda_ranking(exact, k):
+    """ Rank DEST_SQL_STREAM_TOP_CATEGORIES style rows of one window, compare with the exact top-K """
+    revenue, count = exact
+    timestamp = "2021-01-31 14:01:00.000"
+    sums = [{"store_id": store_id, "category": category, "revenue": total,
+             "sales_count": count[store_id][category], "timestamp": timestamp}
+            for store_id, categories in revenue.items() for category, total in categories.items()]
+    (window_end, stores), = top_k.rank_category_sums(sums, k)
+    assert set(stores) == set(revenue), "a store lost its categories"
+    for store_id, (by_revenue, by_count) in stores.items():
+        # Compare values, ties may rank either category first
+        assert [v for _, v, _ in by_revenue] == [v for _, v in revenue[store_id].most_common(k)], store_id
+        assert [v for _, v, _ in by_count] == [v for _, v in count[store_id].most_common(k)], store_id
+        assert all(revenue[store_id][c] == v for c, v, _ in by_revenue)
+        assert all(count[store_id][c] == v for c, v, _ in by_count)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    capacity = int(sys.argv[3]) if len(sys.argv) > 3 else top_k.DEFAULT_CAPACITY
+    results = []
+    for cardinality in CARDINALITIES:
+        events = LoadGenerator(seed=7, stores=STORES, categories=cardinality,
+                               category_skew=1.1, max_sales=100, start_time=START).batch(n)
+        rows = list(top_k.to_category_rows(events))
+        exact, exact_s, exact_peak = _measure(exact_window, rows)
+        sketch, sketch_s, sketch_peak = _measure(_sketch(k, capacity), rows)
+        min_recall, mean_recall = check(sketch, exact, k, capacity)
+        check_kda_ranking(exact, k)
+        results.append({
+            "categories": cardinality,
+            "min_recall": min_recall,
+            "mean_recall": mean_recall,
+            "exact_events_per_s": round(n / exact_s),
+            "sketch_events_per_s": round(n / sketch_s),
+            "exact_peak_mb": round(exact_peak / 1024 / 1024, 2),
+            "sketch_peak_mb": round(sketch_peak / 1024 / 1024, 2),
+        })
+    print(json.dumps({"events": n, "stores": STORES, "k": k, "capacity": capacity,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
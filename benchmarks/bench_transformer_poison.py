@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_transformer_poison
+    :Actions: Mix good and poison records and check the transformer isolates the failures
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Runs with the default configuration, the poison includes records shaped
+like a single JSON object, which take the no round trip path.
+
+Usage: python benchmarks/bench_transformer_poison.py [records_per_batch]
+"""
+
+import base64
+import json
+import logging
+import random
+import sys
+import time
+
+import _paths  # noqa: F401
+import kinesis_firehose_transformer as transformer
+
+RATIOS = [0.0, 0.001, 0.01, 0.1, 0.5]
+
+# One of each failure, as base64 strings firehose could hand us
+POISON = [
+    ("invalid_base64", "not*base64!"),
+    ("invalid_utf8", base64.b64encode(b'\xff\xfe{"store_id": 1}').decode("utf-8")),
+    ("invalid_json", base64.b64encode(b'{"store_id": "store_1", "revenue": }').decode("utf-8")),
+    # Shaped like a plain JSON object, {...} without a newline
+    ("invalid_utf8", base64.b64encode(b'{"a":"\xff\xfe"}').decode("utf-8")),
+    ("invalid_json", base64.b64encode(b'{not json at all}').decode("utf-8")),
+]
+
+
+def make_batch(n, ratio, seed=7):
+    rnd = random.Random(seed)
+    records = []
+    expected = {}
+    for i in range(n):
+        rid = f"record-{i}"
+        if rnd.random() < ratio:
+            reason, data = POISON[i % len(POISON)]
+        else:
+            reason = None
+            data = base64.b64encode(json.dumps({
+                "store_id": f"store_{i % 5 + 1}",
+                "revenue": 8671.3125,
+                "timestamp": "2021-01-31 14:47:00.000"
+            }).encode("utf-8")).decode("utf-8")
+        records.append({"recordId": rid, "data": data})
+        expected[rid] = reason
+    return {"records": records}, expected
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logging.getLogger().setLevel(logging.ERROR)
+    transformer.GlobalArgs.METRICS_ENABLED = False
+    results = []
+    for ratio in RATIOS:
+        event, expected = make_batch(n, ratio)
+        _t = time.perf_counter()
+        out = transformer.lambda_handler(event, None)["records"]
+        elapsed = time.perf_counter() - _t
+
+        assert len(out) == n
+        ok = 0
+        for rec in out:
+            if expected[rec["recordId"]] is None:
+                assert rec["result"] == "Ok", rec
+                ok += 1
+            else:
+                assert rec["result"] == transformer.GlobalArgs.FAILED_RECORD_RESULT, rec
+        results.append({
+            "poison_ratio": ratio,
+            "ok": ok,
+            "failed": n - ok,
+            "records_per_s": round(n / elapsed),
+        })
+    print(json.dumps({"records_per_batch": n, "strict_json": transformer.GlobalArgs.STRICT_JSON, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
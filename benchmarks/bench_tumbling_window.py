@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: bench_tumbling_window
+    :Actions: Replay synthetic events through the local tumbling window engine
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Usage: python benchmarks/bench_tumbling_window.py [num_events] [num_stores]
+"""
+
+import datetime
+import json
+import random
+import sys
+import time
+
+import _paths  # noqa: F401
+from stream_common import tumbling_window
+
+
+def _events(n, num_stores, events_per_s=5000, seed=7):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2021, 1, 31, 14, 5, 0)
+    for i in range(n):
+        yield {
+            "category": "Books",
+            "store_id": f"store_{rnd.randint(1, num_stores)}",
+            "evnt_time": (start + datetime.timedelta(seconds=i / events_per_s)).isoformat(),
+            "sales": round(rnd.random() * 100, 2)
+        }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    num_stores = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    events = list(_events(n, num_stores))
+    # Pre-parsed rows isolate the window operator from the JSON/timestamp parsing cost
+    rows = list(tumbling_window.to_rows(events))
+
+    _t = time.perf_counter()
+    out = list(tumbling_window.run(events))
+    full_s = time.perf_counter() - _t
+
+    _t = time.perf_counter()
+    windows = sum(1 for _ in tumbling_window.tumbling_window(rows))
+    window_s = time.perf_counter() - _t
+
+    print(json.dumps({
+        "events": n,
+        "stores": num_stores,
+        "windows": windows,
+        "output_rows": len(out),
+        "sample_row": out[0],
+        "full_chain_events_per_s": round(n / full_s),
+        "window_operator_rows_per_s": round(n / window_s),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: fakes
+    :Actions: Local stand-ins for kinesis, firehose and the lambda context, shared by the benchmarks
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+StubKinesisClient accepts everything except a random failure_rate share of
+entries, and keeps the accepted payloads with keep_data. StubKinesisStream routes records to shards by ExplicitHashKey or
+the MD5 of the partition key, enforces the per-shard 1000 records/s and
+1MB/s write limits and sleeps for a fixed latency per call, like a network
+round trip. StubFirehoseClient keeps the records written to it.
+StubS3Client keeps objects in memory and sleeps for a fixed latency per
+request, the per-object overhead that small files pay.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+
+MAX_HASH_KEY = 2 ** 128 - 1
+
+
+def _shard_list(shard_count):
+    width = (MAX_HASH_KEY + 1) // shard_count
+    return {"Shards": [{
+        "ShardId": f"shardId-{i:012d}",
+        "HashKeyRange": {
+            "StartingHashKey": str(i * width),
+            "EndingHashKey": str(MAX_HASH_KEY if i == shard_count - 1 else (i + 1) * width - 1)
+        },
+        "SequenceNumberRange": {"StartingSequenceNumber": "1"}
+    } for i in range(shard_count)]}
+
+
+class StubKinesisClient:
+    """ Stand-in for the boto3 kinesis client, randomly failing a fraction of entries """
+
+    def __init__(self, failure_rate=0.0, seed=7, keep_data=False):
+        self.failure_rate = failure_rate
+        self.rnd = random.Random(seed)
+        self.calls = 0
+        self.records = 0
+        # Payloads of the accepted entries, when keep_data is set
+        self.data = [] if keep_data else None
+
+    def list_shards(self, StreamName, **kwargs):
+        return _shard_list(1)
+
+    def put_records(self, Records, StreamName):
+        self.calls += 1
+        results = []
+        failed = 0
+        for record in Records:
+            if self.rnd.random() < self.failure_rate:
+                failed += 1
+                results.append({
+                    "ErrorCode": "ProvisionedThroughputExceededException",
+                    "ErrorMessage": "Rate exceeded for shard"
+                })
+            else:
+                self.records += 1
+                if self.data is not None:
+                    self.data.append(record["Data"])
+                results.append({"SequenceNumber": "1", "ShardId": "shardId-000000000000"})
+        return {"FailedRecordCount": failed, "Records": results}
+
+
+class StubKinesisStream:
+    """ Thread safe stand-in for a kinesis stream with per-shard write limits """
+
+    def __init__(self, shard_count, call_latency_s, records_per_s=1000, bytes_per_s=1024 * 1024):
+        self.shard_count = shard_count
+        self.call_latency_s = call_latency_s
+        self.records_per_s = records_per_s
+        self.bytes_per_s = bytes_per_s
+        self._width = (MAX_HASH_KEY + 1) // shard_count
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._second = None
+        self._usage = [[0, 0] for _ in range(shard_count)]
+        self.accepted = 0
+        self.throttled = 0
+        self.calls = 0
+
+    def list_shards(self, StreamName, **kwargs):
+        return _shard_list(self.shard_count)
+
+    def _shard(self, record):
+        if "ExplicitHashKey" in record:
+            hash_key = int(record["ExplicitHashKey"])
+        else:
+            hash_key = int(hashlib.md5(
+                record["PartitionKey"].encode("utf-8")).hexdigest(), 16)
+        return min(hash_key // self._width, self.shard_count - 1)
+
+    def put_records(self, Records, StreamName):
+        time.sleep(self.call_latency_s)
+        results = []
+        failed = 0
+        with self._lock:
+            self.calls += 1
+            _second = int(time.monotonic() - self._t0)
+            if _second != self._second:
+                self._second = _second
+                self._usage = [[0, 0] for _ in range(self.shard_count)]
+            for record in Records:
+                usage = self._usage[self._shard(record)]
+                size = len(record["Data"]) + len(record["PartitionKey"])
+                if usage[0] + 1 > self.records_per_s or usage[1] + size > self.bytes_per_s:
+                    failed += 1
+                    self.throttled += 1
+                    results.append({
+                        "ErrorCode": "ProvisionedThroughputExceededException",
+                        "ErrorMessage": "Rate exceeded for shard"
+                    })
+                else:
+                    usage[0] += 1
+                    usage[1] += size
+                    self.accepted += 1
+                    results.append({"SequenceNumber": "1", "ShardId": "shardId-000000000000"})
+        return {"FailedRecordCount": failed, "Records": results}
+
+
+class StubFirehoseClient:
+    """ Stand-in for the boto3 firehose client, keeping every accepted record """
+
+    def __init__(self, failure_rate=0.0, seed=7):
+        self.failure_rate = failure_rate
+        self.rnd = random.Random(seed)
+        self.calls = 0
+        self.records = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        self.calls += 1
+        responses = []
+        failed = 0
+        for record in Records:
+            if self.rnd.random() < self.failure_rate:
+                failed += 1
+                responses.append({"ErrorCode": "ServiceUnavailableException",
+                                  "ErrorMessage": "Slow down."})
+            else:
+                self.records.append(record["Data"])
+                responses.append({"RecordId": str(len(self.records))})
+        return {"FailedPutCount": failed, "Encrypted": False, "RequestResponses": responses}
+
+
+class StubS3Client:
+    """ Stand-in for the boto3 s3 client, objects kept in memory, request_latency_s per call """
+
+    def __init__(self, request_latency_s=0.0):
+        self.request_latency_s = request_latency_s
+        self.objects = {}
+        self.requests = 0
+
+    def _request(self):
+        self.requests += 1
+        if self.request_latency_s:
+            time.sleep(self.request_latency_s)
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, ContinuationToken=None):
+        self._request()
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and
+                      (ContinuationToken is None or k > ContinuationToken))
+        page = keys[:MaxKeys]
+        resp = {"Contents": [{"Key": k, "Size": len(self.objects[k])} for k in page],
+                "IsTruncated": len(keys) > MaxKeys}
+        if resp["IsTruncated"]:
+            resp["NextContinuationToken"] = page[-1]
+        return resp
+
+    def get_object(self, Bucket, Key):
+        self._request()
+        return {"Body": io.BytesIO(self.objects[Key]), "ContentLength": len(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self._request()
+        self.objects[Key] = Body if isinstance(Body, bytes) else Body.read()
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self._request()
+        self.objects.pop(Key, None)
+        return {}
+
+
+class DeadlineContext:
+    """ Lambda context whose remaining time runs out after the given seconds """
+
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def producer_events(n):
+    """ (payload, partition key) pairs shaped like the producer events """
+    for i in range(n):
+        yield json.dumps({
+            "category": "Books",
+            "store_id": f"store_{i % 5 + 1}",
+            "evnt_time": "2021-01-31T14:05:47.190114",
+            "sales": 22.78
+        }), f"{i:08x}-0000-4000-8000-000000000000"
+
+
+def firehose_event(records=500, record_bytes=80, poison_ratio=0.0, seed=7):
+    """
+    Firehose transformation event of KDA output rows, padded to about
+    record_bytes of JSON each. A poison_ratio share carries invalid base64.
+    """
+    rnd = random.Random(seed)
+    out = []
+    for i in range(records):
+        if poison_ratio and rnd.random() < poison_ratio:
+            data = "not*base64!"
+        else:
+            row = {
+                "store_id": f"store_{i % 5 + 1}",
+                "revenue": round(rnd.random() * 10000, 4),
+                "timestamp": "2021-01-31 14:47:00.000"
+            }
+            _pad = record_bytes - len(json.dumps(row)) - 12
+            if _pad > 0:
+                row["padding"] = "x" * _pad
+            data = base64.b64encode(json.dumps(row).encode("utf-8")).decode("utf-8")
+        out.append({
+            "recordId": f"49546986683135544286507457936321625675700192471156785154{i:010d}",
+            "approximateArrivalTimestamp": 1612104420000,
+            "data": data
+        })
+    return {
+        "invocationId": "invocationIdExample",
+        "deliveryStreamArn": "arn:aws:kinesis:EXAMPLE",
+        "region": "us-east-1",
+        "records": out
+    }
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: run_suite
+    :Actions: Run the pipeline code paths against local stand-ins and record comparable results
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Every case reports records/s, p50/p99 latency per batch and the peak
+tracemalloc memory of a single batch. A batch is one PutRecords call for
+the producer, one invocation for the transformer and one chunk of events
+for the window aggregations. Memory is measured in a separate run, so
+tracing does not slow down the timed runs.
+
+Results are written to benchmarks/results/<commit>.json. Pass an earlier
+file to --compare to print the change per case, the exit code is 1 when a
+case lost more than --threshold of its throughput.
+
+Usage: python benchmarks/run_suite.py [--quick] [--cases producer,transformer,window] [--compare results/abc123.json]
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import _paths
+import kinesis_firehose_transformer as transformer
+import stream_data_producer as producer
+from fakes import DeadlineContext, StubKinesisClient, firehose_event
+from stream_common import tumbling_window
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# (records per batch, bytes per record)
+TRANSFORMER_BATCHES = [(500, 100), (500, 1024), (5000, 100), (20000, 100)]
+TRANSFORMER_BATCHES_QUICK = [(500, 100), (5000, 100)]
+
+
+class TimedKinesisClient(StubKinesisClient):
+    """ Stub client that keeps the time of every PutRecords call """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.call_times = []
+
+    def put_records(self, Records, StreamName):
+        self.call_times.append(time.perf_counter())
+        return super().put_records(Records, StreamName)
+
+
+def _percentile(sorted_values, q):
+    """ Nearest rank percentile of an ascending list """
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _summary(records, seconds, latencies_s, peak_bytes, **extra):
+    latencies_ms = sorted(l * 1000 for l in latencies_s)
+    result = {
+        "records": records,
+        "batches": len(latencies_ms),
+        "seconds": round(seconds, 4),
+        "records_per_s": round(records / seconds) if seconds else None,
+        "batch_latency_ms": {
+            "p50": round(_percentile(latencies_ms, 50), 4) if latencies_ms else None,
+            "p99": round(_percentile(latencies_ms, 99), 4) if latencies_ms else None,
+        },
+        "peak_memory_mb": round(peak_bytes / 1024 / 1024, 3),
+    }
+    result.update(extra)
+    return result
+
+
+def _peak_memory(fn, *args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _timed_batches(run_batch, batches):
+    """ Time run_batch(i) for every batch, returns (records, seconds, latencies) """
+    records = 0
+    latencies = []
+    _start = time.perf_counter()
+    for i in range(batches):
+        _t = time.perf_counter()
+        records += run_batch(i)
+        latencies.append(time.perf_counter() - _t)
+    return records, time.perf_counter() - _start, latencies
+
+
+def _run_producer(seconds):
+    client = TimedKinesisClient()
+    producer.client = client
+    margin_s = producer.GlobalArgs.DEADLINE_MARGIN_MS / 1000
+    # The handler prints its EMF metrics line to stdout
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        _t = time.perf_counter()
+        resp = producer.lambda_handler({}, DeadlineContext(seconds + margin_s))
+        elapsed = time.perf_counter() - _t
+    return client, json.loads(resp["body"])["message"], elapsed
+
+
+def bench_producer(quick):
+    seconds = 1 if quick else 3
+    # The stub has no shard limits, pacing would only measure the configured rate
+    producer.GlobalArgs.RATE_CONTROL_ENABLED = False
+    client, message, elapsed = _run_producer(seconds)
+    times = client.call_times
+    latencies = [b - a for a, b in zip(times, times[1:])]
+    peak = _peak_memory(_run_producer, 0.2)
+    return {"producer_handler": _summary(
+        client.records, elapsed, latencies, peak, put_calls=client.calls,
+        events=message.get("record_count"))}
+
+
+def bench_transformer(quick):
+    results = {}
+    for records, record_bytes in (TRANSFORMER_BATCHES_QUICK if quick else TRANSFORMER_BATCHES):
+        batches = 5 if quick else 20
+        events = [firehose_event(records, record_bytes, seed=b) for b in range(min(batches, 4))]
+
+        def _run(i):
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                return len(transformer.lambda_handler(events[i % len(events)], None)["records"])
+
+        total, seconds, latencies = _timed_batches(_run, batches)
+        results[f"transformer_handler[records={records},bytes={record_bytes}]"] = _summary(
+            total, seconds, latencies, _peak_memory(_run, 0))
+    return results
+
+
+def _window_events(n, num_stores=100, events_per_s=5000, max_disorder_s=5, seed=7):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2021, 1, 31, 14, 0, 0)
+    events = []
+    for i in range(n):
+        _ts = start + datetime.timedelta(
+            seconds=i / events_per_s - rnd.random() * max_disorder_s)
+        events.append({
+            "category": "Books",
+            "store_id": f"store_{rnd.randint(1, num_stores)}",
+            "evnt_time": _ts.isoformat(),
+            "sales": round(rnd.random() * 100, 2)
+        })
+    return events
+
+
+def bench_window(quick):
+    chunk = 20000 if quick else 100000
+    batches = 3 if quick else 10
+    chunks = [_window_events(chunk, seed=b) for b in range(min(batches, 3))]
+    results = {}
+    for name, kwargs in (
+        ("tumbling_window", {}),
+        ("event_time_window", {"event_time": True,
+         "watermark_delay_seconds": 5, "allowed_lateness_seconds": 60}),
+        ("hopping_window", {"slide_seconds": 10}),
+    ):
+        def _run(i):
+            for _ in tumbling_window.run(chunks[i % len(chunks)], 60, **kwargs):
+                pass
+            return chunk
+
+        total, seconds, latencies = _timed_batches(_run, batches)
+        results[name] = _summary(total, seconds, latencies, _peak_memory(_run, 0))
+    return results
+
+
+CASES = {
+    "producer": bench_producer,
+    "transformer": bench_transformer,
+    "window": bench_window,
+}
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ["git"] + list(args), cwd=_paths.REPO_ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        ).stdout.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """ Per case change in throughput and p99, with the cases that regressed """
+    changes = {}
+    regressions = []
+    for case, result in new["cases"].items():
+        before = old.get("cases", {}).get(case)
+        if not before or not before.get("records_per_s") or not result.get("records_per_s"):
+            continue
+        _rate = result["records_per_s"] / before["records_per_s"] - 1
+        change = {"records_per_s": round(_rate, 4)}
+        if before["batch_latency_ms"]["p99"] and result["batch_latency_ms"]["p99"]:
+            change["p99"] = round(
+                result["batch_latency_ms"]["p99"] / before["batch_latency_ms"]["p99"] - 1, 4)
+        changes[case] = change
+        if _rate < -threshold:
+            regressions.append(case)
+    return {"against": old.get("commit"), "threshold": threshold,
+            "changes": changes, "regressions": regressions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the producer, transformer and window aggregation locally")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, for a smoke test")
+    parser.add_argument("--cases", default=",".join(CASES),
+                        help="Comma separated subset of " + ",".join(CASES))
+    parser.add_argument("--output", help="Results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Throughput loss that counts as a regression")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    commit = _git("rev-parse", "--short", "HEAD")
+    results = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "cases": {},
+    }
+    for name in args.cases.split(","):
+        results["cases"].update(CASES[name.strip()](args.quick))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{commit or 'unknown'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    report = {"output": output, "cases": results["cases"]}
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare(json.load(f), results, args.threshold)
+    print(json.dumps(report, indent=2))
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
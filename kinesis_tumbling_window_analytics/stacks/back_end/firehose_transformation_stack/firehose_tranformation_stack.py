@@ -1,5 +1,6 @@
 from aws_cdk import core
 from aws_cdk import aws_kinesisfirehose as _kinesis_fh
+from aws_cdk import aws_glue as _glue
 from aws_cdk import aws_lambda as _lambda
 from aws_cdk import aws_iam as _iam
 from aws_cdk import aws_logs as _logs
@@ -26,6 +27,11 @@ class FirehoseTransformationStack(core.Stack):
         scope: core.Construct,
         construct_id: str,
         stack_log_level: str,
+        dynamic_partitioning: bool = False,
+        parquet_output: bool = False,
+        top_categories_output: bool = False,
+        hopping_output: bool = False,
+        late_sales_output: bool = False,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -41,32 +47,35 @@ class FirehoseTransformationStack(core.Stack):
 
         firehose_delivery_stream_name = f"revenue_analytics_stream"
 
-        # Firehose Lambda Transformer
-        # Read Lambda Code
-        try:
-            with open("kinesis_tumbling_window_analytics/stacks/back_end/firehose_transformation_stack/lambda_src/kinesis_firehose_transformer.py",
-                      encoding="utf-8",
-                      mode="r"
-                      ) as f:
-                fh_transformer_fn_code = f.read()
-        except OSError:
-            print("Unable to read Lambda Function Code")
-            raise
+        # Shared code for the lambda functions, KPL de-aggregation
+        stream_common_layer = _lambda.LayerVersion(
+            self,
+            "streamCommonLayer",
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/lambda_layers/stream_common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_7],
+            description="Shared code for the stream producer, transformer and consumers"
+        )
 
+        # Firehose Lambda Transformer
         fh_transformer_fn = _lambda.Function(
             self,
             "fhDataTransformerFn",
             function_name=f"fh_data_transformer",
             description="Transform incoming data events with newline character",
             runtime=_lambda.Runtime.PYTHON_3_7,
-            code=_lambda.InlineCode(
-                fh_transformer_fn_code),
-            handler="index.lambda_handler",
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/firehose_transformation_stack/lambda_src"),
+            handler="kinesis_firehose_transformer.lambda_handler",
+            layers=[stream_common_layer],
             timeout=core.Duration.seconds(5),
             reserved_concurrent_executions=1,
             environment={
                 "LOG_LEVEL": "INFO",
                 "APP_ENV": "Production",
+                "FAILED_RECORD_RESULT": "ProcessingFailed",
+                "STRICT_JSON": "true",
+                "EMIT_PARTITION_KEYS": "true" if dynamic_partitioning else "false"
             }
         )
 
@@ -134,6 +143,102 @@ class FirehoseTransformationStack(core.Stack):
         roleStmt3.sid = "AllowKinesisToInvokeLambda"
         fh_delivery_role.add_to_policy(roleStmt3)
 
+        # Parquet output, firehose converts the JSON rows using the schema of this glue table
+        fh_format_conversion = None
+        if parquet_output:
+            revenue_db = _glue.CfnDatabase(
+                self,
+                "revenueAnalyticsDb",
+                catalog_id=core.Aws.ACCOUNT_ID,
+                database_input=_glue.CfnDatabase.DatabaseInputProperty(
+                    name="revenue_analytics"
+                )
+            )
+            # Same columns as DEST_SQL_STREAM_BY_STORE_ID
+            revenue_table = _glue.CfnTable(
+                self,
+                "revenueAnalyticsTable",
+                catalog_id=core.Aws.ACCOUNT_ID,
+                database_name="revenue_analytics",
+                table_input=_glue.CfnTable.TableInputProperty(
+                    name="store_revenue_per_min",
+                    table_type="EXTERNAL_TABLE",
+                    parameters={"classification": "parquet"},
+                    storage_descriptor=_glue.CfnTable.StorageDescriptorProperty(
+                        columns=[
+                            _glue.CfnTable.ColumnProperty(
+                                name="store_id", type="string"),
+                            _glue.CfnTable.ColumnProperty(
+                                name="revenue", type="float"),
+                            _glue.CfnTable.ColumnProperty(
+                                name="timestamp", type="timestamp"),
+                        ],
+                        location=f"s3://{fh_data_store.bucket_name}/sales_revenue/",
+                        input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                        output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                        serde_info=_glue.CfnTable.SerdeInfoProperty(
+                            serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                        )
+                    )
+                )
+            )
+            revenue_table.add_depends_on(revenue_db)
+
+            roleStmt4 = _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                resources=[
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:catalog",
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:database/revenue_analytics",
+                    f"arn:aws:glue:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:table/revenue_analytics/store_revenue_per_min"
+                ],
+                actions=[
+                    "glue:GetTable",
+                    "glue:GetTableVersion",
+                    "glue:GetTableVersions"
+                ]
+            )
+            roleStmt4.sid = "AllowKinesisToReadGlueSchema"
+            fh_delivery_role.add_to_policy(roleStmt4)
+
+            fh_format_conversion = _kinesis_fh.CfnDeliveryStream.DataFormatConversionConfigurationProperty(
+                enabled=True,
+                input_format_configuration=_kinesis_fh.CfnDeliveryStream.InputFormatConfigurationProperty(
+                    deserializer=_kinesis_fh.CfnDeliveryStream.DeserializerProperty(
+                        open_x_json_ser_de=_kinesis_fh.CfnDeliveryStream.OpenXJsonSerDeProperty()
+                    )
+                ),
+                output_format_configuration=_kinesis_fh.CfnDeliveryStream.OutputFormatConfigurationProperty(
+                    serializer=_kinesis_fh.CfnDeliveryStream.SerializerProperty(
+                        parquet_ser_de=_kinesis_fh.CfnDeliveryStream.ParquetSerDeProperty(
+                            compression="SNAPPY"
+                        )
+                    )
+                ),
+                schema_configuration=_kinesis_fh.CfnDeliveryStream.SchemaConfigurationProperty(
+                    catalog_id=core.Aws.ACCOUNT_ID,
+                    database_name="revenue_analytics",
+                    table_name="store_revenue_per_min",
+                    region=core.Aws.REGION,
+                    role_arn=fh_delivery_role.role_arn,
+                    version_id="LATEST"
+                )
+            )
+
+        # Partition by the keys the transformer returns, so per-store or per-day reads touch only their objects
+        if dynamic_partitioning:
+            fh_prefix = "sales_revenue/store_id=!{partitionKeyFromLambda:store_id}/date=!{partitionKeyFromLambda:date}/hour=!{partitionKeyFromLambda:hour}/"
+            fh_error_prefix = "sales_revenue_errors/!{firehose:error-output-type}/date=!{timestamp:yyyy}-!{timestamp:MM}-!{timestamp:dd}/"
+            # Dynamic partitioning needs a buffer of at least 64MB
+            fh_buffer_size_mb = 64
+        else:
+            fh_prefix = "sales_revenue/"
+            fh_error_prefix = None
+            fh_buffer_size_mb = 1
+        if parquet_output:
+            # Format conversion also needs a buffer of at least 64MB
+            fh_buffer_size_mb = 64
+            fh_error_prefix = fh_error_prefix or "sales_revenue_errors/!{firehose:error-output-type}/"
+
         self.fh_to_s3 = _kinesis_fh.CfnDeliveryStream(
             self,
             "fhDeliveryStream",
@@ -142,10 +247,12 @@ class FirehoseTransformationStack(core.Stack):
                 bucket_arn=fh_data_store.bucket_arn,
                 buffering_hints=_kinesis_fh.CfnDeliveryStream.BufferingHintsProperty(
                     interval_in_seconds=60,
-                    size_in_m_bs=1
+                    size_in_m_bs=fh_buffer_size_mb
                 ),
                 compression_format="UNCOMPRESSED",
-                prefix=f"sales_revenue/",
+                prefix=fh_prefix,
+                error_output_prefix=fh_error_prefix,
+                data_format_conversion_configuration=fh_format_conversion,
                 # prefix="sales_revenue/date=!{timestamp:yyyy}-!{timestamp:MM}-!{timestamp:dd}/",
                 role_arn=fh_delivery_role.role_arn,
                 processing_configuration=_kinesis_fh.CfnDeliveryStream.ProcessingConfigurationProperty(
@@ -165,6 +272,13 @@ class FirehoseTransformationStack(core.Stack):
             ),
         )
 
+        if dynamic_partitioning:
+            # Not modelled by this version of the CDK construct yet
+            self.fh_to_s3.add_property_override(
+                "ExtendedS3DestinationConfiguration.DynamicPartitioningConfiguration",
+                {"Enabled": True}
+            )
+
         # Restrict Transformer Lambda to be invoked by Firehose only from the stack owner account
         _lambda.CfnPermission(
             self,
@@ -176,6 +290,23 @@ class FirehoseTransformationStack(core.Stack):
             source_arn=self.fh_to_s3.attr_arn,
         )
 
+        # Rows of the other KDA outputs do not fit the revenue schema, each gets its own stream and prefix
+        self.top_categories_fh = None
+        if top_categories_output:
+            self.top_categories_fh = self._side_delivery_stream(
+                "fhTopCategoriesStream", "top_categories_stream", "top_categories/",
+                fh_data_store, fh_delivery_role, fh_transformer_fn)
+        self.hopping_fh = None
+        if hopping_output:
+            self.hopping_fh = self._side_delivery_stream(
+                "fhHoppingRevenueStream", "hopping_revenue_stream", "hopping_revenue/",
+                fh_data_store, fh_delivery_role, fh_transformer_fn)
+        self.late_sales_fh = None
+        if late_sales_output:
+            self.late_sales_fh = self._side_delivery_stream(
+                "fhLateSalesStream", "late_sales_stream", "late_sales/",
+                fh_data_store, fh_delivery_role, fh_transformer_fn)
+
         ###########################################
         ################# OUTPUTS #################
         ###########################################
@@ -199,7 +330,73 @@ class FirehoseTransformationStack(core.Stack):
             description="The firehose datastore bucket"
         )
 
+    def _side_delivery_stream(self, construct_id, stream_name, prefix, bucket, role, transformer_fn):
+        """ A delivery stream of plain NDJSON under prefix, through the same transformer """
+        log_stmt = _iam.PolicyStatement(
+            effect=_iam.Effect.ALLOW,
+            resources=[
+                f"arn:aws:logs:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:log-group:/aws/kinesisfirehose/{stream_name}:log-stream:*"
+            ],
+            actions=[
+                "logs:PutLogEvents"
+            ]
+        )
+        role.add_to_policy(log_stmt)
+
+        fh_stream = _kinesis_fh.CfnDeliveryStream(
+            self,
+            construct_id,
+            delivery_stream_name=stream_name,
+            extended_s3_destination_configuration=_kinesis_fh.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+                bucket_arn=bucket.bucket_arn,
+                buffering_hints=_kinesis_fh.CfnDeliveryStream.BufferingHintsProperty(
+                    interval_in_seconds=60,
+                    size_in_m_bs=1
+                ),
+                compression_format="UNCOMPRESSED",
+                prefix=prefix,
+                role_arn=role.role_arn,
+                processing_configuration=_kinesis_fh.CfnDeliveryStream.ProcessingConfigurationProperty(
+                    enabled=True,
+                    processors=[
+                        _kinesis_fh.CfnDeliveryStream.ProcessorProperty(
+                            parameters=[
+                                _kinesis_fh.CfnDeliveryStream.ProcessorParameterProperty(
+                                    parameter_name="LambdaArn",
+                                    parameter_value=transformer_fn.function_arn,
+                                )
+                            ],
+                            type="Lambda",
+                        )
+                    ]
+                ),
+            ),
+        )
+
+        _lambda.CfnPermission(
+            self,
+            f"{construct_id}LambdaInvocation",
+            action="lambda:InvokeFunction",
+            function_name=transformer_fn.function_arn,
+            principal="firehose.amazonaws.com",
+            source_account=core.Aws.ACCOUNT_ID,
+            source_arn=fh_stream.attr_arn,
+        )
+        return fh_stream
+
     # properties to share with other stacks
     @property
     def get_fh_stream(self):
         return self.fh_to_s3
+
+    @property
+    def get_top_categories_fh_stream(self):
+        return self.top_categories_fh
+
+    @property
+    def get_hopping_fh_stream(self):
+        return self.hopping_fh
+
+    @property
+    def get_late_sales_fh_stream(self):
+        return self.late_sales_fh
@@ -7,10 +7,17 @@
 .. contactauthor:: miztiik@github issues
 """
 
-import json
 import base64
+import binascii
 import logging
 import os
+import re
+import time
+
+from stream_common.kpl_aggregation import deaggregate
+from stream_common.metrics import BATCH_RECORDS_BUCKETS, LATENCY_BUCKETS_MS, Metrics
+from stream_common.serializer import get_serializer
+from stream_common.structured_logging import BatchSummary, LogSampler, lazy_json, set_logging
 
 # X-Ray SDK: instrument all SDKs
 # from aws_xray_sdk.core import xray_recorder
@@ -29,53 +36,190 @@ class GlobalArgs:
     ENVIRONMENT = "production"
     MODULE_NAME = "kinesis_firehose_transformer"
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    # Share of failed records logged one by one at DEBUG, every failure is still counted
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+    # Longest event or payload put in a log line, firehose batches reach 6MB
+    LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 1024))
     ENCODING = "utf-8"
-
-
-def set_logging(lv=GlobalArgs.LOG_LEVEL):
-    """ Helper to enable logging """
-    logging.basicConfig(level=lv)
-    logger = logging.getLogger()
-    logger.setLevel(lv)
-    return logger
-
-
-logger = set_logging()
+    # Result for records that can not be transformed, ProcessingFailed or Dropped
+    FAILED_RECORD_RESULT = os.getenv(
+        "FAILED_RECORD_RESULT", "ProcessingFailed")
+    # Parse fast path payloads to reject invalid UTF-8 and JSON, false trusts anything shaped {...}
+    STRICT_JSON = os.getenv("STRICT_JSON", "true").lower() == "true"
+    # Return store_id/date/hour in metadata.partitionKeys for firehose dynamic partitioning
+    EMIT_PARTITION_KEYS = os.getenv(
+        "EMIT_PARTITION_KEYS", "false").lower() == "true"
+    # JSON backend, auto uses orjson when the layer has it
+    SERIALIZER = os.getenv("SERIALIZER", "auto")
+    # Publish one embedded metric format line per invocation
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_NAMESPACE = os.getenv(
+        "METRICS_NAMESPACE", "KinesisTumblingWindowAnalytics")
+
+
+# Pull the partition keys straight out of the bytes, escaped strings fall back to a full parse
+_STORE_ID_RE = re.compile(rb'"store_id"\s*:\s*"([^"\\]*)"')
+_TIMESTAMP_RE = re.compile(
+    rb'"timestamp"\s*:\s*"(\d{4}-\d{2}-\d{2})[ T](\d{2})[^"\\]*"')
+
+
+logger = set_logging(GlobalArgs.LOG_LEVEL)
+serializer = get_serializer(GlobalArgs.SERIALIZER)
+
+
+class RecordError(Exception):
+    """ A single record could not be transformed, reason is the failure counter name """
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _is_plain_json(payload):
+    """ Cheap shape check for a single newline-less JSON object, KPL aggregates start with magic bytes """
+    return payload[:1] == b"{" and payload[-1:] == b"}" and b"\n" not in payload
+
+
+def _load_json(data):
+    try:
+        return serializer.loads(data)
+    except UnicodeDecodeError as e:
+        raise RecordError("invalid_utf8", str(e))
+    except ValueError as e:
+        raise RecordError("invalid_json", str(e))
+
+
+def _partition_keys_from_event(event):
+    """ Partition keys of a parsed event, None when the fields are missing """
+    if not isinstance(event, dict):
+        return None
+    store_id = event.get("store_id")
+    timestamp = event.get("timestamp")
+    if not isinstance(store_id, str) or not isinstance(timestamp, str) or len(timestamp) < 13:
+        return None
+    return {"store_id": store_id, "date": timestamp[:10], "hour": timestamp[11:13]}
+
+
+def extract_partition_keys(payload):
+    """ store_id, date and hour of a JSON row, without parsing it when possible """
+    store_id = _STORE_ID_RE.search(payload)
+    timestamp = _TIMESTAMP_RE.search(payload)
+    if store_id and timestamp:
+        return {
+            "store_id": store_id.group(1).decode(GlobalArgs.ENCODING),
+            "date": timestamp.group(1).decode(GlobalArgs.ENCODING),
+            "hour": timestamp.group(2).decode(GlobalArgs.ENCODING)
+        }
+    return _partition_keys_from_event(_load_json(payload))
+
+
+def _aggregate_partition_keys(events):
+    """
+    Partition keys shared by every event of an aggregated record. An output
+    record lands in a single partition, so events of several stores or hours
+    can not be written under the keys of the first.
+    """
+    partition_keys = _partition_keys_from_event(events[0])
+    for event in events[1:]:
+        keys = _partition_keys_from_event(event)
+        if keys != partition_keys:
+            if keys is None:
+                raise RecordError("missing_partition_keys",
+                                  "store_id or timestamp not found")
+            raise RecordError("mixed_partition_keys",
+                              f"aggregated record holds events of {partition_keys} and {keys}")
+    return partition_keys
+
+
+def transform_record(record):
+    """ Build the firehose output record for one input record, in a single pass """
+    try:
+        payload = base64.b64decode(record["data"], validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise RecordError("invalid_base64", str(e))
+
+    if _is_plain_json(payload):
+        if GlobalArgs.STRICT_JSON:
+            _load_json(payload)
+        # Nothing to transform, append the delimiter without a parse/serialize round trip
+        trans_payload = payload + b"\n"
+        partition_keys = extract_partition_keys(
+            payload) if GlobalArgs.EMIT_PARTITION_KEYS else None
+    else:
+        try:
+            user_records = deaggregate(payload)
+        except (ValueError, IndexError) as e:
+            raise RecordError("invalid_aggregate", str(e))
+        events = [_load_json(user_record.data) for user_record in user_records]
+        # KPL aggregated records carry many user events, firehose expects exactly one output per recordId
+        _dumps = serializer.dumps
+        trans_payload = b"".join(_dumps(event) + b"\n" for event in events)
+        partition_keys = None
+        if GlobalArgs.EMIT_PARTITION_KEYS and events:
+            partition_keys = _aggregate_partition_keys(events)
+
+    output_record = {
+        "recordId": record["recordId"],
+        "result": "Ok",
+        "data": base64.b64encode(trans_payload).decode(GlobalArgs.ENCODING)
+    }
+    if GlobalArgs.EMIT_PARTITION_KEYS:
+        if partition_keys is None:
+            raise RecordError("missing_partition_keys",
+                              "store_id or timestamp not found")
+        output_record["metadata"] = {"partitionKeys": partition_keys}
+    return output_record
+
+
+def _publish_metrics(records, resp, elapsed_ms):
+    """
+    Batch level metrics as one EMF line, the per-record loop stays
+    uninstrumented. Byte counts are left to the firehose IncomingBytes metric,
+    summing them here costs more than the 2% budget.
+    """
+    metrics = Metrics(GlobalArgs.METRICS_NAMESPACE, {
+                      "ServiceName": GlobalArgs.MODULE_NAME})
+    metrics.histogram("TransformBatchTime", LATENCY_BUCKETS_MS,
+                      "Milliseconds").record(elapsed_ms)
+    metrics.histogram("TransformBatchRecords", BATCH_RECORDS_BUCKETS,
+                      "Count").record(len(records))
+    metrics.counter("RecordsIn", resp["total_records"])
+    metrics.counter("RecordsProcessed", resp["processed_records"])
+    metrics.counter("RecordsFailed", resp["total_records"] - resp["processed_records"])
+    metrics.flush()
 
 
 def lambda_handler(event, context):
     resp = {"status": False, "records": "", "total_sales": 0}
-    src_records = []
-    logger.info(f"Event: {json.dumps(event)}")
+    logger.info("Event: %s", lazy_json(event, GlobalArgs.LOG_MAX_CHARS))
 
     resp["total_records"] = len(event["records"])
 
-    for record in event["records"]:
-        payload = base64.b64decode(record["data"]).decode(GlobalArgs.ENCODING)
-
-        event = json.loads(payload)
-
-        src_records.append({
-            "recordId": record["recordId"],
-            "event": dict(event)  # copy of event
-        })
-
+    _t = time.perf_counter()
     output = []
-    successes = 0
-
-    for record in src_records:
-        event = record["event"]
-        # copy existing event
-        trans_event = dict(event)
-        trans_payload = json.dumps(trans_event) + "\n"
-        output_record = {
-            "recordId": record["recordId"],
-            "result": "Ok",
-            "data": base64.b64encode(trans_payload.encode(GlobalArgs.ENCODING)).decode(GlobalArgs.ENCODING)
-        }
-        successes += 1
-        output.append(output_record)
-
-    resp["processed_records"] = len(src_records)
-    logger.info(f"resp: {json.dumps(resp)}")
+    failures = BatchSummary(max_chars=GlobalArgs.LOG_MAX_CHARS)
+    _sample = LogSampler(GlobalArgs.LOG_SAMPLE_RATE) if logger.isEnabledFor(
+        logging.DEBUG) else None
+    for record in event["records"]:
+        # One poison record must not fail, and make firehose retry, the whole batch
+        try:
+            output.append(transform_record(record))
+        except RecordError as e:
+            failures.add(e.reason, record["recordId"])
+            if _sample is not None and _sample():
+                logger.debug('{"recordId":"%s","reason":"%s","error":%s}',
+                             record["recordId"], e.reason, lazy_json(str(e), GlobalArgs.LOG_MAX_CHARS))
+            output.append({
+                "recordId": record["recordId"],
+                "result": GlobalArgs.FAILED_RECORD_RESULT,
+                "data": record["data"]
+            })
+
+    _elapsed_ms = (time.perf_counter() - _t) * 1000
+    resp["processed_records"] = len(output) - failures.total()
+    resp["failed_records"] = dict(failures.counts)
+    failures.log(logger, logging.WARNING, "failed_records")
+    logger.info("resp: %s", lazy_json(resp, None))
+    if GlobalArgs.METRICS_ENABLED:
+        _publish_metrics(event["records"], resp, _elapsed_ms)
     return {"records": output}
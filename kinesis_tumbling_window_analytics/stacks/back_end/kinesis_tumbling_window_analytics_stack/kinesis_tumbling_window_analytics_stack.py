@@ -20,6 +20,155 @@ class GlobalArgs:
     MIZTIIK_SUPPORT_EMAIL = ["mystique@example.com", ]
 
 
+# KDA doesn't like - (dash) in names. CSV columns are matched by position, this must equal
+# stream_common.record_format.SALES_COLUMNS, which the producer writes, bench_record_format checks it
+SALES_COLUMNS = (
+    ("store_id", "VARCHAR(16)"),
+    ("category", "VARCHAR(16)"),
+    ("evnt_time", "TIMESTAMP"),
+    ("sales", "REAL"),
+    ("event_id", "VARCHAR(36)"),
+)
+
+
+def sales_input_schema(record_format: str = "JSON"):
+    """
+    Input schema of the sales events, JSON maps the columns by name and CSV
+    by position, both from SALES_COLUMNS.
+    """
+    if record_format == "JSON":
+        mapping_parameters = _kda.CfnApplication.MappingParametersProperty(
+            json_mapping_parameters=_kda.CfnApplication.JSONMappingParametersProperty(
+                record_row_path="$"
+            )
+        )
+    elif record_format == "CSV":
+        mapping_parameters = _kda.CfnApplication.MappingParametersProperty(
+            csv_mapping_parameters=_kda.CfnApplication.CSVMappingParametersProperty(
+                record_row_delimiter="\n",
+                record_column_delimiter=","
+            )
+        )
+    else:
+        raise ValueError(f"unknown record format {record_format}, JSON or CSV")
+    return _kda.CfnApplication.InputSchemaProperty(
+        record_columns=[
+            _kda.CfnApplication.RecordColumnProperty(
+                name=name,
+                sql_type=sql_type,
+                mapping=f"$.{name}" if record_format == "JSON" else None
+            )
+            for name, sql_type in SALES_COLUMNS
+        ],
+        record_encoding="UTF-8",
+        record_format=_kda.CfnApplication.RecordFormatProperty(
+            record_format_type=record_format,
+            mapping_parameters=mapping_parameters
+        )
+    )
+
+
+def revenue_agg_sql(
+    window_seconds: int = 60,
+    event_time: bool = False,
+    allowed_lateness_seconds: int = 0
+) -> str:
+    """
+    Build the store revenue tumbling window application code.
+
+    In event time mode rows are grouped by both the ROWTIME step and the
+    evnt_time step, so every ROWTIME window emits partial sums per event time
+    window. Late events within the allowed lateness show up as extra partial
+    rows for their own minute, summing rows per store and timestamp gives the
+    final revenue. Events later than that are routed to LATE_SALES_EVENTS,
+    stamped with their arrival ROWTIME. KDA SQL has no watermark, the
+    allowed lateness alone decides when an event time window stops counting.
+    """
+    src = '"STORE_REVENUE_PER_MIN_001"'
+    if not event_time:
+        return f"""CREATE OR REPLACE STREAM "DEST_SQL_STREAM_BY_STORE_ID" ("store_id" VARCHAR(16),"revenue" REAL, "timestamp" TIMESTAMP);
+            CREATE OR REPLACE PUMP "STREAM_PUMP" AS INSERT INTO "DEST_SQL_STREAM_BY_STORE_ID"
+                SELECT STREAM "store_id", SUM("sales") AS "revenue", ROWTIME AS "timestamp"
+                    FROM {src}
+                    GROUP BY STEP({src}.ROWTIME BY INTERVAL '{window_seconds}' SECOND),
+                    "store_id"
+                    ;
+            """
+
+    evnt_window = f"STEP({src}.\"evnt_time\" BY INTERVAL '{window_seconds}' SECOND)"
+    # Last ROWTIME at which an event still counts for its event time window
+    accept_until = f"{evnt_window} + INTERVAL '{window_seconds + allowed_lateness_seconds}' SECOND"
+    return f"""CREATE OR REPLACE STREAM "DEST_SQL_STREAM_BY_STORE_ID" ("store_id" VARCHAR(16),"revenue" REAL, "timestamp" TIMESTAMP);
+            CREATE OR REPLACE STREAM "LATE_SALES_EVENTS" ("store_id" VARCHAR(16), "category" VARCHAR(16), "evnt_time" TIMESTAMP, "sales" REAL, "timestamp" TIMESTAMP);
+            CREATE OR REPLACE PUMP "STREAM_PUMP" AS INSERT INTO "DEST_SQL_STREAM_BY_STORE_ID"
+                SELECT STREAM "store_id", SUM("sales") AS "revenue", {evnt_window} + INTERVAL '{window_seconds}' SECOND AS "timestamp"
+                    FROM {src}
+                    WHERE {accept_until} >= {src}.ROWTIME
+                    GROUP BY STEP({src}.ROWTIME BY INTERVAL '{window_seconds}' SECOND),
+                    {evnt_window},
+                    "store_id"
+                    ;
+            CREATE OR REPLACE PUMP "LATE_EVENTS_PUMP" AS INSERT INTO "LATE_SALES_EVENTS"
+                SELECT STREAM "store_id", "category", "evnt_time", "sales", ROWTIME AS "timestamp"
+                    FROM {src}
+                    WHERE {accept_until} < {src}.ROWTIME
+                    ;
+            """
+
+
+def top_categories_sql(window_seconds: int = 60) -> str:
+    """
+    Build the store/category revenue and sales count application code.
+
+    Every window emits the exact revenue and count of each category per
+    store, the input of a per store top-K by either, which
+    stream_common.top_k --from-sums ranks downstream. KDA SQL can not rank
+    within a group, and TOP_K_ITEMS_TUMBLING ranks one column of all stores
+    together by count only, so a busy store would push the categories of
+    every other store out. State is one row per store and category of the
+    window.
+    """
+    src = '"STORE_REVENUE_PER_MIN_001"'
+    return f"""CREATE OR REPLACE STREAM "DEST_SQL_STREAM_TOP_CATEGORIES" ("store_id" VARCHAR(16), "category" VARCHAR(16), "revenue" REAL, "sales_count" BIGINT, "timestamp" TIMESTAMP);
+            CREATE OR REPLACE PUMP "TOP_CATEGORIES_PUMP" AS INSERT INTO "DEST_SQL_STREAM_TOP_CATEGORIES"
+                SELECT STREAM "store_id", "category", SUM("sales") AS "revenue", COUNT(*) AS "sales_count", ROWTIME AS "timestamp"
+                    FROM {src}
+                    GROUP BY STEP({src}.ROWTIME BY INTERVAL '{window_seconds}' SECOND),
+                    "store_id",
+                    "category"
+                    ;
+            """
+
+
+def hopping_revenue_sql(window_seconds: int = 300, slide_seconds: int = 10) -> str:
+    """
+    Build the store revenue hopping window application code, the last
+    window_seconds reported every slide_seconds.
+
+    Sales are summed once per store into slide_seconds panes, and a sliding
+    window over the pane stream adds up the panes of the last window, so
+    events are not re-read for every overlapping window. Pane rows carry the
+    pane end as ROWTIME, the window takes the panes within
+    window_seconds - slide_seconds before the current one. A store gets a row
+    every slide it has sales in.
+    """
+    src = '"STORE_REVENUE_PER_MIN_001"'
+    return f"""CREATE OR REPLACE STREAM "STORE_REVENUE_PANES" ("store_id" VARCHAR(16), "pane_revenue" REAL);
+            CREATE OR REPLACE PUMP "REVENUE_PANE_PUMP" AS INSERT INTO "STORE_REVENUE_PANES"
+                SELECT STREAM "store_id", SUM("sales")
+                    FROM {src}
+                    GROUP BY STEP({src}.ROWTIME BY INTERVAL '{slide_seconds}' SECOND),
+                    "store_id"
+                    ;
+            CREATE OR REPLACE STREAM "DEST_SQL_STREAM_HOPPING" ("store_id" VARCHAR(16), "revenue" REAL, "window_seconds" INTEGER, "timestamp" TIMESTAMP);
+            CREATE OR REPLACE PUMP "HOPPING_PUMP" AS INSERT INTO "DEST_SQL_STREAM_HOPPING"
+                SELECT STREAM "store_id", SUM("pane_revenue") OVER W AS "revenue", {window_seconds}, ROWTIME
+                    FROM "STORE_REVENUE_PANES"
+                    WINDOW W AS (PARTITION BY "store_id" RANGE INTERVAL '{window_seconds - slide_seconds}' SECOND PRECEDING)
+                    ;
+            """
+
+
 class KinesisTumblingWindowAnalyticsStack(core.Stack):
 
     def __init__(
@@ -29,10 +178,35 @@ class KinesisTumblingWindowAnalyticsStack(core.Stack):
         stack_log_level: str,
         src_stream,
         dest_stream,
+        window_seconds: int = 60,
+        event_time: bool = False,
+        allowed_lateness_seconds: int = 0,
+        top_k_items: int = 0,
+        top_categories_stream=None,
+        hop_window_seconds: int = 300,
+        slide_seconds: int = 0,
+        hopping_stream=None,
+        late_sales_stream=None,
+        record_format: str = "JSON",
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Extra outputs write to their own delivery streams, never to the revenue stream
+        if top_k_items and top_categories_stream is None:
+            raise ValueError("top_k_items needs a top_categories_stream")
+        if slide_seconds and hopping_stream is None:
+            raise ValueError("slide_seconds needs a hopping_stream")
+        if event_time and late_sales_stream is None:
+            raise ValueError("event_time needs a late_sales_stream")
+        dest_streams = [dest_stream]
+        if top_k_items:
+            dest_streams.append(top_categories_stream)
+        if slide_seconds:
+            dest_streams.append(hopping_stream)
+        if event_time:
+            dest_streams.append(late_sales_stream)
+
         # Kinesis Analytics IAM Role
         kda_store_revenue_agg_role = _iam.Role(
             self,
@@ -59,8 +233,8 @@ class KinesisTumblingWindowAnalyticsStack(core.Stack):
 
         roleStmt4 = _iam.PolicyStatement(
             effect=_iam.Effect.ALLOW,
-            resources=[f"arn:aws:firehose:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:deliverystream/{dest_stream.delivery_stream_name}"
-                       ],
+            resources=[f"arn:aws:firehose:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:deliverystream/{_stream.delivery_stream_name}"
+                       for _stream in dest_streams],
             actions=[
                 "firehose:DescribeDeliveryStream",
                 "firehose:PutRecord",
@@ -135,49 +309,20 @@ class KinesisTumblingWindowAnalyticsStack(core.Stack):
 
         """
 
-        # KDA doesn't like - (dash) in names
-        col1 = _kda.CfnApplication.RecordColumnProperty(
-            name="store_id",
-            sql_type="VARCHAR(16)",
-            mapping="$.store_id"
-        )
-        col2 = _kda.CfnApplication.RecordColumnProperty(
-            name="category",
-            sql_type="VARCHAR(16)",
-            mapping="$.category"
-        )
-        col3 = _kda.CfnApplication.RecordColumnProperty(
-            name="evnt_time",
-            sql_type="TIMESTAMP",
-            mapping="$.evnt_time"
-        )
-        col4 = _kda.CfnApplication.RecordColumnProperty(
-            name="sales",
-            sql_type="REAL",
-            mapping="$.sales"
-        )
-
-        sales_schema = _kda.CfnApplication.InputSchemaProperty(
-            record_columns=[col1, col2, col3, col4],
-            record_encoding="UTF-8",
-            record_format=_kda.CfnApplication.RecordFormatProperty(
-                record_format_type="JSON",
-                mapping_parameters=_kda.CfnApplication.MappingParametersProperty(
-                    json_mapping_parameters=_kda.CfnApplication.JSONMappingParametersProperty(
-                        record_row_path="$"
-                    )
-                )
-            )
-        )
+        sales_schema = sales_input_schema(record_format)
 
-        revenue_agg_sql_01 = """CREATE OR REPLACE STREAM "DEST_SQL_STREAM_BY_STORE_ID" ("store_id" VARCHAR(16),"revenue" REAL, "timestamp" TIMESTAMP);
-            CREATE OR REPLACE PUMP "STREAM_PUMP" AS INSERT INTO "DEST_SQL_STREAM_BY_STORE_ID"
-                SELECT STREAM "store_id", SUM("sales") AS "revenue", ROWTIME AS "timestamp"
-                    FROM "STORE_REVENUE_PER_MIN_001"
-                    GROUP BY STEP("STORE_REVENUE_PER_MIN_001".ROWTIME BY INTERVAL '60' SECOND),
-                    "store_id"
-                    ;
-            """
+        # ROWTIME (arrival time) windows by default, event_time windows on evnt_time
+        revenue_agg_sql_01 = revenue_agg_sql(
+            window_seconds, event_time, allowed_lateness_seconds)
+        # Per store category sums as a second output, off unless top_k_items is set, ranked downstream
+        if top_k_items:
+            revenue_agg_sql_01 += top_categories_sql(window_seconds)
+        # Last hop_window_seconds of revenue every slide_seconds, off unless slide_seconds is set
+        if slide_seconds:
+            if hop_window_seconds % slide_seconds:
+                raise ValueError("hop_window_seconds must be a multiple of slide_seconds")
+            revenue_agg_sql_01 += hopping_revenue_sql(
+                hop_window_seconds, slide_seconds)
 
         store_revenue = _kda.CfnApplication(
             self,
@@ -221,6 +366,58 @@ class KinesisTumblingWindowAnalyticsStack(core.Stack):
             )
         )
 
+        if top_k_items:
+            top_categories_to_firehose = _kda.CfnApplicationOutput(
+                self,
+                "topCategoriesToFirehose",
+                application_name=core.Fn.ref(store_revenue.logical_id),
+                output=_kda.CfnApplicationOutput.OutputProperty(
+                    destination_schema=kda_dest_schema,
+                    kinesis_firehose_output=_kda.CfnApplicationOutput.KinesisFirehoseOutputProperty(
+                        resource_arn=f"{top_categories_stream.attr_arn}",
+                        role_arn=f"{kda_store_revenue_agg_role.role_arn}"
+                    ),
+                    name="DEST_SQL_STREAM_TOP_CATEGORIES"
+                )
+            )
+            # KDA rejects concurrent updates to the same application
+            top_categories_to_firehose.add_depends_on(kida_output_to_firehose)
+
+        if slide_seconds:
+            hopping_to_firehose = _kda.CfnApplicationOutput(
+                self,
+                "hoppingRevenueToFirehose",
+                application_name=core.Fn.ref(store_revenue.logical_id),
+                output=_kda.CfnApplicationOutput.OutputProperty(
+                    destination_schema=kda_dest_schema,
+                    kinesis_firehose_output=_kda.CfnApplicationOutput.KinesisFirehoseOutputProperty(
+                        resource_arn=f"{hopping_stream.attr_arn}",
+                        role_arn=f"{kda_store_revenue_agg_role.role_arn}"
+                    ),
+                    name="DEST_SQL_STREAM_HOPPING"
+                )
+            )
+            hopping_to_firehose.add_depends_on(
+                top_categories_to_firehose if top_k_items else kida_output_to_firehose)
+
+        if event_time:
+            late_sales_to_firehose = _kda.CfnApplicationOutput(
+                self,
+                "lateSalesToFirehose",
+                application_name=core.Fn.ref(store_revenue.logical_id),
+                output=_kda.CfnApplicationOutput.OutputProperty(
+                    destination_schema=kda_dest_schema,
+                    kinesis_firehose_output=_kda.CfnApplicationOutput.KinesisFirehoseOutputProperty(
+                        resource_arn=f"{late_sales_stream.attr_arn}",
+                        role_arn=f"{kda_store_revenue_agg_role.role_arn}"
+                    ),
+                    name="LATE_SALES_EVENTS"
+                )
+            )
+            late_sales_to_firehose.add_depends_on(
+                hopping_to_firehose if slide_seconds
+                else top_categories_to_firehose if top_k_items else kida_output_to_firehose)
+
         ###########################################
         ################# OUTPUTS #################
         ###########################################
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: stream_common
+    :Actions: Code shared by the producer, transformer and local stream consumers
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+"""
+
+__author__ = "Mystique"
+__email__ = "miztiik@github"
+__version__ = "0.0.1"
+__status__ = "production"
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: backfill
+    :Actions: Recompute store revenue per window from local event archives and firehose output, in parallel
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Reads NDJSON files, plain or gzipped, of either kind,
+
+    producer events     {"store_id": "store_3", "evnt_time": "...", "sales": 22.78, ...}
+    firehose output     {"store_id": "store_1", "revenue": 8671.3125, "timestamp": "2021-01-31 14:47:00.000"}
+
+Producer events sent as CSV rows, store_3,Books,2021-01-31T14:05:47.190114,22.78, are read as well.
+
+Events are summed into event time windows, output rows are summed per
+store into the window holding their timestamp, so partial rows (event time
+SQL, lambda consumer with several shards) add up, and minute rows can be
+rolled up into hours with --window-seconds 3600.
+
+Plain files are split into byte ranges that end on line boundaries, and
+every range, or whole gzip file, is read line by line in a worker process.
+Workers return partial sums per (store, window), which are merged as they
+complete, so memory follows the number of windows, not the input size.
+
+Usage: python -m stream_common.backfill [--workers 4] [--window-seconds 60] [--chunk-mb 64] [--stats stats.json] sample_records/ archive/*.ndjson.gz
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import gzip
+import json
+import os
+import sys
+import time
+
+from stream_common.record_format import get_record_format
+from stream_common.tumbling_window import (DEFAULT_WINDOW_SECONDS, as_real,
+                                           format_timestamp, parse_evnt_time)
+
+DEFAULT_CHUNK_MB = 64
+_event_format = get_record_format("auto")
+
+
+def list_inputs(paths):
+    """ Files under the given files and directories, hidden files skipped """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                files.extend(os.path.join(root, n) for n in sorted(names) if not n.startswith("."))
+        else:
+            files.append(path)
+    return files
+
+
+def plan_chunks(files, chunk_bytes=DEFAULT_CHUNK_MB * 1024 * 1024):
+    """ (path, start, end) work units, gzip files are read whole, end None means to the end """
+    chunks = []
+    for path in files:
+        size = os.path.getsize(path)
+        if path.endswith(".gz") or size <= chunk_bytes:
+            chunks.append((path, 0, None))
+            continue
+        for start in range(0, size, chunk_bytes):
+            chunks.append((path, start, start + chunk_bytes))
+    return chunks
+
+
+def _lines(path, start, end):
+    """ Lines that start within [start, end), the line crossing start belongs to the range before """
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from f
+        return
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            # Skip the rest of the line the previous range owns
+            f.readline()
+        pos = f.tell()
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line
+
+
+def aggregate_chunk(path, start=0, end=None, window_seconds=DEFAULT_WINDOW_SECONDS):
+    """
+    Sum one work unit, returns ({(store_id, window_end_ms): [revenue, count]}, stats).
+    Lines that are blank, not JSON or neither kind of record, and hopping
+    window rows, are counted and skipped.
+    """
+    _t = time.perf_counter()
+    window_ms = int(window_seconds * 1000)
+    loads = _event_format.loads
+    sums = {}
+    lines = 0
+    size = 0
+    invalid = 0
+    hopping = 0
+    for line in _lines(path, start, end):
+        lines += 1
+        size += len(line)
+        try:
+            record = loads(line)
+            if "sales" in record:
+                ts = parse_evnt_time(record["evnt_time"])
+                value = record["sales"]
+            elif "window_seconds" in record:
+                # Hopping rows re-report the last window every slide, summing them counts sales many times
+                hopping += 1
+                continue
+            else:
+                ts = parse_evnt_time(record["timestamp"])
+                value = record["revenue"]
+                # Row timestamps are window ends, 14:01:00.000 closes the 14:00 minute
+                ts -= 1
+            key = (record["store_id"], ts - ts % window_ms + window_ms)
+            value = float(value)
+        except (ValueError, KeyError, TypeError):
+            if line.strip():
+                invalid += 1
+            continue
+        acc = sums.get(key)
+        if acc is None:
+            sums[key] = [value, 1]
+        else:
+            acc[0] += value
+            acc[1] += 1
+    stats = {"pid": os.getpid(), "lines": lines, "bytes": size, "invalid_lines": invalid,
+             "hopping_rows": hopping, "seconds": time.perf_counter() - _t}
+    return sums, stats
+
+
+def merge(total, partial):
+    """ Fold partial sums into total, in place """
+    for key, (value, count) in partial.items():
+        acc = total.get(key)
+        if acc is None:
+            total[key] = [value, count]
+        else:
+            acc[0] += value
+            acc[1] += count
+    return total
+
+
+def run(paths, window_seconds=DEFAULT_WINDOW_SECONDS, workers=None, chunk_mb=DEFAULT_CHUNK_MB):
+    """ Returns (merged sums, per worker stats), workers=1 runs in this process """
+    chunks = plan_chunks(list_inputs(paths), int(chunk_mb * 1024 * 1024))
+    workers = workers or os.cpu_count() or 1
+    total = {}
+    per_worker = collections.defaultdict(collections.Counter)
+    _t = time.perf_counter()
+    if workers == 1:
+        results = (aggregate_chunk(path, start, end, window_seconds) for path, start, end in chunks)
+        for partial, stats in results:
+            merge(total, partial)
+            per_worker[stats.pop("pid")].update(stats)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(aggregate_chunk, path, start, end, window_seconds)
+                       for path, start, end in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                partial, stats = future.result()
+                merge(total, partial)
+                per_worker[stats.pop("pid")].update(stats)
+    elapsed = time.perf_counter() - _t
+    report = {
+        "files": len({c[0] for c in chunks}),
+        "chunks": len(chunks),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "lines": sum(w["lines"] for w in per_worker.values()),
+        "invalid_lines": sum(w["invalid_lines"] for w in per_worker.values()),
+        "hopping_rows": sum(w["hopping_rows"] for w in per_worker.values()),
+        "mb_per_s": round(sum(w["bytes"] for w in per_worker.values()) / 1024 / 1024 / elapsed, 2) if elapsed else None,
+        "per_worker": [{
+            "lines": w["lines"],
+            "mb": round(w["bytes"] / 1024 / 1024, 2),
+            "busy_seconds": round(w["seconds"], 3),
+            "lines_per_s": round(w["lines"] / w["seconds"]) if w["seconds"] else None,
+            "mb_per_s": round(w["bytes"] / 1024 / 1024 / w["seconds"], 2) if w["seconds"] else None,
+        } for w in per_worker.values()],
+    }
+    return total, report
+
+
+def format_backfill_rows(sums):
+    """ DEST_SQL_STREAM_BY_STORE_ID rows, ordered by timestamp and store """
+    for (store_id, window_end), (revenue, count) in sorted(sums.items(), key=lambda kv: (kv[0][1], kv[0][0])):
+        yield {"store_id": store_id, "revenue": as_real(revenue), "records": count,
+               "timestamp": format_timestamp(window_end)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Recompute store revenue per window from event archives and firehose output")
+    parser.add_argument("paths", nargs="+", help="NDJSON files or directories, .gz files are decompressed")
+    parser.add_argument("--window-seconds", type=float, default=DEFAULT_WINDOW_SECONDS)
+    parser.add_argument("--workers", type=int, help="Worker processes, defaults to the number of cores")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_MB,
+                        help="Plain files larger than this are split between workers")
+    parser.add_argument("--stats", help="Write the throughput report to this file instead of stderr")
+    args = parser.parse_args(argv)
+
+    sums, report = run(args.paths, args.window_seconds, args.workers, args.chunk_mb)
+    for row in format_backfill_rows(sums):
+        sys.stdout.write(json.dumps(row) + "\n")
+    if args.stats:
+        with open(args.stats, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        sys.stderr.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: compaction
+    :Actions: Merge the small firehose NDJSON objects into large, time sorted, gzipped files with an index
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Firehose flushes every 60 seconds, a day of output is well over a thousand
+objects of a few hundred bytes each. Objects are grouped by the day (or
+hour) in their firehose name, revenue_analytics_stream-1-2021-01-31-14-47-03-...,
+and every group is rewritten as gzipped NDJSON parts sorted by timestamp,
+
+    compacted/2021/01/31/part-<digest>-0000.ndjson.gz
+    compacted/_index.json       min/max timestamp and rows of every part, and the compacted sources
+
+Rows are sorted with an external merge sort, at most max_rows are held in
+memory and the rest is spilled to sorted runs on local disk. Part names
+depend only on the period and the source keys, and the index is written
+once a run, after all its parts, so a job that dies half way leaves nothing
+the index points to and re-running it writes the same parts again. Sources
+already in the index are skipped, sources are only deleted, with
+--delete-sources, once the index naming their part has been written. The
+next run drops the sources it no longer finds from the index, so deleted
+sources do not pile up in it.
+
+The store is a local directory or an S3 bucket through a boto3 style
+client, so the job runs the same against a copy on disk, a stand-in client
+or the firehose bucket.
+
+Usage: python -m stream_common.compaction sample_records/ [--dest-prefix compacted/] [--period day] [--target-mb 128]
+       python -m stream_common.compaction s3://bucket/sales_revenue/ --dest-prefix compacted/
+"""
+
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+DEFAULT_DEST_PREFIX = "compacted/"
+DEFAULT_TARGET_MB = 128
+DEFAULT_MAX_ROWS = 200000
+INDEX_NAME = "_index.json"
+_READ_BYTES = 1024 * 1024
+
+_FIREHOSE_TIME_RE = re.compile(r"-(\d{4})-(\d{2})-(\d{2})-(\d{2})-\d{2}-\d{2}-[^/]*$")
+_TIMESTAMP_RE = re.compile(rb'"timestamp"\s*:\s*"([^"\\]*)"')
+_PERIODS = ("day", "hour")
+
+
+class LocalStore:
+    """ Objects as files under root, keys use / like S3 """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def list(self, prefix=""):
+        """ Sorted [(key, size)] of the files whose key starts with prefix """
+        out = []
+        for dirpath, dirs, names in os.walk(self.root):
+            dirs.sort()
+            for name in names:
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    out.append((key, os.path.getsize(path)))
+        return sorted(out)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put_file(self, key, path):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Copy then rename, readers never see a half written object
+        tmp = f"{dest}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+
+    def put_bytes(self, key, data):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+
+    def delete(self, key):
+        os.remove(self._path(key))
+
+
+class S3Store:
+    """ Objects in an S3 bucket through a boto3 s3 client, or anything with the same calls """
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def list(self, prefix=""):
+        out = []
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        while True:
+            resp = self.client.list_objects_v2(**kwargs)
+            out.extend((o["Key"], o["Size"]) for o in resp.get("Contents", []))
+            if not resp.get("IsTruncated"):
+                return sorted(out)
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def exists(self, key):
+        resp = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return any(o["Key"] == key for o in resp.get("Contents", []))
+
+    def put_file(self, key, path):
+        with open(path, "rb") as f:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=f)
+
+    def put_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+def iter_lines(body, gzipped=False):
+    """ Lines of a file like object without the newline, read a block at a time """
+    if gzipped:
+        body = gzip.GzipFile(fileobj=body)
+    tail = b""
+    try:
+        while True:
+            block = body.read(_READ_BYTES)
+            if not block:
+                break
+            lines = (tail + block).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if tail.strip():
+            yield tail
+    finally:
+        body.close()
+
+
+def sort_key(line):
+    """ Rows sort by timestamp, the whole line breaks ties so the output is deterministic """
+    m = _TIMESTAMP_RE.search(line)
+    return (m.group(1) if m else b"", line)
+
+
+def period_of(key, period="day"):
+    """ 2021/01/31 or 2021/01/31/14 from a firehose object name, None when the name has no time """
+    m = _FIREHOSE_TIME_RE.search(key)
+    if not m:
+        return None
+    return "/".join(m.groups()[:3 if period == "day" else 4])
+
+
+def _spill(lines, tmpdir):
+    fd, path = tempfile.mkstemp(dir=tmpdir, suffix=".run")
+    with os.fdopen(fd, "wb") as f:
+        for line in lines:
+            f.write(line + b"\n")
+    return path
+
+
+def sorted_lines(store, keys, max_rows=DEFAULT_MAX_ROWS, tmpdir=None):
+    """ Every line of the objects in timestamp order, holding at most max_rows in memory """
+    runs = []
+    buf = []
+    for key in keys:
+        for line in iter_lines(store.open(key), key.endswith(".gz")):
+            buf.append(line)
+            if len(buf) >= max_rows:
+                buf.sort(key=sort_key)
+                runs.append(_spill(buf, tmpdir))
+                buf = []
+    buf.sort(key=sort_key)
+    if not runs:
+        yield from buf
+        return
+    runs.append(_spill(buf, tmpdir))
+    files = [open(path, "rb") for path in runs]
+    try:
+        yield from heapq.merge(*[(line.rstrip(b"\n") for line in f) for f in files], key=sort_key)
+    finally:
+        for f, path in zip(files, runs):
+            f.close()
+            os.remove(path)
+
+
+def _digest(keys):
+    return hashlib.sha1("\n".join(sorted(keys)).encode("utf-8")).hexdigest()[:16]
+
+
+class _PartWriter:
+    """ Gzipped NDJSON parts of about target_bytes uncompressed, uploaded as each one closes """
+
+    def __init__(self, store, key_prefix, target_bytes, tmpdir):
+        self.store = store
+        self.key_prefix = key_prefix
+        self.target_bytes = target_bytes
+        self.tmpdir = tmpdir
+        self.parts = []
+        self._gz = None
+
+    def _open(self):
+        fd, self._path = tempfile.mkstemp(dir=self.tmpdir, suffix=".gz")
+        self._raw = os.fdopen(fd, "wb")
+        # mtime=0 keeps the bytes, and so re-runs, identical
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", mtime=0)
+        self._entry = {"key": f"{self.key_prefix}-{len(self.parts):04d}.ndjson.gz",
+                       "rows": 0, "bytes": 0, "min_timestamp": None, "max_timestamp": None}
+
+    def write(self, line):
+        if self._gz is None:
+            self._open()
+        self._gz.write(line + b"\n")
+        entry = self._entry
+        entry["rows"] += 1
+        entry["bytes"] += len(line) + 1
+        ts = sort_key(line)[0].decode("utf-8") or None
+        if ts is not None:
+            # Lines come sorted, the first timestamp is the smallest
+            if entry["min_timestamp"] is None:
+                entry["min_timestamp"] = ts
+            entry["max_timestamp"] = ts
+        if entry["bytes"] >= self.target_bytes:
+            self.close()
+
+    def close(self):
+        if self._gz is None:
+            return
+        self._gz.close()
+        self._raw.close()
+        self._entry["compressed_bytes"] = os.path.getsize(self._path)
+        self.store.put_file(self._entry["key"], self._path)
+        os.remove(self._path)
+        self.parts.append(self._entry)
+        self._gz = None
+
+
+def load_index(store, dest_prefix=DEFAULT_DEST_PREFIX):
+    key = dest_prefix + INDEX_NAME
+    if not store.exists(key):
+        return {"files": [], "sources": {}}
+    with store.open(key) as body:
+        return json.loads(body.read().decode("utf-8"))
+
+
+def _write_index(store, dest_prefix, index):
+    index["files"].sort(key=lambda f: (f["min_timestamp"] or "", f["key"]))
+    store.put_bytes(dest_prefix + INDEX_NAME,
+                    json.dumps(index, indent=1, sort_keys=True).encode("utf-8"))
+
+
+def compact(
+    store,
+    source_prefix="",
+    dest_prefix=DEFAULT_DEST_PREFIX,
+    period="day",
+    target_mb=DEFAULT_TARGET_MB,
+    max_rows=DEFAULT_MAX_ROWS,
+    delete_sources=False,
+    min_objects=2
+):
+    """
+    Compact the objects under source_prefix that the index does not list yet,
+    returns a summary. Periods with fewer than min_objects new objects are
+    left for a later run, as are objects without a time in their name.
+    """
+    if period not in _PERIODS:
+        raise ValueError(f"unknown period {period}, one of " + ", ".join(_PERIODS))
+    index = load_index(store, dest_prefix)
+    groups = {}
+    skipped = 0
+    listed = set()
+    for key, _ in store.list(source_prefix):
+        if key.startswith(dest_prefix):
+            continue
+        listed.add(key)
+        if key in index["sources"]:
+            continue
+        _period = period_of(key, period)
+        if _period is None:
+            skipped += 1
+            continue
+        groups.setdefault(_period, []).append(key)
+    # Sources under the prefix that are gone were deleted after an earlier run, nothing can list them again
+    gone = [key for key in index["sources"] if key.startswith(source_prefix) and key not in listed]
+    for key in gone:
+        del index["sources"][key]
+
+    summary = {"groups": 0, "sources": 0, "parts": 0, "rows": 0, "skipped_objects": skipped,
+               "forgotten_sources": len(gone)}
+    compacted = []
+    with tempfile.TemporaryDirectory(prefix="compaction_") as tmpdir:
+        for _period, keys in sorted(groups.items()):
+            if len(keys) < min_objects:
+                summary["skipped_objects"] += len(keys)
+                continue
+            digest = _digest(keys)
+            writer = _PartWriter(store, f"{dest_prefix}{_period}/part-{digest}",
+                                 int(target_mb * 1024 * 1024), tmpdir)
+            for line in sorted_lines(store, keys, max_rows, tmpdir):
+                writer.write(line)
+            writer.close()
+            for part in writer.parts:
+                part["sources"] = digest
+            index["files"].extend(writer.parts)
+            index["sources"].update((key, digest) for key in keys)
+            compacted.extend(keys)
+            summary["groups"] += 1
+            summary["sources"] += len(keys)
+            summary["parts"] += len(writer.parts)
+            summary["rows"] += sum(p["rows"] for p in writer.parts)
+    if compacted or gone:
+        _write_index(store, dest_prefix, index)
+    if delete_sources:
+        for key in compacted:
+            store.delete(key)
+    return summary
+
+
+def scan(store, dest_prefix=DEFAULT_DEST_PREFIX, start=None, end=None, index=None):
+    """
+    Rows with start <= timestamp < end from the compacted files, reading only
+    the files whose index range overlaps. Timestamps compare as strings,
+    "2021-01-31 14:00:00.000".
+    """
+    index = index or load_index(store, dest_prefix)
+    for entry in index["files"]:
+        if start is not None and entry["max_timestamp"] is not None and entry["max_timestamp"] < start:
+            continue
+        if end is not None and entry["min_timestamp"] is not None and entry["min_timestamp"] >= end:
+            continue
+        for line in iter_lines(store.open(entry["key"]), gzipped=True):
+            if start is None and end is None:
+                yield line
+                continue
+            ts = sort_key(line)[0].decode("utf-8")
+            if (start is None or ts >= start) and (end is None or ts < end):
+                yield line
+
+
+def _store_for(location):
+    """ (store, prefix) for a directory or an s3://bucket/prefix location """
+    if location.startswith("s3://"):
+        import boto3
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3Store(boto3.client("s3"), bucket), prefix
+    return LocalStore(location), ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compact small firehose NDJSON objects into sorted, gzipped files with an index")
+    parser.add_argument("source", help="Directory or s3://bucket/prefix of the firehose objects")
+    parser.add_argument("--dest-prefix", default=DEFAULT_DEST_PREFIX,
+                        help="Key prefix of the compacted files and the index, in the same store")
+    parser.add_argument("--period", choices=_PERIODS, default="day")
+    parser.add_argument("--target-mb", type=float, default=DEFAULT_TARGET_MB,
+                        help="Uncompressed size of a compacted part")
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS,
+                        help="Rows sorted in memory before spilling a run to disk")
+    parser.add_argument("--min-objects", type=int, default=2)
+    parser.add_argument("--delete-sources", action="store_true",
+                        help="Delete the small objects once the index names their part")
+    args = parser.parse_args(argv)
+    store, prefix = _store_for(args.source)
+    summary = compact(store, prefix, args.dest_prefix, args.period, args.target_mb,
+                      args.max_rows, args.delete_sources, args.min_objects)
+    sys.stdout.write(json.dumps(summary) + "\n")
+
+
+if __name__ == "__main__":
+    main()
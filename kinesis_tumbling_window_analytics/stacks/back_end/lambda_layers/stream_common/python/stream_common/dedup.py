@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: dedup
+    :Actions: Drop replayed events by event_id with fixed memory Bloom filters, before they are summed
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+A record that PutRecords reported as failed may still have been written, so
+the producer's retry, or a re-run of a seeded invocation, puts the same
+event twice and the SUM counts its sales twice. The producer stamps every
+event with an event_id, the window engine drops ids it has seen before.
+
+Ids are kept in Bloom filters, one per window_seconds of event time, so a
+replay always lands in the partition of the original. Partitions older than
+the largest event time seen minus the horizon (window, watermark delay and
+allowed lateness) are dropped, the window they fed has fired for good, and
+the memory is fixed by capacity, the events expected per partition, and the
+error rate,
+
+    bits per partition = -capacity * ln(error_rate) / ln(2)**2, 9.6 bits per event at 1%
+
+An unseen event is taken for a replay with probability error_rate, when the
+partition holds capacity events, and its sales are lost. Filled beyond
+capacity the rate climbs, so size capacity for the peak rate.
+"""
+
+import base64
+import functools
+import hashlib
+import math
+import struct
+
+DEFAULT_ERROR_RATE = 0.01
+_LN2_SQUARED = math.log(2) ** 2
+
+
+def _nbytes(capacity, error_rate):
+    if capacity < 1 or not 0 < error_rate < 1:
+        raise ValueError("capacity must be positive and error_rate between 0 and 1")
+    return max(1, math.ceil(-capacity * math.log(error_rate) / _LN2_SQUARED / 8))
+
+
+@functools.lru_cache(maxsize=None)
+def _positions(k):
+    """ Unpacks k 32 bit positions from one blake2b digest, one hash call per key """
+    return struct.Struct(f">{k}I").unpack
+
+
+def _hashes(key, k):
+    if not isinstance(key, bytes):
+        key = str(key).encode("utf-8")
+    return _positions(k)(hashlib.blake2b(key, digest_size=4 * k).digest())
+
+
+class BloomFilter:
+    """ Bloom filter of capacity keys at error_rate, k of its bits per key """
+    __slots__ = ("m", "k", "bits")
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE, k=None, bits=None):
+        if bits is None:
+            nbytes = _nbytes(capacity, error_rate)
+            bits = bytearray(nbytes)
+            k = k or min(16, max(1, round(nbytes * 8 / capacity * math.log(2))))
+        self.bits = bytearray(bits)
+        self.m = len(self.bits) * 8
+        self.k = k
+
+    def add(self, key):
+        """ Set the bits of key, True when they were all set already, i.e. key was probably added before """
+        bits = self.bits
+        m = self.m
+        seen = True
+        for pos in _hashes(key, self.k):
+            pos %= m
+            mask = 1 << (pos & 7)
+            byte = bits[pos >> 3]
+            if not byte & mask:
+                seen = False
+                bits[pos >> 3] = byte | mask
+        return seen
+
+    def __contains__(self, key):
+        m = self.m
+        return all(self.bits[pos % m >> 3] & (1 << (pos % m & 7)) for pos in _hashes(key, self.k))
+
+    def to_base64(self):
+        """ k in the first byte, then the bits """
+        return base64.b64encode(bytes([self.k]) + bytes(self.bits)).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, value):
+        raw = base64.b64decode(value)
+        return cls(None, k=raw[0], bits=raw[1:])
+
+
+class Deduplicator:
+    """ Event ids seen within the horizon, in one Bloom filter per partition_seconds of event time """
+
+    def __init__(self, partition_seconds, horizon_seconds, capacity, error_rate=DEFAULT_ERROR_RATE):
+        self.partition_ms = int(partition_seconds * 1000)
+        self.horizon_ms = int(horizon_seconds * 1000)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.partitions = {}
+        self.watermark = None
+        self._oldest = None
+        self.stats = {"unique": 0, "duplicates": 0, "expired": 0, "partitions_dropped": 0}
+
+    def seen(self, event_id, ts_ms):
+        """
+        True when event_id was probably seen before and the event should be
+        dropped. Events older than the horizon are passed, and counted as expired.
+        """
+        if self.watermark is None or ts_ms > self.watermark:
+            self.watermark = ts_ms
+            oldest = (ts_ms - self.horizon_ms) // self.partition_ms
+            if oldest != self._oldest:
+                self._oldest = oldest
+                for bucket in [b for b in self.partitions if b < oldest]:
+                    del self.partitions[bucket]
+                    self.stats["partitions_dropped"] += 1
+        bucket = ts_ms // self.partition_ms
+        if bucket < self._oldest:
+            self.stats["expired"] += 1
+            return False
+        bloom = self.partitions.get(bucket)
+        if bloom is None:
+            bloom = self.partitions[bucket] = BloomFilter(self.capacity, self.error_rate)
+        if bloom.add(event_id):
+            self.stats["duplicates"] += 1
+            return True
+        self.stats["unique"] += 1
+        return False
+
+    def max_partitions(self):
+        return self.horizon_ms // self.partition_ms + 2
+
+    def memory_bytes(self):
+        """ Upper bound of the filter memory, whatever the event rate """
+        return self.max_partitions() * _nbytes(self.capacity, self.error_rate)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: hyperloglog
+    :Actions: Approximate distinct customers and products per store per tumbling window
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Each store and field gets a HyperLogLog of 2**p one-byte registers, 4KB at
+the default p=12, with a standard error of 1.04 / sqrt(2**p), about 1.6%,
+whatever the number of distinct values. Values are hashed with blake2b, not
+the salted built-in hash, so sketches from different runs can be merged.
+
+Output rows carry the registers in base64 next to the estimate. Merging the
+registers of the minute rows gives the hourly or daily distinct count
+without going back to the raw events,
+
+    python -m stream_common.hyperloglog window events.ndjson > minutes.ndjson
+    python -m stream_common.hyperloglog rollup --granularity hour minutes.ndjson
+
+KDA has COUNT_DISTINCT_ITEMS_TUMBLING, but it counts over the whole stream
+and can not be grouped by store, so the per store counts are computed here.
+"""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import math
+import sys
+
+from stream_common.record_format import read_events
+from stream_common.tumbling_window import DEFAULT_WINDOW_SECONDS, format_timestamp, parse_evnt_time
+
+DEFAULT_PRECISION = 12
+DEFAULT_FIELDS = ("customer_id", "product_id")
+
+
+def _hash64(value):
+    if not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    """ Dense HyperLogLog with 64 bit hashes, so no large range correction is needed """
+    __slots__ = ("p", "m", "registers", "_shift", "_low_mask")
+
+    def __init__(self, p=DEFAULT_PRECISION, registers=None):
+        if not 4 <= p <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(
+            self.m) if registers is None else bytearray(registers)
+        if len(self.registers) != self.m:
+            raise ValueError(f"{len(self.registers)} registers for precision {p}")
+        self._shift = 64 - p
+        self._low_mask = (1 << (64 - p)) - 1
+
+    def add(self, value):
+        x = _hash64(value)
+        idx = x >> self._shift
+        # Position of the first set bit in the remaining 64 - p bits
+        rank = self._shift - (x & self._low_mask).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def count(self):
+        m = self.m
+        registers = self.registers
+        estimate = _alpha(m) * m * m / sum(math.ldexp(1.0, -r) for r in registers)
+        zeros = registers.count(0)
+        # Linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return estimate
+
+    def merge(self, other):
+        """ Union with another sketch of the same precision, in place """
+        if other.p != self.p:
+            raise ValueError("can not merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_base64(self):
+        return base64.b64encode(bytes([self.p]) + bytes(self.registers)).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, data):
+        raw = base64.b64decode(data)
+        return cls(raw[0], raw[1:])
+
+
+def to_distinct_rows(events, fields=DEFAULT_FIELDS, time_fn=parse_evnt_time):
+    """ Yield (epoch_ms, store_id, values) rows, a missing field is None """
+    for event in events:
+        yield time_fn(event["evnt_time"]), event["store_id"], tuple(event.get(f) for f in fields)
+
+
+def distinct_window(rows, window_seconds=DEFAULT_WINDOW_SECONDS, fields=DEFAULT_FIELDS, p=DEFAULT_PRECISION):
+    """ Yield (window_end_ms, {store_id: [sketch per field]}) as each ROWTIME window closes """
+    window_ms = int(window_seconds * 1000)
+    window_end = None
+    sketches = {}
+    for ts, store_id, values in rows:
+        if window_end is None:
+            window_end = ts - ts % window_ms + window_ms
+        elif ts >= window_end:
+            if sketches:
+                yield window_end, sketches
+                sketches = {}
+            window_end = ts - ts % window_ms + window_ms
+        store = sketches.get(store_id)
+        if store is None:
+            store = sketches[store_id] = [HyperLogLog(p) for _ in fields]
+        for sketch, value in zip(store, values):
+            if value is not None:
+                sketch.add(value)
+    if sketches:
+        yield window_end, sketches
+
+
+def format_distinct_rows(windows, fields=DEFAULT_FIELDS):
+    """ One row per store per window with the estimate and the registers of every field """
+    for window_end, sketches in windows:
+        timestamp = format_timestamp(window_end)
+        for store_id, store in sketches.items():
+            row = {"store_id": store_id, "timestamp": timestamp}
+            for field, sketch in zip(fields, store):
+                row[f"distinct_{field}"] = round(sketch.count())
+                row[f"hll_{field}"] = sketch.to_base64()
+            yield row
+
+
+def run(events, window_seconds=DEFAULT_WINDOW_SECONDS, fields=DEFAULT_FIELDS, p=DEFAULT_PRECISION):
+    """ Full operator chain from producer events to distinct count rows """
+    return format_distinct_rows(
+        distinct_window(to_distinct_rows(events, fields), window_seconds, fields, p), fields)
+
+
+_GRANULARITY = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _period(timestamp, granularity):
+    """ Hour or day a window belongs to, a window ending at 15:00 is part of 14:00 """
+    window_end = datetime.datetime.strptime(timestamp, _TIMESTAMP_FORMAT)
+    return (window_end - datetime.timedelta(milliseconds=1)).strftime(_GRANULARITY[granularity])
+
+
+def rollup(rows, granularity="hour"):
+    """
+    Merge window rows into hourly or daily rows per store, from the registers
+    alone. Rows may come in any order, output is sorted by store and period.
+    """
+    if granularity not in _GRANULARITY:
+        raise ValueError(f"unknown granularity {granularity}, one of " + ", ".join(_GRANULARITY))
+    merged = {}
+    for row in rows:
+        key = (row["store_id"], _period(row["timestamp"], granularity))
+        target = merged.setdefault(key, {})
+        for name, value in row.items():
+            if name.startswith("hll_"):
+                sketch = HyperLogLog.from_base64(value)
+                if name in target:
+                    target[name].merge(sketch)
+                else:
+                    target[name] = sketch
+    for (store_id, period), target in sorted(merged.items()):
+        out = {"store_id": store_id, granularity: period}
+        for name, sketch in target.items():
+            out["distinct_" + name[4:]] = round(sketch.count())
+            out[name] = sketch.to_base64()
+        yield out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Approximate distinct counts per store per window, and rollups of them")
+    sub = parser.add_subparsers(dest="command")
+    window = sub.add_parser("window", help="Distinct counts per tumbling window from NDJSON events")
+    window.add_argument("paths", nargs="*", help="NDJSON event files, - for stdin")
+    window.add_argument("--window-seconds", type=float, default=DEFAULT_WINDOW_SECONDS)
+    window.add_argument("--fields", default=",".join(DEFAULT_FIELDS))
+    window.add_argument("--precision", type=int, default=DEFAULT_PRECISION)
+    roll = sub.add_parser("rollup", help="Merge window rows into hourly or daily rows")
+    roll.add_argument("paths", nargs="*", help="NDJSON window rows, - for stdin")
+    roll.add_argument("--granularity", choices=sorted(_GRANULARITY), default="hour")
+    args = parser.parse_args(argv)
+
+    if args.command == "rollup":
+        rows = rollup(read_events(args.paths), args.granularity)
+    elif args.command == "window":
+        fields = tuple(f.strip() for f in args.fields.split(",") if f.strip())
+        rows = run(read_events(args.paths), args.window_seconds, fields, args.precision)
+    else:
+        parser.error("choose window or rollup")
+    for row in rows:
+        sys.stdout.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: kpl_aggregation
+    :Actions: Pack and unpack user records in the KPL aggregated record format
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+An aggregated record is the 4 magic bytes, a protobuf encoded body and the
+MD5 digest of that body,
+
+    message AggregatedRecord {
+        repeated string partition_key_table     = 1;
+        repeated string explicit_hash_key_table = 2;
+        repeated Record records                 = 3;
+    }
+    message Record {
+        required uint64 partition_key_index     = 1;
+        optional uint64 explicit_hash_key_index = 2;
+        required bytes  data                    = 3;
+        repeated Tag    tags                    = 4;
+    }
+
+The protobuf subset needed here is small enough to hand roll, keeping the
+lambdas free of the protobuf dependency.
+"""
+
+import collections
+import hashlib
+
+MAGIC = b"\xf3\x89\x9a\xc2"
+DIGEST_SIZE = 16
+# Same default as the KPL AggregationMaxSize
+DEFAULT_MAX_BYTES = 51200
+# A kinesis record, including the partition key, can not exceed 1MB
+MAX_RECORD_BYTES = 1024 * 1024
+
+UserRecord = collections.namedtuple(
+    "UserRecord", ["partition_key", "explicit_hash_key", "data"])
+
+
+def _varint(value):
+    """ Encode an unsigned int as a protobuf varint """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(buf, pos):
+    """ Decode the varint at pos, returns (value, next_pos) """
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("Varint too long")
+
+
+def _field(field_number, payload):
+    """ Encode a length delimited field """
+    return _varint((field_number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def _iter_fields(buf, start=0, end=None):
+    """ Yield (field_number, wire_type, value) for every field in buf[start:end] """
+    pos = start
+    end = len(buf) if end is None else end
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        if pos > end:
+            raise ValueError("Truncated protobuf message")
+        yield field_number, wire_type, value
+
+
+def _to_bytes(data):
+    return data if isinstance(data, bytes) else data.encode("utf-8")
+
+
+class RecordAggregator:
+    """ Collect user records into KPL aggregated records of at most max_bytes """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        if max_bytes > MAX_RECORD_BYTES:
+            raise ValueError(f"max_bytes can not exceed {MAX_RECORD_BYTES}")
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def _reset(self):
+        self._pk_index = {}
+        self._ehk_index = {}
+        self._body = []
+        self._size = len(MAGIC) + DIGEST_SIZE
+        self._first_pk = None
+        self._first_ehk = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _record_size(self, partition_key, explicit_hash_key, data):
+        """ Bytes this record would add to the current aggregate """
+        size = 0
+        pk_idx = self._pk_index.get(partition_key)
+        if pk_idx is None:
+            pk_idx = len(self._pk_index)
+            size += len(_field(1, partition_key.encode("utf-8")))
+        record_len = 1 + len(_varint(pk_idx)) + \
+            1 + len(_varint(len(data))) + len(data)
+        if explicit_hash_key is not None:
+            ehk_idx = self._ehk_index.get(explicit_hash_key)
+            if ehk_idx is None:
+                ehk_idx = len(self._ehk_index)
+                size += len(_field(2, explicit_hash_key.encode("utf-8")))
+            record_len += 1 + len(_varint(ehk_idx))
+        return size + 1 + len(_varint(record_len)) + record_len
+
+    def add(self, partition_key, data, explicit_hash_key=None):
+        """
+        Add one user record. Returns a completed aggregate as UserRecord when
+        the record did not fit into the current one, else None.
+        """
+        data = _to_bytes(data)
+        completed = None
+        size = self._record_size(partition_key, explicit_hash_key, data)
+        if self._count and self._size + size > self.max_bytes:
+            completed = self.flush()
+            size = self._record_size(partition_key, explicit_hash_key, data)
+        if self._size + size > self.max_bytes:
+            raise ValueError(
+                f"Record of {len(data)} bytes does not fit in an aggregate of {self.max_bytes} bytes")
+
+        pk_idx = self._pk_index.get(partition_key)
+        if pk_idx is None:
+            pk_idx = self._pk_index[partition_key] = len(self._pk_index)
+        record = b"\x08" + _varint(pk_idx)
+        if explicit_hash_key is not None:
+            ehk_idx = self._ehk_index.get(explicit_hash_key)
+            if ehk_idx is None:
+                ehk_idx = self._ehk_index[explicit_hash_key] = len(
+                    self._ehk_index)
+            record += b"\x10" + _varint(ehk_idx)
+        record += _field(3, data)
+        self._body.append(_field(3, record))
+        self._size += size
+        if self._first_pk is None:
+            self._first_pk = partition_key
+            self._first_ehk = explicit_hash_key
+        self._count += 1
+        return completed
+
+    def flush(self):
+        """ Return the current aggregate as UserRecord and start a new one, None if empty """
+        if not self._count:
+            return None
+        body = b"".join(
+            [_field(1, pk.encode("utf-8")) for pk in self._pk_index] +
+            [_field(2, ehk.encode("utf-8")) for ehk in self._ehk_index] +
+            self._body
+        )
+        aggregated = UserRecord(
+            self._first_pk,
+            self._first_ehk,
+            MAGIC + body + hashlib.md5(body).digest()
+        )
+        self._reset()
+        return aggregated
+
+
+class HashKeyAggregator:
+    """
+    One RecordAggregator per explicit hash key. An aggregate is put with the
+    hash key of its first record, so records aimed at different shards must
+    not share one.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        if max_bytes > MAX_RECORD_BYTES:
+            raise ValueError(f"max_bytes can not exceed {MAX_RECORD_BYTES}")
+        self.max_bytes = max_bytes
+        self._aggregators = {}
+
+    def __len__(self):
+        return sum(len(agg) for agg in self._aggregators.values())
+
+    def add(self, partition_key, data, explicit_hash_key=None):
+        """ Add one user record to the aggregate of its hash key, returns a completed aggregate or None """
+        agg = self._aggregators.get(explicit_hash_key)
+        if agg is None:
+            agg = self._aggregators[explicit_hash_key] = RecordAggregator(self.max_bytes)
+        return agg.add(partition_key, data, explicit_hash_key)
+
+    def flush(self):
+        """ Return the next non empty aggregate as UserRecord, None once all are empty """
+        for agg in self._aggregators.values():
+            completed = agg.flush()
+            if completed:
+                return completed
+        return None
+
+
+def aggregate(records, max_bytes=DEFAULT_MAX_BYTES):
+    """ Aggregate an iterable of (partition_key, data) pairs, yielding UserRecord """
+    agg = RecordAggregator(max_bytes)
+    for partition_key, data in records:
+        completed = agg.add(partition_key, data)
+        if completed:
+            yield completed
+    completed = agg.flush()
+    if completed:
+        yield completed
+
+
+def is_aggregated(data):
+    """ True when data carries the KPL magic bytes and a valid MD5 trailer """
+    if len(data) <= len(MAGIC) + DIGEST_SIZE or not data.startswith(MAGIC):
+        return False
+    body = data[len(MAGIC):-DIGEST_SIZE]
+    return hashlib.md5(body).digest() == data[-DIGEST_SIZE:]
+
+
+def deaggregate(data, partition_key=None, explicit_hash_key=None):
+    """
+    Unpack a kinesis record into its user records. Data that is not a valid
+    aggregate is returned as a single user record, like the KCL does.
+    """
+    data = _to_bytes(data)
+    if not is_aggregated(data):
+        return [UserRecord(partition_key, explicit_hash_key, data)]
+
+    buf = memoryview(data)[len(MAGIC):-DIGEST_SIZE]
+    pk_table = []
+    ehk_table = []
+    raw_records = []
+    for field_number, wire_type, value in _iter_fields(buf):
+        if wire_type != 2:
+            continue
+        if field_number == 1:
+            pk_table.append(bytes(value).decode("utf-8"))
+        elif field_number == 2:
+            ehk_table.append(bytes(value).decode("utf-8"))
+        elif field_number == 3:
+            raw_records.append(value)
+
+    user_records = []
+    for raw in raw_records:
+        pk_idx = None
+        ehk_idx = None
+        rec_data = b""
+        for field_number, wire_type, value in _iter_fields(raw):
+            if field_number == 1 and wire_type == 0:
+                pk_idx = value
+            elif field_number == 2 and wire_type == 0:
+                ehk_idx = value
+            elif field_number == 3 and wire_type == 2:
+                rec_data = bytes(value)
+        if pk_idx is None or pk_idx >= len(pk_table):
+            raise ValueError("Aggregated record with invalid partition key index")
+        user_records.append(UserRecord(
+            pk_table[pk_idx],
+            ehk_table[ehk_idx] if ehk_idx is not None and ehk_idx < len(
+                ehk_table) else None,
+            rec_data
+        ))
+    return user_records
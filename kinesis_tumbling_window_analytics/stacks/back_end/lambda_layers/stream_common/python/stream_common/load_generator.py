@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: load_generator
+    :Actions: Reproducible synthetic sales events for the producer and local runs
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Events look like the producer events,
+
+    {"category": "Books", "store_id": "store_3", "evnt_time": "2021-01-31T14:05:47.190114", "sales": 22.78}
+
+Stores and categories are drawn from a Zipf (or any custom weighted)
+distribution, so hot keys can be reproduced. With customers or products
+set, events also carry a uniformly drawn customer_id or product_id out of
+that many, for the distinct counts. With event_ids, every event carries a
+random 128 bit hex event_id, drawn from the seeded generator, so a re-run
+repeats the ids along with the events. Event times follow the wall
+clock, or with start_time a virtual clock at events_per_s, and can be
+jittered or pushed back to arrive out of order. With a seed and a
+start_time the output is identical on every run.
+
+The random fields are drawn a batch at a time with random.choices, the
+per-event work is building the dict and stamping the time.
+
+Usage: python -m stream_common.load_generator --count 10000 --seed 7 --stores 50 --store-skew 1.1 [--replay events.ndjson]
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import random
+import sys
+import time
+
+from stream_common.record_format import CsvRecordFormat
+
+DEFAULT_STORES = 5
+DEFAULT_CATEGORIES = ("Books", "Electronics")
+DEFAULT_BATCH_SIZE = 500
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def zipf_weights(n, s):
+    """ Weight of rank i is 1 / i**s, s=0 is uniform """
+    return [1.0 / (i ** s) for i in range(1, n + 1)]
+
+
+def _names(spec, prefix, default):
+    """ Names from a sequence, or n generated names from an int """
+    if spec is None:
+        return list(default)
+    if isinstance(spec, int):
+        return [f"{prefix}_{i}" for i in range(1, spec + 1)]
+    return list(spec)
+
+
+def _cum_weights(names, weights, skew):
+    if weights is None:
+        weights = zipf_weights(len(names), skew)
+    if len(weights) != len(names):
+        raise ValueError(f"{len(weights)} weights for {len(names)} names")
+    return list(itertools.accumulate(weights))
+
+
+class EventTimeFormatter:
+    """ Epoch seconds to evnt_time strings, the date part is reused within a second """
+
+    def __init__(self):
+        self._second = None
+        self._prefix = None
+
+    def __call__(self, ts):
+        second = int(ts)
+        if second != self._second:
+            self._second = second
+            self._prefix = (_EPOCH + datetime.timedelta(seconds=second)
+                            ).strftime("%Y-%m-%dT%H:%M:%S")
+        return f"{self._prefix}.{int((ts - second) * 1000000):06d}"
+
+
+class LoadGenerator:
+    """ Seeded producer events with skewed keys and configurable event time disorder """
+
+    def __init__(
+        self,
+        seed=None,
+        stores=DEFAULT_STORES,
+        categories=None,
+        store_skew=0.0,
+        category_skew=0.0,
+        store_weights=None,
+        category_weights=None,
+        max_sales=100.0,
+        customers=0,
+        products=0,
+        event_ids=False,
+        jitter_ms=0,
+        out_of_order_ratio=0.0,
+        max_delay_ms=0,
+        start_time=None,
+        events_per_s=1000,
+        batch_size=DEFAULT_BATCH_SIZE,
+        clock=time.time
+    ):
+        self.rnd = random.Random(seed)
+        self.stores = _names(stores, "store", ())
+        self.categories = _names(categories, "category", DEFAULT_CATEGORIES)
+        self._store_cum = _cum_weights(self.stores, store_weights, store_skew)
+        self._category_cum = _cum_weights(
+            self.categories, category_weights, category_skew)
+        self.max_sales = max_sales
+        self.customers = customers
+        self.products = products
+        self.event_ids = event_ids
+        self.jitter_s = jitter_ms / 1000
+        self.out_of_order_ratio = out_of_order_ratio
+        self.max_delay_s = max_delay_ms / 1000
+        # A virtual clock makes event times reproducible, else events are stamped when taken
+        self.start_time = start_time
+        self.events_per_s = events_per_s
+        self.batch_size = batch_size
+        self.clock = clock
+        self.generated = 0
+
+    def _offsets(self, n):
+        """ Seconds to add to each event's arrival time, negative means late """
+        rnd = self.rnd
+        if self.jitter_s:
+            offsets = [rnd.uniform(-self.jitter_s, self.jitter_s)
+                       for _ in range(n)]
+        else:
+            offsets = [0.0] * n
+        if self.out_of_order_ratio and self.max_delay_s:
+            for i in range(n):
+                if rnd.random() < self.out_of_order_ratio:
+                    offsets[i] -= rnd.uniform(0, self.max_delay_s)
+        return offsets
+
+    def _draw(self, n):
+        rnd = self.rnd
+        stores = rnd.choices(self.stores, cum_weights=self._store_cum, k=n)
+        categories = rnd.choices(
+            self.categories, cum_weights=self._category_cum, k=n)
+        _max = self.max_sales
+        sales = [round(rnd.random() * _max, 2) for _ in range(n)]
+        return stores, categories, sales, self._offsets(n)
+
+    def _ids(self, prefix, cardinality, n):
+        """ n ids out of cardinality, None when the field is off """
+        if not cardinality:
+            return None
+        rnd = self.rnd
+        return [f"{prefix}_{int(rnd.random() * cardinality) + 1}" for _ in range(n)]
+
+    def events(self, count=None):
+        """ Yield event dicts, forever or count of them, drawing the random fields a batch at a time """
+        fmt = EventTimeFormatter()
+        remaining = count
+        while remaining is None or remaining > 0:
+            n = self.batch_size if remaining is None else min(
+                self.batch_size, remaining)
+            stores, categories, sales, offsets = self._draw(n)
+            customers = self._ids("customer", self.customers, n)
+            products = self._ids("product", self.products, n)
+            event_ids = [f"{self.rnd.getrandbits(128):032x}" for _ in range(n)] if self.event_ids else None
+            for i in range(n):
+                if self.start_time is None:
+                    arrival = self.clock()
+                else:
+                    arrival = self.start_time + self.generated / self.events_per_s
+                self.generated += 1
+                event = {
+                    "category": categories[i],
+                    "store_id": stores[i],
+                    "evnt_time": fmt(arrival + offsets[i]),
+                    "sales": sales[i]
+                }
+                if customers is not None:
+                    event["customer_id"] = customers[i]
+                if products is not None:
+                    event["product_id"] = products[i]
+                if event_ids is not None:
+                    event["event_id"] = event_ids[i]
+                yield event
+            if remaining is not None:
+                remaining -= n
+
+    def batch(self, n):
+        """ The next n events as a list """
+        return list(self.events(n))
+
+
+def replay_ndjson(paths, loop=False):
+    """ Yield events from NDJSON files in order, starting over when loop is set """
+    while True:
+        replayed = 0
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        replayed += 1
+                        yield json.loads(line)
+        if not loop or not replayed:
+            return
+
+
+def _parse_time(value):
+    """ Epoch seconds of an ISO timestamp or a number """
+    try:
+        return float(value)
+    except ValueError:
+        return (datetime.datetime.fromisoformat(value) - _EPOCH).total_seconds()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write reproducible synthetic producer events as NDJSON")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--stores", type=int, default=DEFAULT_STORES)
+    parser.add_argument("--categories", default=",".join(DEFAULT_CATEGORIES),
+                        help="Comma separated names or a number of categories")
+    parser.add_argument("--store-skew", type=float, default=0.0, help="Zipf exponent, 0 is uniform")
+    parser.add_argument("--category-skew", type=float, default=0.0)
+    parser.add_argument("--max-sales", type=float, default=100.0)
+    parser.add_argument("--customers", type=int, default=0, help="Distinct customer_id values, 0 leaves the field out")
+    parser.add_argument("--products", type=int, default=0, help="Distinct product_id values, 0 leaves the field out")
+    parser.add_argument("--event-ids", action="store_true", help="Stamp every event with a random event_id")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--out-of-order-ratio", type=float, default=0.0)
+    parser.add_argument("--max-delay-ms", type=float, default=0)
+    parser.add_argument("--start-time", help="ISO time or epoch seconds of a virtual clock, default is the wall clock")
+    parser.add_argument("--events-per-s", type=float, default=1000)
+    parser.add_argument("--replay", nargs="*", help="Replay NDJSON files instead of generating")
+    parser.add_argument("--record-format", choices=("json", "csv"), default="json",
+                        help="Write NDJSON or CSV rows in the KDA input column order")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        events = itertools.islice(replay_ndjson(args.replay), args.count)
+    else:
+        categories = int(args.categories) if args.categories.isdigit() else [
+            c.strip() for c in args.categories.split(",") if c.strip()]
+        events = LoadGenerator(
+            seed=args.seed,
+            stores=args.stores,
+            categories=categories,
+            store_skew=args.store_skew,
+            category_skew=args.category_skew,
+            max_sales=args.max_sales,
+            customers=args.customers,
+            products=args.products,
+            event_ids=args.event_ids,
+            jitter_ms=args.jitter_ms,
+            out_of_order_ratio=args.out_of_order_ratio,
+            max_delay_ms=args.max_delay_ms,
+            start_time=_parse_time(args.start_time) if args.start_time else None,
+            events_per_s=args.events_per_s
+        ).events(args.count)
+    if args.record_format == "csv":
+        _csv = CsvRecordFormat()
+        for event in events:
+            sys.stdout.write(_csv.dumps(event).decode("utf-8"))
+    else:
+        for event in events:
+            sys.stdout.write(json.dumps(event) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: metrics
+    :Actions: Collect lambda metrics in memory and publish them as CloudWatch Embedded Metric Format
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Nothing is sent while the handler runs. Counters and fixed bucket
+histograms are updated in memory, and flush() prints a single EMF JSON line
+per invocation. CloudWatch Logs extracts the metrics from that line, so
+there are no PutMetricData calls.
+
+    metrics = Metrics("KinesisTumblingWindowAnalytics", {"ServiceName": "producer"})
+    latency = metrics.histogram("PutRecordsLatency", LATENCY_BUCKETS_MS, "Milliseconds")
+    latency.record(12.5)
+    metrics.counter("RecordsSent", 500)
+    metrics.flush()
+"""
+
+import bisect
+import json
+import time
+
+DEFAULT_NAMESPACE = "KinesisTumblingWindowAnalytics"
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200,
+                      500, 1000, 2000, 5000, 10000)
+BATCH_RECORDS_BUCKETS = (1, 10, 50, 100, 200, 300, 400, 500)
+BATCH_BYTES_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024,
+                       1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024)
+# EMF limits per log line
+MAX_METRICS = 100
+MAX_VALUES = 100
+
+
+class Histogram:
+    """ Counts per fixed bucket, recording a value costs one bisect over the bounds """
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds):
+        self.bounds = tuple(sorted(bounds))
+        if len(self.bounds) >= MAX_VALUES:
+            raise ValueError(f"at most {MAX_VALUES - 1} bucket bounds")
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.bounds != self.bounds:
+            raise ValueError("histograms with different buckets")
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def emf_value(self):
+        """ EMF Values/Counts, a bucket is reported at its upper bound clamped to the observed range """
+        values = []
+        counts = []
+        for i, c in enumerate(self.counts):
+            if c:
+                _v = self.bounds[i] if i < len(self.bounds) else self.max
+                values.append(min(max(_v, self.min), self.max))
+                counts.append(c)
+        return {"Values": values, "Counts": counts}
+
+
+class Metrics:
+    """ Counters and histograms of one invocation under a namespace and a dimension set """
+
+    def __init__(self, namespace=DEFAULT_NAMESPACE, dimensions=None, clock=time.time):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.clock = clock
+        self._counters = {}
+        self._histograms = {}
+        self._units = {}
+
+    def counter(self, name, value=1, unit="Count"):
+        self._counters[name] = self._counters.get(name, 0) + value
+        self._units[name] = unit
+
+    def histogram(self, name, bounds, unit="None"):
+        """ The histogram to record name into, keep a reference to it in hot loops """
+        hist = self._histograms.get(name)
+        if hist is None:
+            hist = self._histograms[name] = Histogram(bounds)
+            self._units[name] = unit
+        return hist
+
+    def merge(self, other):
+        """ Fold in the metrics of another recorder, e.g. one per writer thread """
+        for name, value in other._counters.items():
+            self.counter(name, value, other._units[name])
+        for name, hist in other._histograms.items():
+            self.histogram(name, hist.bounds, other._units[name]).merge(hist)
+
+    def to_emf(self):
+        """ The EMF document, histograms without samples are left out """
+        doc = dict(self.dimensions)
+        definitions = []
+        for name, value in self._counters.items():
+            doc[name] = value
+            definitions.append({"Name": name, "Unit": self._units[name]})
+        for name, hist in self._histograms.items():
+            if hist.count:
+                doc[name] = hist.emf_value()
+                definitions.append({"Name": name, "Unit": self._units[name]})
+        if len(definitions) > MAX_METRICS:
+            raise ValueError(f"at most {MAX_METRICS} metrics per EMF document")
+        doc["_aws"] = {
+            "Timestamp": int(self.clock() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": self.namespace,
+                "Dimensions": [list(self.dimensions)],
+                "Metrics": definitions
+            }]
+        }
+        return doc
+
+    def flush(self, write=print):
+        """ Write the EMF line and start over, nothing is written without metrics """
+        if not self._counters and not any(h.count for h in self._histograms.values()):
+            return None
+        line = json.dumps(self.to_emf())
+        write(line)
+        self._counters = {}
+        self._histograms = {}
+        self._units = {}
+        return line
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: parquet_writer
+    :Actions: Convert the NDJSON revenue rows from firehose to Parquet
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Rows are streamed into fixed size row groups, so memory stays bounded by
+the row group size whatever the input size. The schema mirrors the
+DEST_SQL_STREAM_BY_STORE_ID stream and the glue table used by firehose
+record format conversion.
+
+Needs pyarrow, which is not part of the lambda runtime. Install it locally
+with `pip install pyarrow`.
+
+Usage: python -m stream_common.parquet_writer out.parquet revenue_analytics_stream-* [--row-group-size 100000]
+"""
+
+import argparse
+import json
+
+from stream_common.tumbling_window import parse_evnt_time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError(
+            "pyarrow is required for parquet output, pip install pyarrow")
+
+
+def revenue_schema():
+    """ Arrow schema of the revenue rows, REAL maps to float32 """
+    _require_pyarrow()
+    return pa.schema([
+        ("store_id", pa.string()),
+        ("revenue", pa.float32()),
+        ("timestamp", pa.timestamp("ms")),
+    ])
+
+
+def _iter_rows(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def write_parquet(rows, dest, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression="snappy"):
+    """ Stream revenue row dicts into a parquet file, returns the number of rows written """
+    schema = revenue_schema()
+    store_ids = []
+    revenues = []
+    timestamps = []
+    written = 0
+
+    def _flush(writer):
+        writer.write_table(pa.Table.from_arrays([
+            pa.array(store_ids, pa.string()),
+            pa.array(revenues, pa.float32()),
+            pa.array(timestamps, pa.int64()).cast(pa.timestamp("ms")),
+        ], schema=schema))
+        del store_ids[:], revenues[:], timestamps[:]
+
+    with pq.ParquetWriter(dest, schema, compression=compression) as writer:
+        for row in rows:
+            store_ids.append(row["store_id"])
+            revenues.append(row["revenue"])
+            timestamps.append(parse_evnt_time(row["timestamp"]))
+            if len(store_ids) >= row_group_size:
+                written += len(store_ids)
+                _flush(writer)
+        if store_ids:
+            written += len(store_ids)
+            _flush(writer)
+    return written
+
+
+def ndjson_to_parquet(paths, dest, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression="snappy"):
+    """ Convert firehose NDJSON objects into a single parquet file """
+    return write_parquet(_iter_rows(paths), dest, row_group_size, compression)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert NDJSON revenue rows to parquet")
+    parser.add_argument("dest", help="Parquet file to write")
+    parser.add_argument("paths", nargs="+", help="NDJSON firehose objects")
+    parser.add_argument("--row-group-size", type=int,
+                        default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument("--compression", default="snappy")
+    args = parser.parse_args(argv)
+    rows = ndjson_to_parquet(
+        args.paths, args.dest, args.row_group_size, args.compression)
+    print(json.dumps({"dest": args.dest, "rows": rows}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: record_format
+    :Actions: Sales events on the wire as JSON or as CSV rows in the KDA input column order
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+JSON repeats every field name in every record, a CSV row carries only the
+values, in the order of the KDA input schema columns,
+
+    {"category":"Books","store_id":"store_3","evnt_time":"2021-01-31T14:05:47.190114","sales":22.78}
+    store_3,Books,2021-01-31T14:05:47.190114,22.78,
+
+The last column is the event_id, empty when the producer does not stamp
+ids. KDA CSV has no quoting, values must not contain the delimiter, which
+store ids, categories (a comma separated setting) and ids never do. Fields
+that are not columns, like the events count of a partial aggregate, are
+not sent.
+
+Consumers decode with auto, which tells the formats apart by the first
+byte, so the producer can be switched without draining the stream.
+"""
+
+import sys
+
+from stream_common.serializer import get_serializer
+
+# Same names, types and order as the KDA input schema columns in
+# KinesisTumblingWindowAnalyticsStack, CSV columns are matched by position,
+# benchmarks/bench_record_format.py fails when the two differ
+SALES_COLUMNS = (
+    ("store_id", "VARCHAR(16)"),
+    ("category", "VARCHAR(16)"),
+    ("evnt_time", "TIMESTAMP"),
+    ("sales", "REAL"),
+    ("event_id", "VARCHAR(36)"),
+)
+CSV_ROW_DELIMITER = "\n"
+CSV_COLUMN_DELIMITER = ","
+RECORD_FORMATS = ("json", "csv", "auto")
+
+
+def _converter(sql_type):
+    if sql_type in ("REAL", "DOUBLE", "FLOAT"):
+        return float
+    if sql_type in ("INTEGER", "BIGINT", "SMALLINT", "TINYINT"):
+        return int
+    return str
+
+
+class CsvRecordFormat:
+    """ One CSV row per event, columns by position, empty values are left out of the event """
+    name = "csv"
+
+    def __init__(self, columns=SALES_COLUMNS, delimiter=CSV_COLUMN_DELIMITER):
+        self.columns = tuple(columns)
+        self.delimiter = delimiter
+        self._names = tuple(name for name, _ in self.columns)
+        self._converters = tuple((name, _converter(sql_type)) for name, sql_type in self.columns)
+
+    def dumps(self, event):
+        get = event.get
+        return (self.delimiter.join([str(get(name, "")) for name in self._names])
+                + CSV_ROW_DELIMITER).encode("utf-8")
+
+    def loads(self, data):
+        """ Parse one row of UTF-8 bytes or a str, raising UnicodeDecodeError or ValueError """
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        values = data.rstrip("\r\n").split(self.delimiter)
+        if len(values) > len(self._converters):
+            raise ValueError(f"{len(values)} columns, expected at most {len(self._converters)}")
+        event = {}
+        for (name, convert), value in zip(self._converters, values):
+            if value:
+                event[name] = convert(value)
+        return event
+
+
+class AutoRecordFormat:
+    """ Decodes JSON objects and CSV rows alike, encoding needs an explicit format """
+    name = "auto"
+
+    def __init__(self, serializer=None, csv=None):
+        self._json = serializer or get_serializer()
+        self._csv = csv or CsvRecordFormat()
+
+    def dumps(self, event):
+        raise ValueError("pick json or csv to encode events")
+
+    def loads(self, data):
+        if data[:1] in (b"{", "{"):
+            return self._json.loads(data)
+        return self._csv.loads(data)
+
+
+def get_record_format(name="json", serializer=None):
+    """ dumps/loads of events, json is the serializer itself """
+    name = (name or "json").lower()
+    if name == "json":
+        return serializer or get_serializer()
+    if name == "csv":
+        return CsvRecordFormat()
+    if name == "auto":
+        return AutoRecordFormat(serializer)
+    raise ValueError(f"unknown record format {name}, one of " + ", ".join(RECORD_FORMATS))
+
+
+def read_events(paths, record_format="auto"):
+    """ Events of NDJSON or CSV files, - or no paths for stdin, auto tells the formats apart per line """
+    loads = get_record_format(record_format).loads
+    for path in paths or ["-"]:
+        f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
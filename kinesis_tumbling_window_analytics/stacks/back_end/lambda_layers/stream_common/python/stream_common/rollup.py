@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: rollup
+    :Actions: Roll the per minute revenue rows up to hourly, daily and store group revenue with NumPy
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+The DEST_SQL_STREAM_BY_STORE_ID rows from firehose, or the compacted parts,
+are read chunk_rows at a time into columns,
+
+    store_codes     int64, store_id dictionary encoded in first seen order
+    revenue         float64
+    epoch_ms        int64, the row timestamp
+
+and every rollup, a (dimension, granularity) pair, sums a chunk with one
+vectorized group-by on bucket * keys + key. The group-by uses bincount when
+the keys of the chunk are dense, as they are for hours and days of a few
+hundred stores, and sort + reduceat otherwise. A chunk's sums are merged into
+the rollup table the same way, so memory is one chunk and the rollup tables,
+whatever the input size. Row timestamps are window ends, so rows land in the
+bucket their window falls in, (start, start + granularity], and buckets are
+stamped with their end, as backfill does. A row at 15:00:00.000 closes the
+14:59 minute and counts in the hour stamped 15:00:00.000. Days are in UTC.
+
+Dimensions are store_id, store_group, from a {"store_id": "group"} JSON file,
+stores without a group go to "other", and all, the total of every store.
+Tables are written as NDJSON, one row per bucket and key with the number of
+input rows summed, store_id tables keep the firehose row fields,
+
+    {"store_id": "store_3", "revenue": 613094.5, "timestamp": "2021-01-31 15:00:00.000", "rows": 60}
+
+Needs numpy, which is not part of the lambda runtime. Install it locally
+with `pip install numpy`.
+
+Usage: python -m stream_common.rollup dest_dir/ revenue_analytics_stream-* [--granularity hour,day] [--store-groups groups.json]
+       python -m stream_common.rollup dest_dir/ compacted/2021/01/*/part-*.ndjson.gz --dimension store_id,all
+"""
+
+import argparse
+import collections
+import json
+import os
+
+from stream_common.compaction import iter_lines
+from stream_common.serializer import get_serializer
+from stream_common.tumbling_window import format_timestamp, parse_evnt_time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GRANULARITIES = {
+    "minute": 60 * 1000,
+    "hour": 60 * 60 * 1000,
+    "day": 24 * 60 * 60 * 1000,
+}
+DIMENSIONS = ("store_id", "store_group", "all")
+DEFAULT_GRANULARITIES = ("hour", "day")
+DEFAULT_DIMENSIONS = ("store_id", "store_group", "all")
+DEFAULT_CHUNK_ROWS = 1000000
+DEFAULT_GROUP = "other"
+# bincount when the key range is at most this many times the rows
+_DENSE_RATIO = 4
+
+RevenueColumns = collections.namedtuple("RevenueColumns", "store_codes revenue epoch_ms")
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError(
+            "numpy is required for rollups, pip install numpy")
+
+
+class StoreDictionary:
+    """ store_id to int code in first seen order, and the store group of every code """
+
+    def __init__(self, groups=None):
+        self.ids = []
+        self._codes = {}
+        self._groups = groups or {}
+        self.group_names = []
+        self._group_codes = {}
+        self._group_of = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def code(self, store_id):
+        code = self._codes.get(store_id)
+        if code is None:
+            code = self._codes[store_id] = len(self.ids)
+            self.ids.append(store_id)
+            group = self._groups.get(store_id, DEFAULT_GROUP)
+            group_code = self._group_codes.get(group)
+            if group_code is None:
+                group_code = self._group_codes[group] = len(self.group_names)
+                self.group_names.append(group)
+            self._group_of.append(group_code)
+        return code
+
+    def group_codes(self):
+        """ Array of the group code of every store code """
+        return np.asarray(self._group_of, dtype=np.int64)
+
+
+def group_sum(keys, values, counts=None):
+    """
+    Sorted unique keys with the sum of values and of counts, every key counts
+    one when counts is None. bincount over the key range when it is dense,
+    sort + reduceat otherwise.
+    """
+    if not len(keys):
+        return keys, values, np.zeros(0, np.int64) if counts is None else counts
+    lo = int(keys.min())
+    span = int(keys.max()) - lo + 1
+    if span <= max(len(keys) * _DENSE_RATIO, 1024):
+        idx = keys - lo
+        if counts is None:
+            n = np.bincount(idx, minlength=span)
+        else:
+            n = np.bincount(idx, weights=counts, minlength=span).astype(np.int64)
+        present = np.flatnonzero(n)
+        sums = np.bincount(idx, weights=values, minlength=span)
+        return present + lo, sums[present], n[present]
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    sums = np.add.reduceat(values[order], starts)
+    if counts is None:
+        n = np.diff(np.append(starts, len(keys)))
+    else:
+        n = np.add.reduceat(counts[order], starts)
+    return keys[starts], sums, n
+
+
+class Rollup:
+    """ Revenue and input rows per (time bucket, key) of one dimension and granularity """
+
+    def __init__(self, dimension, granularity):
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"unknown dimension {dimension}, one of " + ", ".join(DIMENSIONS))
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"unknown granularity {granularity}, one of " + ", ".join(GRANULARITIES))
+        self.dimension = dimension
+        self.granularity = granularity
+        self.bucket_ms = GRANULARITIES[granularity]
+        self.buckets = np.zeros(0, np.int64)
+        self.keys = np.zeros(0, np.int64)
+        self.revenue = np.zeros(0, np.float64)
+        self.rows = np.zeros(0, np.int64)
+
+    def _merge(self, buckets, keys, revenue, counts, nkeys):
+        base = int(buckets.min())
+        composite, revenue, counts = group_sum((buckets - base) * nkeys + keys, revenue, counts)
+        return composite // nkeys + base, composite % nkeys, revenue, counts
+
+    def add(self, keys, revenue, epoch_ms, nkeys):
+        """ Sum a chunk of rows into the table, keys are codes below nkeys """
+        if not len(keys):
+            return
+        nkeys = max(nkeys, 1)
+        # Row timestamps are window ends, 15:00:00.000 closes a minute of the 14:00 hour
+        chunk = self._merge((epoch_ms - 1) // self.bucket_ms, keys, revenue, None, nkeys)
+        if len(self.keys):
+            chunk = self._merge(
+                np.concatenate((self.buckets, chunk[0])), np.concatenate((self.keys, chunk[1])),
+                np.concatenate((self.revenue, chunk[2])), np.concatenate((self.rows, chunk[3])), nkeys)
+        self.buckets, self.keys, self.revenue, self.rows = chunk
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_rows(self, labels=None):
+        """ Rows ordered by time then key, labels turn key codes back into names """
+        order = np.lexsort((self.keys, self.buckets))
+        for bucket, key, revenue, rows in zip(
+                self.buckets[order].tolist(), self.keys[order].tolist(),
+                self.revenue[order].tolist(), self.rows[order].tolist()):
+            row = {} if self.dimension == "all" else {self.dimension: labels[key]}
+            row["revenue"] = revenue
+            # Window end, like every other row timestamp
+            row["timestamp"] = format_timestamp((bucket + 1) * self.bucket_ms)
+            row["rows"] = rows
+            yield row
+
+
+def read_columns(paths, stores, chunk_rows=DEFAULT_CHUNK_ROWS, serializer=None, stats=None):
+    """
+    Yield RevenueColumns of at most chunk_rows from NDJSON files, gzipped when
+    the name ends in .gz. Rows of the other output streams, without store_id
+    and revenue or with window_seconds, are skipped and counted in stats.
+    """
+    _require_numpy()
+    loads = (serializer or get_serializer()).loads
+    code = stores.code
+    # A minute of output repeats one timestamp for every store, parse it once
+    epoch_ms_of = {}
+    stats = stats if stats is not None else {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("skipped", 0)
+    codes, revenue, epoch_ms = [], [], []
+
+    def _chunk():
+        columns = RevenueColumns(np.array(codes, np.int64), np.array(revenue, np.float64),
+                                 np.array(epoch_ms, np.int64))
+        del codes[:], revenue[:], epoch_ms[:]
+        return columns
+
+    for path in paths:
+        for line in iter_lines(open(path, "rb"), gzipped=path.endswith(".gz")):
+            row = loads(line)
+            # Hopping rows, with window_seconds, re-report the last window every slide
+            if "store_id" not in row or "revenue" not in row or "window_seconds" in row:
+                stats["skipped"] += 1
+                continue
+            timestamp = row["timestamp"]
+            ts = epoch_ms_of.get(timestamp)
+            if ts is None:
+                ts = epoch_ms_of[timestamp] = parse_evnt_time(timestamp)
+            codes.append(code(row["store_id"]))
+            revenue.append(row["revenue"])
+            epoch_ms.append(ts)
+            if len(codes) >= chunk_rows:
+                stats["rows"] += len(codes)
+                yield _chunk()
+        if len(epoch_ms_of) > chunk_rows:
+            epoch_ms_of.clear()
+    if codes:
+        stats["rows"] += len(codes)
+        yield _chunk()
+
+
+def rollup_columns(chunks, stores, granularities=DEFAULT_GRANULARITIES, dimensions=DEFAULT_DIMENSIONS):
+    """ Sum RevenueColumns chunks into {(dimension, granularity): Rollup} """
+    _require_numpy()
+    rollups = {(d, g): Rollup(d, g) for d in dimensions for g in granularities}
+    for chunk in chunks:
+        group_of = stores.group_codes()
+        keys = {
+            "store_id": (chunk.store_codes, len(stores)),
+            "store_group": (group_of[chunk.store_codes], len(stores.group_names)),
+            "all": (np.zeros(len(chunk.store_codes), np.int64), 1),
+        }
+        for (dimension, _), table in rollups.items():
+            table.add(keys[dimension][0], chunk.revenue, chunk.epoch_ms, keys[dimension][1])
+    return rollups
+
+
+def rollup(paths, granularities=DEFAULT_GRANULARITIES, dimensions=DEFAULT_DIMENSIONS, groups=None,
+           chunk_rows=DEFAULT_CHUNK_ROWS, stats=None):
+    """ Rollup tables of the revenue rows in paths, and the store dictionary that labels them """
+    stores = StoreDictionary(groups)
+    chunks = read_columns(paths, stores, chunk_rows, stats=stats)
+    return rollup_columns(chunks, stores, granularities, dimensions), stores
+
+
+def write_rollups(rollups, stores, dest_dir):
+    """ One NDJSON file per table, <dimension>_<granularity>.ndjson, returns {path: rows} """
+    os.makedirs(dest_dir, exist_ok=True)
+    labels = {"store_id": stores.ids, "store_group": stores.group_names, "all": None}
+    written = {}
+    for (dimension, granularity), table in rollups.items():
+        path = os.path.join(dest_dir, f"{dimension}_{granularity}.ndjson")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in table.to_rows(labels[dimension]):
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp, path)
+        written[path] = len(table)
+    return written
+
+
+def _csv_arg(value, choices):
+    items = tuple(v.strip() for v in value.split(",") if v.strip())
+    unknown = [v for v in items if v not in choices]
+    if unknown or not items:
+        raise argparse.ArgumentTypeError(f"{value}, pick from " + ", ".join(choices))
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Roll the per minute revenue rows up by hour, day and store group")
+    parser.add_argument("dest", help="Directory to write the rollup tables to")
+    parser.add_argument("paths", nargs="+", help="NDJSON firehose objects or gzipped compacted parts")
+    parser.add_argument("--granularity", type=lambda v: _csv_arg(v, GRANULARITIES),
+                        default=DEFAULT_GRANULARITIES, help="Comma separated, minute, hour, day")
+    parser.add_argument("--dimension", type=lambda v: _csv_arg(v, DIMENSIONS),
+                        default=DEFAULT_DIMENSIONS, help="Comma separated, store_id, store_group, all")
+    parser.add_argument("--store-groups", help="JSON file of {\"store_id\": \"group\"}")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="Rows read into columns at a time")
+    args = parser.parse_args(argv)
+    groups = None
+    if args.store_groups:
+        with open(args.store_groups, encoding="utf-8") as f:
+            groups = json.load(f)
+    stats = {}
+    rollups, stores = rollup(args.paths, args.granularity, args.dimension, groups, args.chunk_rows, stats)
+    written = write_rollups(rollups, stores, args.dest)
+    print(json.dumps(dict(stats, stores=len(stores), tables=written)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: serializer
+    :Actions: JSON to and from bytes, with orjson when it is packaged and the standard library otherwise
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Both backends write compact UTF-8 JSON, {"store_id":"store_1","sales":22.78},
+so switching backend does not change a single byte for our events and rows
+(strings, ints and finite floats). dumps returns bytes, ready for kinesis or
+firehose, serialize an event once and reuse the bytes.
+
+orjson is not part of the lambda runtime. Add it to the stream_common layer
+with `pip install orjson -t python/` on a linux x86_64 machine to use it.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StdlibSerializer:
+    """ The json module with compact separators, always available """
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(
+            separators=(",", ":"), ensure_ascii=False)
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj).encode("utf-8")
+
+    def loads(self, data):
+        """ Parse UTF-8 bytes or a str, raising UnicodeDecodeError or ValueError """
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return self._decoder.decode(data)
+
+
+class OrjsonSerializer:
+    """ orjson, several times faster than the json module on small objects """
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+        self.dumps = orjson.dumps
+
+    def loads(self, data):
+        """ Parse UTF-8 bytes or a str, raising UnicodeDecodeError or ValueError """
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson reports bad UTF-8 as a JSON error, keep the two apart like the json module
+            if isinstance(data, (bytes, bytearray)):
+                data.decode("utf-8")
+            raise
+
+
+BACKENDS = {
+    "json": StdlibSerializer,
+    "orjson": OrjsonSerializer,
+}
+
+
+def get_serializer(name="auto"):
+    """ The named backend, auto picks orjson when it can be imported """
+    if name in (None, "", "auto"):
+        name = "orjson" if orjson is not None else "json"
+    if name not in BACKENDS:
+        raise ValueError(f"unknown serializer {name}, one of auto, " + ", ".join(BACKENDS))
+    return BACKENDS[name]()
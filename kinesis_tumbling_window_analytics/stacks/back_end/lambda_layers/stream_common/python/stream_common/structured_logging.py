@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: structured_logging
+    :Actions: Cheap logging for the per-record loops of the producer and transformer
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Log lines in the hot loops cost more than the records they describe, so
+
+    - payloads are only serialized when a line is actually emitted (lazy_json),
+      and never beyond max_chars, however large the object
+    - per-record lines go through a LogSampler, e.g. one in a thousand
+    - anything counted per record is logged once per batch (BatchSummary)
+"""
+
+import json
+import logging
+
+DEFAULT_MAX_CHARS = 1024
+_ENCODER = json.JSONEncoder(default=str)
+
+
+def set_logging(lv="INFO"):
+    """ Helper to enable logging """
+    logging.basicConfig(level=lv)
+    logger = logging.getLogger()
+    logger.setLevel(lv)
+    return logger
+
+
+def truncate(text, max_chars=DEFAULT_MAX_CHARS):
+    """ Cut text to max_chars, noting how much was left out """
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(+{len(text) - max_chars} chars)"
+
+
+def dumps_bounded(obj, max_chars=DEFAULT_MAX_CHARS):
+    """ JSON of obj cut at max_chars, stops encoding once the limit is reached """
+    if max_chars is None:
+        return _ENCODER.encode(obj)
+    chunks = []
+    size = 0
+    for chunk in _ENCODER.iterencode(obj):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_chars:
+            return "".join(chunks)[:max_chars] + "...(truncated)"
+    return "".join(chunks)
+
+
+class lazy_json:
+    """ Log argument that is serialized, bounded, only if the record is emitted """
+    __slots__ = ("obj", "max_chars")
+
+    def __init__(self, obj, max_chars=DEFAULT_MAX_CHARS):
+        self.obj = obj
+        self.max_chars = max_chars
+
+    def __str__(self):
+        return dumps_bounded(self.obj, self.max_chars)
+
+
+class LogSampler:
+    """ True for one call in every 1/rate, deterministic so counts are predictable """
+
+    def __init__(self, rate):
+        rate = min(max(float(rate), 0.0), 1.0)
+        self.every = round(1 / rate) if rate else 0
+        self._n = 0
+
+    def __call__(self):
+        if not self.every:
+            return False
+        self._n += 1
+        if self._n >= self.every:
+            self._n = 0
+            return True
+        return False
+
+
+class BatchSummary:
+    """ Count per-record outcomes and keep a few examples, logged as a single line """
+
+    def __init__(self, max_examples=3, max_chars=DEFAULT_MAX_CHARS):
+        self.counts = {}
+        self.examples = {}
+        self.max_examples = max_examples
+        self.max_chars = max_chars
+
+    def add(self, reason, example=None):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if example is not None:
+            _examples = self.examples.setdefault(reason, [])
+            if len(_examples) < self.max_examples:
+                _examples.append(truncate(str(example), self.max_chars))
+
+    def __bool__(self):
+        return bool(self.counts)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def log(self, logger, level, name):
+        """ One line with every count and the kept examples, nothing when empty """
+        if self.counts and logger.isEnabledFor(level):
+            logger.log(level, '{"%s":%s,"examples":%s}', name,
+                       json.dumps(self.counts), json.dumps(self.examples))
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: top_k
+    :Actions: Top-K categories by revenue and by sales count, per store per tumbling window
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Every store keeps two Space-Saving summaries (Metwally et al.), one
+weighted by revenue and one by count, each tracking at most `capacity`
+categories. A category whose true total is above total / capacity is always
+reported, and no estimate is off by more than total / capacity, so memory
+stays constant however many categories the stream carries.
+
+    decode_records -> to_category_rows -> top_k_window -> format_top_k_rows
+
+Windows follow ROWTIME (arrival order), like tumbling_window.tumbling_window.
+
+The KDA application does not rank, it writes the exact revenue and
+sales_count of every store and category per window to top_categories/.
+rank_category_sums turns those rows into the same per store top-K, with no
+error, and --from-sums reads them instead of events.
+
+Usage: python -m stream_common.top_k [--k 3] [--capacity 64] [--window-seconds 60] [events.ndjson ...]
+       python -m stream_common.top_k --from-sums [--k 3] top_categories_stream-*
+"""
+
+import argparse
+import heapq
+import json
+import sys
+
+from stream_common.record_format import read_events
+from stream_common.tumbling_window import DEFAULT_WINDOW_SECONDS, as_real, format_timestamp, parse_evnt_time
+
+DEFAULT_K = 3
+DEFAULT_CAPACITY = 64
+
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving summary of at most capacity items. A new item
+    replaces the smallest counter and inherits its value as the error bound.
+    Each item has one min-heap entry, refreshed only when it reaches the top,
+    so increments are O(1) and a replacement is O(log capacity). Weights must
+    not be negative.
+    """
+    __slots__ = ("capacity", "counters", "total", "_heap")
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        # item -> [estimate, error]
+        self.counters = {}
+        self.total = 0
+        # (estimate when pushed, item), a lower bound of the item's estimate
+        self._heap = []
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+            heapq.heappush(self._heap, (weight, item))
+        else:
+            heap = self._heap
+            while True:
+                value, smallest = heap[0]
+                floor = self.counters[smallest][0]
+                if floor == value:
+                    break
+                heapq.heapreplace(heap, (floor, smallest))
+            del self.counters[smallest]
+            self.counters[item] = [floor + weight, floor]
+            heapq.heapreplace(heap, (floor + weight, item))
+
+    def top(self, k):
+        """ [(item, estimate, error)] of the k largest estimates """
+        return [(item, c[0], c[1]) for item, c in heapq.nlargest(
+            k, self.counters.items(), key=lambda kv: kv[1][0])]
+
+    def merge(self, other):
+        """ Fold in another summary, e.g. one per shard or per worker """
+        for item, (estimate, error) in other.counters.items():
+            self.add(item, estimate)
+            self.counters[item][1] += error
+        # add() counted the estimates, the stream total is the sum of the totals
+        self.total += other.total - sum(c[0] for c in other.counters.values())
+
+
+class StoreTopK:
+    """ Revenue and count summaries of every store in one window """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.stores = {}
+
+    def add(self, store_id, category, sales):
+        summaries = self.stores.get(store_id)
+        if summaries is None:
+            summaries = self.stores[store_id] = (
+                SpaceSaving(self.capacity), SpaceSaving(self.capacity))
+        summaries[0].add(category, sales)
+        summaries[1].add(category, 1)
+
+    def top(self, k):
+        """ {store_id: (top by revenue, top by count)} """
+        return {store: (by_revenue.top(k), by_count.top(k))
+                for store, (by_revenue, by_count) in self.stores.items()}
+
+
+def to_category_rows(events, time_fn=parse_evnt_time):
+    """ Yield (epoch_ms, store_id, category, sales) rows """
+    for event in events:
+        yield time_fn(event["evnt_time"]), event["store_id"], event["category"], event["sales"]
+
+
+def top_k_window(rows, window_seconds=DEFAULT_WINDOW_SECONDS, k=DEFAULT_K, capacity=DEFAULT_CAPACITY):
+    """ Yield (window_end_ms, {store_id: (top by revenue, top by count)}) as each window closes """
+    window_ms = int(window_seconds * 1000)
+    window_end = None
+    state = StoreTopK(capacity)
+    for ts, store_id, category, sales in rows:
+        if window_end is None:
+            window_end = ts - ts % window_ms + window_ms
+        elif ts >= window_end:
+            if state.stores:
+                yield window_end, state.top(k)
+                state = StoreTopK(capacity)
+            window_end = ts - ts % window_ms + window_ms
+        state.add(store_id, category, sales)
+    if state.stores:
+        yield window_end, state.top(k)
+
+
+def rank_category_sums(rows, k=DEFAULT_K):
+    """
+    Yield (window_end_ms, {store_id: (top by revenue, top by count)}) from
+    DEST_SQL_STREAM_TOP_CATEGORIES rows, in window order. The rows are exact
+    sums, so every error is 0, rows repeating a store and category are added.
+    """
+    windows = {}
+    for row in rows:
+        window = windows.setdefault(parse_evnt_time(row["timestamp"]), {})
+        acc = window.setdefault(row["store_id"], {}).setdefault(row["category"], [0.0, 0])
+        acc[0] += row["revenue"]
+        acc[1] += row["sales_count"]
+    for window_end in sorted(windows):
+        stores = {}
+        for store_id, categories in windows[window_end].items():
+            by_revenue = heapq.nlargest(k, categories.items(), key=lambda kv: kv[1][0])
+            by_count = heapq.nlargest(k, categories.items(), key=lambda kv: kv[1][1])
+            stores[store_id] = ([(c, v[0], 0.0) for c, v in by_revenue],
+                                [(c, v[1], 0) for c, v in by_count])
+        yield window_end, stores
+
+
+def format_top_k_rows(windows):
+    """ One DEST_SQL_STREAM_TOP_CATEGORIES style row per store, category and rank """
+    for window_end, stores in windows:
+        timestamp = format_timestamp(window_end)
+        for store_id, (by_revenue, by_count) in stores.items():
+            for rank, (category, revenue, error) in enumerate(by_revenue, 1):
+                yield {"store_id": store_id, "category": category, "rank": rank, "metric": "revenue",
+                       "value": as_real(revenue), "max_error": as_real(error), "timestamp": timestamp}
+            for rank, (category, count, error) in enumerate(by_count, 1):
+                yield {"store_id": store_id, "category": category, "rank": rank, "metric": "sales_count",
+                       "value": count, "max_error": error, "timestamp": timestamp}
+
+
+def run(events, window_seconds=DEFAULT_WINDOW_SECONDS, k=DEFAULT_K, capacity=DEFAULT_CAPACITY):
+    """ Full operator chain from producer events to top-K rows """
+    return format_top_k_rows(top_k_window(to_category_rows(events), window_seconds, k, capacity))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Top-K categories by revenue and count per store per tumbling window")
+    parser.add_argument("paths", nargs="*", help="NDJSON event files, - for stdin")
+    parser.add_argument("--window-seconds", type=float, default=DEFAULT_WINDOW_SECONDS)
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY,
+                        help="Categories tracked per store, bounds memory and error")
+    parser.add_argument("--from-sums", action="store_true",
+                        help="Inputs are the per store category sums of the KDA application, rank them")
+    args = parser.parse_args(argv)
+    if args.from_sums:
+        rows = format_top_k_rows(rank_category_sums(read_events(args.paths, "json"), args.k))
+    else:
+        rows = run(read_events(args.paths), args.window_seconds, args.k, max(args.capacity, args.k))
+    for row in rows:
+        sys.stdout.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
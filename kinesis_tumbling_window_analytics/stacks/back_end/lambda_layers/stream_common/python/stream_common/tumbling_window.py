@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: tumbling_window
+    :Actions: Run the store revenue tumbling window aggregation outside of AWS
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Local equivalent of the kinesis analytics pump,
+
+    SELECT STREAM "store_id", SUM("sales") AS "revenue", ROWTIME AS "timestamp"
+        FROM "STORE_REVENUE_PER_MIN_001"
+        GROUP BY STEP("STORE_REVENUE_PER_MIN_001".ROWTIME BY INTERVAL '60' SECOND), "store_id"
+
+built as a chain of generators,
+
+    decode_records -> [drop_duplicates] -> to_rows -> tumbling_window -> format_rows
+                                                      event_time_window
+                                                      hopping_window
+
+Each stage can be replaced, e.g. feed pre-parsed (epoch_ms, key, value) rows
+straight into tumbling_window for capacity planning. Only the accumulators
+of the open window are held in memory, one float per group-by key.
+
+tumbling_window follows ROWTIME (arrival order). event_time_window windows on
+the event time instead and closes windows on a watermark that trails the
+largest event time seen by a fixed delay. Events arriving after their window
+fired, but within the allowed lateness, are emitted as additive update rows.
+Anything later goes to the on_late side output. Summing rows per key and
+timestamp gives the final revenue, the same contract as the event time SQL.
+
+hopping_window reports the last window_seconds every slide_seconds, e.g.
+the last 5 minutes every 10 seconds. Rows are summed once into the slide
+long pane they arrive in, and closing a pane adds it to running totals and
+subtracts the pane that left the window, so a row costs the same whatever
+the window / slide ratio.
+
+drop_duplicates skips events whose event_id was already seen within the
+window and lateness horizon, in fixed memory, see stream_common.dedup.
+
+Usage: python -m stream_common.tumbling_window [--window-seconds 60] [--slide-seconds 10] [--event-time] [--dedup-capacity 60000] [events.ndjson ...]
+"""
+
+import argparse
+import collections
+import datetime
+import functools
+import json
+import struct
+import sys
+
+from stream_common.dedup import DEFAULT_ERROR_RATE, Deduplicator
+from stream_common.kpl_aggregation import deaggregate
+from stream_common.record_format import get_record_format, read_events
+
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_GROUP_BY = ("store_id",)
+_EPOCH = datetime.datetime(1970, 1, 1)
+_FLOAT32 = struct.Struct("f")
+
+
+@functools.lru_cache(maxsize=4096)
+def _epoch_seconds(prefix):
+    """ Epoch seconds of a 'YYYY-MM-DDTHH:MM:SS' prefix, cached as events share seconds """
+    return int((datetime.datetime.strptime(prefix, "%Y-%m-%dT%H:%M:%S") - _EPOCH).total_seconds())
+
+
+def parse_evnt_time(value):
+    """ Epoch milliseconds of a producer evnt_time, e.g. 2021-01-31T14:05:47.190114 """
+    value = value.replace(" ", "T", 1)
+    millis = 0
+    if len(value) > 20 and value[19] == ".":
+        millis = int(value[20:23].ljust(3, "0"))
+    return _epoch_seconds(value[:19]) * 1000 + millis
+
+
+def format_timestamp(epoch_ms):
+    """ Render epoch milliseconds like the kinesis analytics TIMESTAMP output """
+    dt = _EPOCH + datetime.timedelta(milliseconds=epoch_ms)
+    return dt.strftime("%Y-%m-%d %H:%M:%S.") + f"{dt.microsecond // 1000:03d}"
+
+
+def as_real(value):
+    """ Round a python float to the shortest repr of the SQL REAL (float32) it becomes """
+    real = _FLOAT32.unpack(_FLOAT32.pack(value))[0]
+    for precision in range(6, 10):
+        candidate = float(f"{real:.{precision}g}")
+        if _FLOAT32.unpack(_FLOAT32.pack(candidate))[0] == real:
+            return candidate
+    return real
+
+
+def decode_records(records, encoding="utf-8", record_format="auto"):
+    """ Yield events from raw kinesis record payloads, JSON or CSV, de-aggregating KPL records """
+    loads = get_record_format(record_format).loads
+    for data in records:
+        if isinstance(data, str):
+            data = data.encode(encoding)
+        for user_record in deaggregate(data):
+            yield loads(user_record.data.decode(encoding))
+
+
+def drop_duplicates(events, dedup, id_field="event_id", time_field="evnt_time"):
+    """ Events whose id the Deduplicator has not seen, events without an id are all kept """
+    seen = dedup.seen
+    for event in events:
+        event_id = event.get(id_field)
+        if event_id is None or not seen(event_id, parse_evnt_time(event[time_field])):
+            yield event
+
+
+def to_rows(events, group_by=DEFAULT_GROUP_BY, value_field="sales", time_field="evnt_time", time_fn=parse_evnt_time):
+    """ Yield (epoch_ms, key, value) rows, key is a scalar for a single group-by column """
+    if len(group_by) == 1:
+        _col = group_by[0]
+        for event in events:
+            yield time_fn(event[time_field]), event[_col], event[value_field]
+    else:
+        for event in events:
+            yield time_fn(event[time_field]), tuple(event[c] for c in group_by), event[value_field]
+
+
+def tumbling_window(rows, window_seconds=DEFAULT_WINDOW_SECONDS):
+    """
+    Sum values per key per tumbling window and yield (window_end_ms, sums) as
+    each window closes. Like ROWTIME, row time never moves backwards, a row
+    that arrives late is counted in the window that is currently open.
+    """
+    window_ms = int(window_seconds * 1000)
+    window_end = None
+    sums = {}
+    for ts, key, value in rows:
+        if window_end is None:
+            window_end = ts - ts % window_ms + window_ms
+        elif ts >= window_end:
+            if sums:
+                yield window_end, sums
+                sums = {}
+            window_end = ts - ts % window_ms + window_ms
+        sums[key] = sums.get(key, 0.0) + value
+    if sums:
+        yield window_end, sums
+
+
+def event_time_window(
+    rows,
+    window_seconds=DEFAULT_WINDOW_SECONDS,
+    watermark_delay_seconds=0,
+    allowed_lateness_seconds=0,
+    on_late=None
+):
+    """
+    Sum values per key per event time window and yield (window_end_ms, sums).
+    A window fires once the watermark passes its end, late rows within the
+    allowed lateness are yielded later as delta sums for the same window, and
+    rows beyond it are passed to on_late. Windows are dropped when the
+    watermark passes end + lateness, so state is bounded by
+    (watermark delay + lateness) / window + 1 windows.
+    """
+    window_ms = int(window_seconds * 1000)
+    delay_ms = int(watermark_delay_seconds * 1000)
+    lateness_ms = int(allowed_lateness_seconds * 1000)
+    watermark = None
+    boundary = None
+    open_windows = {}
+    # Fired windows still accepting late rows, holding the deltas not yet emitted
+    fired = {}
+
+    for ts, key, value in rows:
+        end = ts - ts % window_ms + window_ms
+        if watermark is not None and end <= watermark:
+            if end + lateness_ms <= watermark:
+                if on_late is not None:
+                    on_late((ts, key, value))
+                continue
+            sums = fired.get(end)
+            if sums is None:
+                sums = fired[end] = {}
+        else:
+            sums = open_windows.get(end)
+            if sums is None:
+                sums = open_windows[end] = {}
+        sums[key] = sums.get(key, 0.0) + value
+
+        _wm = ts - delay_ms
+        if watermark is None or _wm > watermark:
+            watermark = _wm
+            # Windows only fire on window boundaries, skip the bookkeeping in between
+            _boundary = watermark - watermark % window_ms
+            if _boundary != boundary:
+                boundary = _boundary
+                for end in sorted(e for e in open_windows if e <= watermark):
+                    yield end, open_windows.pop(end)
+                    fired[end] = {}
+                for end in sorted(fired):
+                    if fired[end]:
+                        yield end, fired[end]
+                        fired[end] = {}
+                    if end + lateness_ms <= watermark:
+                        del fired[end]
+
+    for end in sorted(fired):
+        if fired[end]:
+            yield end, fired[end]
+    for end in sorted(open_windows):
+        yield end, open_windows[end]
+
+
+def hopping_window(rows, window_seconds=DEFAULT_WINDOW_SECONDS, slide_seconds=10):
+    """
+    Sum values per key over the last window_seconds and yield (window_end_ms,
+    sums) every slide_seconds, in ROWTIME like tumbling_window. window_seconds
+    must be a multiple of slide_seconds. A key stays in the totals while any
+    pane of the window holds it, so keys that leave are dropped, not left at
+    a rounding residue. After the last row the open windows are drained.
+    """
+    window_ms = int(window_seconds * 1000)
+    slide_ms = int(slide_seconds * 1000)
+    if slide_ms <= 0 or window_ms % slide_ms:
+        raise ValueError("window_seconds must be a positive multiple of slide_seconds")
+    panes_per_window = window_ms // slide_ms
+    # Closed panes of the current window, oldest first
+    panes = collections.deque()
+    totals = {}
+    # Number of panes in the window holding each key
+    counts = {}
+
+    def _close(pane):
+        panes.append(pane)
+        for key, value in pane.items():
+            totals[key] = totals.get(key, 0.0) + value
+            counts[key] = counts.get(key, 0) + 1
+        if len(panes) > panes_per_window:
+            for key, value in panes.popleft().items():
+                if counts[key] == 1:
+                    del counts[key]
+                    del totals[key]
+                else:
+                    counts[key] -= 1
+                    totals[key] -= value
+
+    pane_end = None
+    pane = {}
+    for ts, key, value in rows:
+        if pane_end is None:
+            pane_end = ts - ts % slide_ms + slide_ms
+        elif ts >= pane_end:
+            next_end = ts - ts % slide_ms + slide_ms
+            # Slide through the gap until the window runs empty, then jump ahead
+            while pane_end < next_end and (pane or totals):
+                _close(pane)
+                pane = {}
+                if totals:
+                    yield pane_end, dict(totals)
+                pane_end += slide_ms
+            if not totals:
+                panes.clear()
+            pane_end = next_end
+        pane[key] = pane.get(key, 0.0) + value
+
+    while pane or totals:
+        _close(pane)
+        pane = {}
+        if totals:
+            yield pane_end, dict(totals)
+        pane_end += slide_ms
+
+
+def format_rows(windows, group_by=DEFAULT_GROUP_BY, value_name="revenue"):
+    """ Yield the DEST_SQL_STREAM_BY_STORE_ID rows for each closed window """
+    single = len(group_by) == 1
+    for window_end, sums in windows:
+        timestamp = format_timestamp(window_end)
+        for key, total in sums.items():
+            row = {group_by[0]: key} if single else dict(zip(group_by, key))
+            row[value_name] = as_real(total)
+            row["timestamp"] = timestamp
+            yield row
+
+
+def run(
+    events,
+    window_seconds=DEFAULT_WINDOW_SECONDS,
+    group_by=DEFAULT_GROUP_BY,
+    event_time=False,
+    watermark_delay_seconds=0,
+    allowed_lateness_seconds=0,
+    on_late=None,
+    slide_seconds=None,
+    dedup=None
+):
+    """
+    Full operator chain from producer events to output rows, hopping when
+    slide_seconds is set, dropping replayed event ids with a Deduplicator
+    """
+    if dedup is not None:
+        events = drop_duplicates(events, dedup)
+    rows = to_rows(events, group_by)
+    if slide_seconds:
+        if event_time:
+            raise ValueError("hopping windows follow ROWTIME, drop event_time or slide_seconds")
+        windows = hopping_window(rows, window_seconds, slide_seconds)
+    elif event_time:
+        windows = event_time_window(
+            rows, window_seconds, watermark_delay_seconds, allowed_lateness_seconds, on_late)
+    else:
+        windows = tumbling_window(rows, window_seconds)
+    return format_rows(windows, group_by)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay NDJSON producer events through the tumbling window aggregation")
+    parser.add_argument("paths", nargs="*", help="NDJSON event files, - for stdin")
+    parser.add_argument("--window-seconds", type=float, default=DEFAULT_WINDOW_SECONDS)
+    parser.add_argument("--group-by", default=",".join(DEFAULT_GROUP_BY),
+                        help="Comma separated group-by columns")
+    parser.add_argument("--slide-seconds", type=float,
+                        help="Report the last --window-seconds every --slide-seconds")
+    parser.add_argument("--event-time", action="store_true",
+                        help="Window on evnt_time with a watermark instead of arrival order")
+    parser.add_argument("--watermark-delay-seconds", type=float, default=0)
+    parser.add_argument("--allowed-lateness-seconds", type=float, default=0)
+    parser.add_argument("--late-output", help="Write events beyond the allowed lateness to this NDJSON file")
+    parser.add_argument("--dedup-capacity", type=int, default=0,
+                        help="Drop repeated event_id values, sized for this many events per window, 0 is off")
+    parser.add_argument("--dedup-error-rate", type=float, default=DEFAULT_ERROR_RATE,
+                        help="Share of unique events taken for duplicates at capacity")
+    args = parser.parse_args(argv)
+    group_by = tuple(c.strip() for c in args.group_by.split(",") if c.strip())
+
+    late_f = open(args.late_output, "w", encoding="utf-8") if args.late_output else None
+
+    def _on_late(row):
+        if late_f:
+            late_f.write(json.dumps(
+                {"evnt_time": format_timestamp(row[0]), "key": row[1], "value": row[2]}) + "\n")
+
+    dedup = None
+    if args.dedup_capacity:
+        _horizon = args.window_seconds + args.watermark_delay_seconds + args.allowed_lateness_seconds
+        dedup = Deduplicator(args.window_seconds, _horizon, args.dedup_capacity, args.dedup_error_rate)
+
+    try:
+        for row in run(
+            read_events(args.paths),
+            args.window_seconds,
+            group_by,
+            event_time=args.event_time,
+            watermark_delay_seconds=args.watermark_delay_seconds,
+            allowed_lateness_seconds=args.allowed_lateness_seconds,
+            on_late=_on_late,
+            slide_seconds=args.slide_seconds,
+            dedup=dedup
+        ):
+            sys.stdout.write(json.dumps(row) + "\n")
+    finally:
+        if late_f:
+            late_f.close()
+    if dedup is not None:
+        sys.stderr.write(json.dumps(dedup.stats) + "\n")
+
+
+if __name__ == "__main__":
+    main()
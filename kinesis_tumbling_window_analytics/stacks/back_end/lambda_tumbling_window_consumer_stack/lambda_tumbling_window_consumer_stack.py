@@ -0,0 +1,124 @@
+from aws_cdk import core
+from aws_cdk import aws_lambda as _lambda
+from aws_cdk import aws_iam as _iam
+from aws_cdk import aws_logs as _logs
+
+
+class GlobalArgs:
+    """
+    Helper to define global statics
+    """
+
+    OWNER = "MystiqueAutomation"
+    ENVIRONMENT = "production"
+    REPO_NAME = "kinesis-tumbling-window-analytics"
+    SOURCE_INFO = f"https://github.com/miztiik/{REPO_NAME}"
+    VERSION = "2021_01_24"
+    MIZTIIK_SUPPORT_EMAIL = ["mystique@example.com", ]
+
+
+class LambdaTumblingWindowConsumerStack(core.Stack):
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        construct_id: str,
+        stack_log_level: str,
+        src_stream,
+        dest_stream,
+        window_seconds: int = 60,
+        batch_size: int = 1000,
+        max_batching_window_seconds: int = 5,
+        parallelization_factor: int = 1,
+        dedup_capacity: int = 0,
+        **kwargs
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # Shared code for the lambda functions, KPL de-aggregation and the window rows
+        stream_common_layer = _lambda.LayerVersion(
+            self,
+            "streamCommonLayer",
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/lambda_layers/stream_common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_7],
+            description="Shared code for the stream producer, transformer and consumers"
+        )
+
+        window_consumer_fn = _lambda.Function(
+            self,
+            "tumblingWindowConsumerFn",
+            function_name=f"tumbling_window_consumer_{construct_id}",
+            description="Sum store revenue in lambda tumbling windows and deliver it to firehose",
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/lambda_tumbling_window_consumer_stack/lambda_src"),
+            handler="tumbling_window_consumer.lambda_handler",
+            layers=[stream_common_layer],
+            timeout=core.Duration.seconds(30),
+            environment={
+                "LOG_LEVEL": "INFO",
+                "APP_ENV": "Production",
+                "DELIVERY_STREAM_NAME": f"{dest_stream.delivery_stream_name}",
+                "BATCH_MAX_RETRIES": "5",
+                "DEDUP_CAPACITY": f"{dedup_capacity}",
+                "DEDUP_ERROR_RATE": "0.01"
+            }
+        )
+
+        # Create Custom Loggroup for Consumer
+        window_consumer_lg = _logs.LogGroup(
+            self,
+            "tumblingWindowConsumerLogGroup",
+            log_group_name=f"/aws/lambda/{window_consumer_fn.function_name}",
+            removal_policy=core.RemovalPolicy.DESTROY,
+            retention=_logs.RetentionDays.ONE_DAY
+        )
+
+        src_stream.grant_read(window_consumer_fn)
+
+        roleStmt1 = _iam.PolicyStatement(
+            effect=_iam.Effect.ALLOW,
+            resources=[f"arn:aws:firehose:{core.Aws.REGION}:{core.Aws.ACCOUNT_ID}:deliverystream/{dest_stream.delivery_stream_name}"
+                       ],
+            actions=[
+                "firehose:DescribeDeliveryStream",
+                "firehose:PutRecordBatch"
+            ]
+        )
+        roleStmt1.sid = "AllowWindowConsumerWriteToFirehose"
+        window_consumer_fn.add_to_role_policy(roleStmt1)
+
+        # One state per shard (and per concurrent batch with a parallelization factor) per window.
+        # Larger batches mean fewer invocations, each of which round trips the state.
+        window_consumer_esm = _lambda.CfnEventSourceMapping(
+            self,
+            "tumblingWindowConsumerEventSource",
+            function_name=window_consumer_fn.function_name,
+            event_source_arn=src_stream.stream_arn,
+            starting_position="LATEST",
+            batch_size=batch_size,
+            maximum_batching_window_in_seconds=max_batching_window_seconds,
+            parallelization_factor=parallelization_factor,
+            tumbling_window_in_seconds=window_seconds,
+            # Retrying a batch replays it into the same window state, splitting it would not help
+            bisect_batch_on_function_error=False,
+            maximum_retry_attempts=10
+        )
+
+        ###########################################
+        ################# OUTPUTS #################
+        ###########################################
+        output_0 = core.CfnOutput(
+            self,
+            "AutomationFrom",
+            value=f"{GlobalArgs.SOURCE_INFO}",
+            description="To know more about this automation stack, check out our github page."
+        )
+
+        output_1 = core.CfnOutput(
+            self,
+            "tumblingWindowConsumer",
+            value=f"https://console.aws.amazon.com/lambda/home?region={core.Aws.REGION}#/functions/{window_consumer_fn.function_name}",
+            description="Sum store revenue in lambda tumbling windows and deliver it to firehose."
+        )
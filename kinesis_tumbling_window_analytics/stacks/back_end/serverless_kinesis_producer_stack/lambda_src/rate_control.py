@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+.. module: rate_control
+    :Actions: Pace the producer per shard, backing off when kinesis throttles
+    :copyright: (c) 2021 Mystique.,
+.. moduleauthor:: Mystique
+.. contactauthor:: miztiik@github issues
+
+Every shard gets a records and a bytes token bucket, refilled at the shard
+share of the target rate, capped at the kinesis per-shard write limits. On
+throttling the shard rate is halved (multiplicative decrease) and then
+grows back linearly while writes succeed (additive increase).
+"""
+
+import time
+
+__author__ = "Mystique"
+__email__ = "miztiik@github"
+__version__ = "0.0.1"
+__status__ = "production"
+
+# Kinesis per shard write limits
+SHARD_MAX_RECORDS_PER_S = 1000
+SHARD_MAX_BYTES_PER_S = 1024 * 1024
+
+
+class TokenBucket:
+    """ Tokens refill at rate per second up to capacity, a reservation may run into debt """
+
+    def __init__(self, rate, burst_s=0.1, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst_s = burst_s
+        self.clock = clock
+        self.tokens = self.capacity
+        self._last = clock()
+
+    @property
+    def capacity(self):
+        return max(self.rate * self.burst_s, 1.0)
+
+    def reserve(self, n):
+        """ Take n tokens, returns the seconds to wait until the debt is paid """
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self._last) * self.rate)
+        self._last = now
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ShardRateController:
+    """ Token buckets per shard with AIMD adjustment on throttling feedback """
+
+    def __init__(
+        self,
+        hash_keys,
+        target_events_per_s=0,
+        target_bytes_per_s=0,
+        utilization=0.95,
+        count_records=True,
+        min_factor=0.05,
+        increase_per_s=0.1,
+        decrease_interval_s=1.0,
+        min_sleep_s=0.005,
+        clock=time.monotonic,
+        sleep=time.sleep
+    ):
+        shards = max(len(hash_keys), 1)
+        self.shard_index = {hk: i for i, hk in enumerate(hash_keys)}
+        # 0 means as fast as the shards allow
+        self.record_cap = SHARD_MAX_RECORDS_PER_S * utilization
+        if target_events_per_s:
+            self.record_cap = min(self.record_cap, target_events_per_s / shards)
+        self.byte_cap = SHARD_MAX_BYTES_PER_S * utilization
+        if target_bytes_per_s:
+            self.byte_cap = min(self.byte_cap, target_bytes_per_s / shards)
+        # With KPL aggregation many events share one kinesis record, only bytes bind
+        self.count_records = count_records
+        self.min_factor = min_factor
+        self.increase_per_s = increase_per_s
+        self.decrease_interval_s = decrease_interval_s
+        self.min_sleep_s = min_sleep_s
+        self.clock = clock
+        self.sleep = sleep
+        now = clock()
+        self.factor = [1.0] * shards
+        self._last_increase = [now] * shards
+        self._last_decrease = [now - decrease_interval_s] * shards
+        self.records = [TokenBucket(self.record_cap, clock=clock)
+                        for _ in range(shards)]
+        self.bytes = [TokenBucket(self.byte_cap, clock=clock)
+                      for _ in range(shards)]
+        self.stats = {"throttle_events": 0, "rate_decreases": 0, "paced_s": 0.0}
+
+    def acquire(self, shard, nbytes):
+        """ Block until shard has budget for one event of nbytes """
+        wait = self.bytes[shard].reserve(nbytes)
+        if self.count_records:
+            wait = max(wait, self.records[shard].reserve(1))
+        # Sleeping in tiny slices costs more than it paces
+        if wait >= self.min_sleep_s:
+            self.stats["paced_s"] += wait
+            self.sleep(wait)
+
+    def _set_factor(self, shard, factor):
+        self.factor[shard] = factor
+        self.records[shard].rate = self.record_cap * factor
+        self.bytes[shard].rate = self.byte_cap * factor
+
+    def on_result(self, entries, results):
+        """ Feed back a put_records outcome, results is None when the whole call was throttled """
+        now = self.clock()
+        throttled = set()
+        succeeded = set()
+        for i, entry in enumerate(entries):
+            shard = self.shard_index.get(entry.get("ExplicitHashKey"))
+            if shard is None:
+                continue
+            if results is None or "ErrorCode" in results[i]:
+                throttled.add(shard)
+            else:
+                succeeded.add(shard)
+        for shard in throttled:
+            self.stats["throttle_events"] += 1
+            # One halving per interval, a batch full of failures is a single signal
+            if now - self._last_decrease[shard] >= self.decrease_interval_s:
+                self._last_decrease[shard] = now
+                self._last_increase[shard] = now
+                self.stats["rate_decreases"] += 1
+                self._set_factor(shard, max(
+                    self.min_factor, self.factor[shard] * 0.5))
+        for shard in succeeded - throttled:
+            if self.factor[shard] < 1.0:
+                self._set_factor(shard, min(
+                    1.0, self.factor[shard] + self.increase_per_s * (now - self._last_increase[shard])))
+            self._last_increase[shard] = now
+
+    def rates(self):
+        """ Current records/s and bytes/s budget of every shard """
+        return [
+            {"records_per_s": round(r.rate, 1), "bytes_per_s": round(b.rate)}
+            for r, b in zip(self.records, self.bytes)
+        ]
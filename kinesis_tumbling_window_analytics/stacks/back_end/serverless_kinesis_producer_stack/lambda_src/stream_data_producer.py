@@ -8,14 +8,28 @@
 """
 
 
+import collections
+import concurrent.futures
+import itertools
 import json
 import logging
-import datetime
 import os
 import random
+import time
 import uuid
 
 import boto3
+from botocore.config import Config
+
+from stream_common.kpl_aggregation import HashKeyAggregator
+from stream_common.load_generator import LoadGenerator, replay_ndjson
+from stream_common.metrics import (BATCH_BYTES_BUCKETS, BATCH_RECORDS_BUCKETS,
+                                   LATENCY_BUCKETS_MS, Metrics)
+from stream_common.pre_aggregation import PreAggregator
+from stream_common.record_format import get_record_format
+from stream_common.serializer import get_serializer
+from stream_common.structured_logging import LogSampler, lazy_json, set_logging
+from rate_control import ShardRateController
 
 __author__ = "Mystique"
 __email__ = "miztiik@github"
@@ -29,19 +43,79 @@ class GlobalArgs:
     ENVIRONMENT = "production"
     MODULE_NAME = "stream_data_producer"
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    # Share of generated events logged at DEBUG, and the longest payload put in a log line
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.001))
+    LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 1024))
     STREAM_NAME = os.getenv("STREAM_NAME", "data_pipe")
     STREAM_AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+    # Kinesis PutRecords hard limits
+    MAX_RECORDS_PER_BATCH = 500
+    MAX_BYTES_PER_BATCH = 5 * 1024 * 1024
+    MAX_BYTES_PER_RECORD = 1024 * 1024
+    BATCH_MAX_RECORDS = min(
+        int(os.getenv("BATCH_MAX_RECORDS", MAX_RECORDS_PER_BATCH)), MAX_RECORDS_PER_BATCH)
+    BATCH_MAX_BYTES = min(
+        int(os.getenv("BATCH_MAX_BYTES", MAX_BYTES_PER_BATCH)), MAX_BYTES_PER_BATCH)
+    BATCH_MAX_AGE_MS = int(os.getenv("BATCH_MAX_AGE_MS", 1000))
+    BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", 5))
+    BACKOFF_BASE_MS = int(os.getenv("BACKOFF_BASE_MS", 50))
+    BACKOFF_CAP_MS = int(os.getenv("BACKOFF_CAP_MS", 2000))
+    # Stop producing and drain the buffer when this close to the lambda timeout
+    DEADLINE_MARGIN_MS = int(os.getenv("DEADLINE_MARGIN_MS", 2000))
+    # Pack user records into KPL aggregated records, every consumer must de-aggregate
+    AGGREGATION_ENABLED = os.getenv(
+        "AGGREGATION_ENABLED", "false").lower() == "true"
+    AGGREGATION_MAX_BYTES = int(os.getenv("AGGREGATION_MAX_BYTES", 51200))
+    # Writer threads per invocation, each pinned to a share of the stream shards
+    PRODUCER_CONCURRENCY = max(1, int(os.getenv("PRODUCER_CONCURRENCY", 1)))
+    # Pace writes per shard, 0 targets mean as fast as the shard limits allow
+    RATE_CONTROL_ENABLED = os.getenv(
+        "RATE_CONTROL_ENABLED", "true").lower() == "true"
+    TARGET_EVENTS_PER_S = float(os.getenv("TARGET_EVENTS_PER_S", 0))
+    TARGET_BYTES_PER_S = float(os.getenv("TARGET_BYTES_PER_S", 0))
+    SHARD_UTILIZATION = float(os.getenv("SHARD_UTILIZATION", 0.95))
+    # Error codes that mean slow down, not give up
+    THROTTLE_ERROR_CODES = (
+        "ProvisionedThroughputExceededException",
+        "LimitExceededException",
+        "ThrottlingException",
+    )
+    # JSON backend for the event payloads, auto uses orjson when the layer has it
+    SERIALIZER = os.getenv("SERIALIZER", "auto")
+    # Wire format of the events, json or csv rows in the KDA input column order, about half the bytes
+    RECORD_FORMAT = os.getenv("RECORD_FORMAT", "json")
+    # Send per store and category partial sums every this many seconds of event time instead of
+    # every event, 0 sends raw events. Pick a divisor of the analytics window.
+    PRE_AGGREGATION_SECONDS = float(os.getenv("PRE_AGGREGATION_SECONDS", 0))
+    # Synthetic load, LOAD_SEED makes the keys and sales of every invocation repeat
+    LOAD_SEED = os.getenv("LOAD_SEED")
+    LOAD_STORES = int(os.getenv("LOAD_STORES", 5))
+    LOAD_CATEGORIES = os.getenv("LOAD_CATEGORIES", "Books,Electronics")
+    LOAD_STORE_SKEW = float(os.getenv("LOAD_STORE_SKEW", 0))
+    LOAD_CATEGORY_SKEW = float(os.getenv("LOAD_CATEGORY_SKEW", 0))
+    # Distinct customer_id and product_id values, 0 leaves the field out of the events
+    LOAD_CUSTOMERS = int(os.getenv("LOAD_CUSTOMERS", 0))
+    LOAD_PRODUCTS = int(os.getenv("LOAD_PRODUCTS", 0))
+    # Stamp every event with an event_id, also used as partition key, so consumers can drop replays
+    EVENT_IDS_ENABLED = os.getenv(
+        "EVENT_IDS_ENABLED", "true").lower() == "true"
+    LOAD_JITTER_MS = float(os.getenv("LOAD_JITTER_MS", 0))
+    LOAD_OUT_OF_ORDER_RATIO = float(os.getenv("LOAD_OUT_OF_ORDER_RATIO", 0))
+    LOAD_MAX_DELAY_MS = float(os.getenv("LOAD_MAX_DELAY_MS", 0))
+    # Replay events from an NDJSON file shipped with the function instead of generating them
+    LOAD_REPLAY_PATH = os.getenv("LOAD_REPLAY_PATH")
+    # Publish one embedded metric format line per invocation
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_NAMESPACE = os.getenv(
+        "METRICS_NAMESPACE", "KinesisTumblingWindowAnalytics")
 
 
-def set_logging(lv=GlobalArgs.LOG_LEVEL):
-    """ Helper to enable logging """
-    logging.basicConfig(level=lv)
-    logger = logging.getLogger()
-    logger.setLevel(lv)
-    return logger
-
-
-logger = set_logging()
+logger = set_logging(GlobalArgs.LOG_LEVEL)
+serializer = get_serializer(GlobalArgs.SERIALIZER)
+event_format = get_record_format(GlobalArgs.RECORD_FORMAT, serializer)
+if GlobalArgs.PRE_AGGREGATION_SECONDS and GlobalArgs.RECORD_FORMAT.lower() == "csv":
+    raise ValueError(
+        "PRE_AGGREGATION_SECONDS needs RECORD_FORMAT=json, a csv row has no events column")
 
 
 def _gen_uuid():
@@ -49,67 +123,370 @@ def _gen_uuid():
     return str(uuid.uuid4())
 
 
-def send_data(client, data, key, stream_name):
-    logger.info(
-        f'{{"data":{json.dumps(data)}}}')
-    resp = client.put_records(
-        Records=[
-            {
-                "Data": json.dumps(data),
-                "PartitionKey": key},
-        ],
-        StreamName=stream_name
-    )
-    logger.info(f"Response:{resp}")
+class KinesisBatchWriter:
+    """ Buffer records and ship them with as few PutRecords calls as the Kinesis limits allow """
+
+    def __init__(
+        self,
+        client,
+        stream_name,
+        context=None,
+        max_records=GlobalArgs.BATCH_MAX_RECORDS,
+        max_bytes=GlobalArgs.BATCH_MAX_BYTES,
+        max_age_ms=GlobalArgs.BATCH_MAX_AGE_MS,
+        max_retries=GlobalArgs.BATCH_MAX_RETRIES,
+        backoff_base_ms=GlobalArgs.BACKOFF_BASE_MS,
+        backoff_cap_ms=GlobalArgs.BACKOFF_CAP_MS,
+        deadline_margin_ms=GlobalArgs.DEADLINE_MARGIN_MS,
+        aggregator=None,
+        rate_controller=None,
+        metrics=None,
+        clock=time.monotonic,
+        sleep=time.sleep
+    ):
+        self.client = client
+        self.stream_name = stream_name
+        self.context = context
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age_ms = max_age_ms
+        self.max_retries = max_retries
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_cap_ms = backoff_cap_ms
+        self.deadline_margin_ms = deadline_margin_ms
+        self.aggregator = aggregator
+        self.rate_controller = rate_controller
+        self.metrics = metrics
+        if metrics is not None:
+            self._put_latency = metrics.histogram(
+                "PutRecordsLatency", LATENCY_BUCKETS_MS, "Milliseconds")
+            self._batch_records = metrics.histogram(
+                "PutRecordsBatchRecords", BATCH_RECORDS_BUCKETS, "Count")
+            self._batch_bytes = metrics.histogram(
+                "PutRecordsBatchBytes", BATCH_BYTES_BUCKETS, "Bytes")
+        self.clock = clock
+        self.sleep = sleep
+        # Read the remaining time once, the hot loop compares against the clock
+        self._stop_at = None
+        if context:
+            self._stop_at = clock() + \
+                (context.get_remaining_time_in_millis() - deadline_margin_ms) / 1000
+        self._buf = []
+        self._buf_bytes = 0
+        self._buf_started = None
+        self.stats = {
+            "put_calls": 0,
+            "user_records_in": 0,
+            "records_in": 0,
+            "records_sent": 0,
+            "records_retried": 0,
+            "records_failed": 0,
+            "records_rejected": 0,
+            "throttled_calls": 0,
+            "bytes_out": 0,
+        }
+
+    def put(self, data, key, explicit_hash_key=None):
+        """ Queue one user record, packing it into the aggregator when one is set """
+        self.stats["user_records_in"] += 1
+        if self._buf_started is None:
+            self._buf_started = self.clock()
+        if self.aggregator is None:
+            self._enqueue(data, key, explicit_hash_key)
+        else:
+            completed = self.aggregator.add(key, data, explicit_hash_key)
+            if completed:
+                self._enqueue(completed.data, completed.partition_key,
+                              completed.explicit_hash_key)
+        if (self.clock() - self._buf_started) * 1000 >= self.max_age_ms:
+            self.flush()
+
+    def _enqueue(self, data, key, explicit_hash_key=None):
+        """ Add one kinesis record to the batch, sending first if it would overflow """
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        rec_size = len(data) + len(key.encode("utf-8"))
+        if rec_size > GlobalArgs.MAX_BYTES_PER_RECORD:
+            logger.error(
+                '{"rejected_record_bytes":%d,"partition_key":"%s"}', rec_size, key)
+            self.stats["records_rejected"] += 1
+            return
+        self.stats["records_in"] += 1
+        if self._buf and self._buf_bytes + rec_size > self.max_bytes:
+            self._send()
+        entry = {"Data": data, "PartitionKey": key}
+        if explicit_hash_key is not None:
+            entry["ExplicitHashKey"] = explicit_hash_key
+        self._buf.append(entry)
+        self._buf_bytes += rec_size
+        if len(self._buf) >= self.max_records or self._buf_bytes >= self.max_bytes:
+            self._send()
+
+    def flush(self):
+        """ Drain the aggregator and send everything buffered """
+        if self.aggregator is not None:
+            completed = self.aggregator.flush()
+            while completed:
+                self._enqueue(completed.data, completed.partition_key,
+                              completed.explicit_hash_key)
+                completed = self.aggregator.flush()
+        self._send()
+        self._buf_started = None
+
+    def _send(self):
+        """ Ship the batch, retrying only the entries Kinesis rejected """
+        if not self._buf:
+            return
+        pending = self._buf
+        self.stats["bytes_out"] += self._buf_bytes
+        if self.metrics is not None:
+            self._batch_records.record(len(pending))
+            self._batch_bytes.record(self._buf_bytes)
+        self._buf = []
+        self._buf_bytes = 0
+        attempt = 0
+        while pending:
+            _t = self.clock()
+            try:
+                resp = self.client.put_records(
+                    Records=pending,
+                    StreamName=self.stream_name
+                )
+            except Exception as e:
+                # A throttled call is retried like a batch where every record failed
+                _code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                if _code not in GlobalArgs.THROTTLE_ERROR_CODES:
+                    raise
+                resp = None
+                self.stats["throttled_calls"] += 1
+            self.stats["put_calls"] += 1
+            if self.metrics is not None:
+                self._put_latency.record((self.clock() - _t) * 1000)
+            if self.rate_controller is not None:
+                self.rate_controller.on_result(
+                    pending, resp["Records"] if resp else None)
+            if resp is not None:
+                failed_count = resp.get("FailedRecordCount", 0)
+                self.stats["records_sent"] += len(pending) - failed_count
+                if not failed_count:
+                    break
+                pending = [
+                    r for r, res in zip(pending, resp["Records"]) if "ErrorCode" in res
+                ]
+            if attempt >= self.max_retries or not self._backoff(attempt):
+                logger.error(
+                    '{"failed_records":%d,"attempts":%d}', len(pending), attempt + 1)
+                self.stats["records_failed"] += len(pending)
+                break
+            self.stats["records_retried"] += len(pending)
+            attempt += 1
+
+    def _backoff(self, attempt):
+        """ Full jitter exponential backoff, refusing to sleep past the lambda deadline """
+        _cap = min(self.backoff_cap_ms, self.backoff_base_ms * (2 ** attempt))
+        _delay_ms = random.uniform(0, _cap)
+        if self._stop_at is not None and self.clock() + _delay_ms / 1000 > self._stop_at:
+            return False
+        self.sleep(_delay_ms / 1000)
+        return True
+
+    def time_to_stop(self):
+        """ True when the buffer must be drained before the lambda runs out of time """
+        return self._stop_at is not None and self.clock() >= self._stop_at
+
+
+def shard_hash_keys(client, stream_name):
+    """ An explicit hash key in the middle of each open shard's hash key range """
+    hash_keys = []
+    kwargs = {"StreamName": stream_name}
+    while True:
+        resp = client.list_shards(**kwargs)
+        for shard in resp["Shards"]:
+            # Closed shards, left behind by resharding, no longer accept writes
+            if "EndingSequenceNumber" in shard.get("SequenceNumberRange", {}):
+                continue
+            _range = shard["HashKeyRange"]
+            _start = int(_range["StartingHashKey"])
+            _end = int(_range["EndingHashKey"])
+            hash_keys.append(str((_start + _end) // 2))
+        if not resp.get("NextToken"):
+            return hash_keys
+        kwargs = {"NextToken": resp["NextToken"]}
+
+
+def _until(events, stop):
+    """ Events until stop() turns true """
+    for event in events:
+        if stop():
+            return
+        yield event
+
+
+def _produce(writer, hash_keys, events, pre_aggregator=None):
+    """
+    Queue events, or their partial aggregates, until the writer has to stop
+    or they run out, returns (records queued, sales)
+    """
+    record_count = 0
+    tot_sales = 0
+    _hk_count = len(hash_keys) if hash_keys else 0
+    rate = writer.rate_controller
+    # Decide once per run, not per event, whether the sampled debug lines can be emitted at all
+    _sample = LogSampler(GlobalArgs.LOG_SAMPLE_RATE) if logger.isEnabledFor(
+        logging.DEBUG) else None
+    _dumps = event_format.dumps
+    _event_ids = GlobalArgs.EVENT_IDS_ENABLED
+    records = _until(events, writer.time_to_stop)
+    if pre_aggregator is not None:
+        # Buckets still open when the writer stops are flushed, their events are already summed
+        records = itertools.chain(pre_aggregator.aggregate(records), pre_aggregator.flush())
+    for data in records:
+        if _event_ids and "event_id" not in data:
+            data["event_id"] = _gen_uuid()
+        # Serialized once, the same bytes are metered and sent, retries repeat the event_id
+        _payload = _dumps(data)
+        if _sample is not None and _sample():
+            logger.debug('{"data":%s}', lazy_json(data, GlobalArgs.LOG_MAX_CHARS))
+        _key = data.get("event_id") or _gen_uuid()
+        _shard = record_count % _hk_count if _hk_count else None
+        if rate is not None and _shard is not None:
+            rate.acquire(_shard, len(_payload) + len(_key))
+        writer.put(
+            _payload,
+            _key,
+            hash_keys[_shard] if _shard is not None else None
+        )
+        record_count += 1
+        tot_sales += data["sales"]
+    writer.flush()
+    return record_count, tot_sales
+
+
+def _load(writer_index):
+    """ The event source of one writer, seeded per writer so threads do not repeat each other """
+    if GlobalArgs.LOAD_REPLAY_PATH:
+        return replay_ndjson([GlobalArgs.LOAD_REPLAY_PATH], loop=True)
+    _categories = GlobalArgs.LOAD_CATEGORIES
+    return LoadGenerator(
+        seed=None if GlobalArgs.LOAD_SEED is None else f"{GlobalArgs.LOAD_SEED}-{writer_index}",
+        stores=GlobalArgs.LOAD_STORES,
+        categories=int(_categories) if _categories.isdigit() else _categories.split(","),
+        store_skew=GlobalArgs.LOAD_STORE_SKEW,
+        category_skew=GlobalArgs.LOAD_CATEGORY_SKEW,
+        customers=GlobalArgs.LOAD_CUSTOMERS,
+        products=GlobalArgs.LOAD_PRODUCTS,
+        # Partial aggregates get their own ids
+        event_ids=GlobalArgs.EVENT_IDS_ENABLED and not GlobalArgs.PRE_AGGREGATION_SECONDS,
+        jitter_ms=GlobalArgs.LOAD_JITTER_MS,
+        out_of_order_ratio=GlobalArgs.LOAD_OUT_OF_ORDER_RATIO,
+        max_delay_ms=GlobalArgs.LOAD_MAX_DELAY_MS
+    ).events()
 
 
 client = boto3.client(
-    "kinesis", region_name=GlobalArgs.STREAM_AWS_REGION)
+    "kinesis",
+    region_name=GlobalArgs.STREAM_AWS_REGION,
+    config=Config(max_pool_connections=max(
+        10, GlobalArgs.PRODUCER_CONCURRENCY))
+)
 
 
-def lambda_handler(event, context):
-    resp = {"status": False}
-    logger.info(f"Event: {json.dumps(event)}")
+def _new_metrics():
+    return Metrics(GlobalArgs.METRICS_NAMESPACE, {"ServiceName": GlobalArgs.MODULE_NAME})
+
 
-    _random_user_name = ["Aarakocra", "Aasimar", "Beholder", "Bugbear", "Centaur", "Changeling", "Deep Gnome", "Deva", "Dragonborn", "Drow", "Dwarf", "Eladrin", "Elf", "Firbolg", "Genasi", "Githzerai", "Gnoll", "Gnome", "Goblin", "Goliath", "Hag", "Half-Elf",
-                         "Half-Orc", "Halfling", "Hobgoblin", "Kalashtar", "Kenku", "Kobold", "Lizardfolk", "Loxodon", "Mind Flayer", "Minotaur", "Orc", "Shardmind", "Shifter", "Simic Hybrid", "Tabaxi", "Tiefling", "Tortle", "Triton", "Vedalken", "Warforged", "Wilden", "Yuan-Ti"]
+def _publish_metrics(writers, resp):
+    """ Merge the writer metrics with the invocation totals and print one EMF line """
+    metrics = _new_metrics()
+    for writer in writers:
+        if writer.metrics is not None:
+            metrics.merge(writer.metrics)
+    stats = resp.get("batch_stats", {})
+    metrics.counter("EventsGenerated", resp.get(
+        "events_aggregated", resp.get("record_count", 0)))
+    metrics.counter("RecordsSent", stats.get("records_sent", 0))
+    metrics.counter("RecordsRetried", stats.get("records_retried", 0))
+    metrics.counter("RecordsFailed", stats.get("records_failed", 0))
+    metrics.counter("ThrottledCalls", stats.get("throttled_calls", 0))
+    metrics.counter("BytesOut", stats.get("bytes_out", 0), "Bytes")
+    metrics.counter("InvocationErrors", 0 if resp["status"] else 1)
+    metrics.flush()
 
-    _random_category = ["Books", "Games", "Mobiles", "Groceries", "Shoes", "Stationaries", "Laptops",
-                        "Tablets", "Notebooks", "Camera", "Printers", "Monitors", "Speakers", "Projectors", "Cables", "Furniture"]
 
-    _random_category_01 = ["Books", "Electronics"]
+def _new_writer(context, hash_keys, share, utilization):
+    """ A batch writer for hash_keys, budgeted for share of the total target rate """
+    aggregator = None
+    if GlobalArgs.AGGREGATION_ENABLED:
+        # One aggregate per shard hash key, so every aggregate lands on the shard its records were meant for
+        aggregator = HashKeyAggregator(GlobalArgs.AGGREGATION_MAX_BYTES)
+    rate_controller = None
+    if GlobalArgs.RATE_CONTROL_ENABLED:
+        rate_controller = ShardRateController(
+            hash_keys,
+            target_events_per_s=GlobalArgs.TARGET_EVENTS_PER_S * share,
+            target_bytes_per_s=GlobalArgs.TARGET_BYTES_PER_S * share,
+            utilization=utilization,
+            count_records=not GlobalArgs.AGGREGATION_ENABLED
+        )
+    return KinesisBatchWriter(
+        client, GlobalArgs.STREAM_NAME, context,
+        aggregator=aggregator, rate_controller=rate_controller,
+        metrics=_new_metrics() if GlobalArgs.METRICS_ENABLED else None)
 
-    _t_limit = context.get_remaining_time_in_millis()
+
+def lambda_handler(event, context):
+    resp = {"status": False}
+    logger.info("Event: %s", lazy_json(event, GlobalArgs.LOG_MAX_CHARS))
+
+    concurrency = GlobalArgs.PRODUCER_CONCURRENCY
+    writers = []
     try:
-        record_count = 0
-        tot_sales = 0
-        while context.get_remaining_time_in_millis() > 100:
-            # _s = random.randint(1, 500)
-            _s = round(random.random() * 100, 2)
-            send_data(
-                client,
-                {
-                    "category": random.choice(_random_category_01),
-                    "store_id": f"store_{random.randint(1, 5)}",
-                    "evnt_time": datetime.datetime.now().isoformat(),
-                    "sales": _s
-                },
-                _gen_uuid(),
-                GlobalArgs.STREAM_NAME
-            )
-            record_count += 1
-            tot_sales += _s
-            logger.info(
-                f'{{"remaining_time":{context.get_remaining_time_in_millis()}}}')
-        resp["record_count"] = record_count
-        resp["tot_sales"] = tot_sales
+        # Spread the writers over the shards so every shard gets its own stream of batches
+        hash_keys = shard_hash_keys(client, GlobalArgs.STREAM_NAME)
+        writer_keys = [
+            hash_keys[i::concurrency] or [hash_keys[i % len(hash_keys)]]
+            for i in range(concurrency)
+        ]
+        # Writers sharing a shard split its budget
+        _sharing = max(1.0, concurrency / len(hash_keys))
+        writers = [
+            _new_writer(context, keys, len(keys) / len(hash_keys) / _sharing,
+                        GlobalArgs.SHARD_UTILIZATION / _sharing)
+            for keys in writer_keys
+        ]
+        loads = [_load(i) for i in range(concurrency)]
+        pre_aggregators = [
+            PreAggregator(GlobalArgs.PRE_AGGREGATION_SECONDS) if GlobalArgs.PRE_AGGREGATION_SECONDS else None
+            for _ in range(concurrency)
+        ]
+        if concurrency == 1:
+            results = [_produce(writers[0], writer_keys[0], loads[0], pre_aggregators[0])]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(
+                    _produce, writers, writer_keys, loads, pre_aggregators))
+        batch_stats = collections.Counter()
+        for writer in writers:
+            batch_stats.update(writer.stats)
+        resp["record_count"] = sum(r[0] for r in results)
+        resp["tot_sales"] = sum(r[1] for r in results)
+        if GlobalArgs.PRE_AGGREGATION_SECONDS:
+            resp["events_aggregated"] = sum(p.events_in for p in pre_aggregators)
+        resp["batch_stats"] = dict(batch_stats)
+        resp["writers"] = concurrency
+        if GlobalArgs.RATE_CONTROL_ENABLED:
+            resp["shard_rates"] = [
+                w.rate_controller.rates() for w in writers]
         resp["status"] = True
-        logger.info(f"resp: {json.dumps(resp)}")
+        logger.info("resp: %s", lazy_json(resp, None))
 
     except Exception as e:
         logger.error(f"ERROR:{str(e)}")
         resp["error_message"] = str(e)
 
+    if GlobalArgs.METRICS_ENABLED:
+        _publish_metrics(writers, resp)
+
     return {
         "statusCode": 200,
         "body": json.dumps({
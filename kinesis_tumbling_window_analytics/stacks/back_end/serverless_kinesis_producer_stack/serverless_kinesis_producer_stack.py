@@ -25,6 +25,10 @@ class ServerlessKinesisProducerStack(core.Stack):
         scope: core.Construct,
         construct_id: str,
         stack_log_level: str,
+        shard_count: int = 1,
+        producer_concurrency: int = 1,
+        pre_aggregation_seconds: float = 0,
+        record_format: str = "json",
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -35,7 +39,7 @@ class ServerlessKinesisProducerStack(core.Stack):
             self,
             "dataPipeStream",
             retention_period=core.Duration.hours(24),
-            shard_count=1,
+            shard_count=shard_count,
             stream_name=f"data_pipe_{construct_id}"
         )
 
@@ -45,16 +49,15 @@ class ServerlessKinesisProducerStack(core.Stack):
         #######                          #######
         ########################################
 
-        # Read Lambda Code
-        try:
-            with open("kinesis_tumbling_window_analytics/stacks/back_end/serverless_kinesis_producer_stack/lambda_src/stream_data_producer.py",
-                      encoding="utf-8",
-                      mode="r"
-                      ) as f:
-                data_producer_fn_code = f.read()
-        except OSError:
-            print("Unable to read Lambda Function Code")
-            raise
+        # Shared code for the lambda functions, KPL aggregation
+        stream_common_layer = _lambda.LayerVersion(
+            self,
+            "streamCommonLayer",
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/lambda_layers/stream_common"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_7],
+            description="Shared code for the stream producer, transformer and consumers"
+        )
 
         data_producer_fn = _lambda.Function(
             self,
@@ -62,16 +65,37 @@ class ServerlessKinesisProducerStack(core.Stack):
             function_name=f"data_producer_{construct_id}",
             description="Produce streaming data events and push to Kinesis stream",
             runtime=_lambda.Runtime.PYTHON_3_7,
-            code=_lambda.InlineCode(
-                data_producer_fn_code),
-            handler="index.lambda_handler",
+            # Code is larger than the 4KB inline limit, ship lambda_src as an asset
+            code=_lambda.Code.from_asset(
+                "kinesis_tumbling_window_analytics/stacks/back_end/serverless_kinesis_producer_stack/lambda_src"),
+            handler="stream_data_producer.lambda_handler",
+            layers=[stream_common_layer],
             timeout=core.Duration.seconds(60),
             reserved_concurrent_executions=1,
             environment={
                 "LOG_LEVEL": "INFO",
                 "STREAM_NAME": f"{self.data_pipe_stream.stream_name}",
                 "APP_ENV": "Production",
-                "STREAM_AWS_REGION": f"{core.Aws.REGION}"
+                "STREAM_AWS_REGION": f"{core.Aws.REGION}",
+                "BATCH_MAX_RECORDS": "500",
+                "BATCH_MAX_AGE_MS": "1000",
+                "DEADLINE_MARGIN_MS": "2000",
+                "AGGREGATION_ENABLED": "false",
+                "AGGREGATION_MAX_BYTES": "51200",
+                "PRODUCER_CONCURRENCY": f"{producer_concurrency}",
+                "RATE_CONTROL_ENABLED": "true",
+                "TARGET_EVENTS_PER_S": "0",
+                "TARGET_BYTES_PER_S": "0",
+                "SHARD_UTILIZATION": "0.95",
+                "LOAD_STORES": "5",
+                "LOAD_CATEGORIES": "Books,Electronics",
+                "LOAD_STORE_SKEW": "0",
+                "LOAD_CATEGORY_SKEW": "0",
+                "LOAD_CUSTOMERS": "0",
+                "LOAD_PRODUCTS": "0",
+                "EVENT_IDS_ENABLED": "true",
+                "PRE_AGGREGATION_SECONDS": f"{pre_aggregation_seconds}",
+                "RECORD_FORMAT": record_format
             }
         )
 